@@ -5,32 +5,59 @@ Railway Twilio Voice Assistant
 Real implementation with pipecat integration
 """
 
+from voice_assistant_startup import boot
+
 import os
 import asyncio
+from typing import Optional
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.websockets import WebSocket
 import uvicorn
 from dotenv import load_dotenv
 from loguru import logger
 
-# Import the official pipecat voice assistant
-from voice_assistant_official import bot as voice_bot, run_bot
-from pipecat.runner.types import RunnerArguments
-from pipecat.runner.utils import create_transport
-
 load_dotenv(override=True)
 
 app = FastAPI(title="Pipecat Twilio Voice Assistant")
 
-# Transport configuration from voice_assistant_official.py
-transport_params = {
-    "twilio": lambda: FastAPIWebsocketParams(
-        audio_in_enabled=True,
-        audio_out_enabled=True,
-        vad_analyzer=SileroVADAnalyzer(params=VADParams(stop_secs=0.2)),
-        turn_analyzer=LocalSmartTurnAnalyzerV3(params=SmartTurnParams()),
-    ),
-}
+# The pipecat stack is imported after the port is bound, in this order
+# (each entry is timed in the boot report)
+PRELOAD_IMPORTS = [
+    "pipecat.pipeline.task",
+    "voice_assistant_connections",
+    "voice_assistant_models",
+    "voice_assistant_official",
+]
+
+# How long a stream that arrives during the preload waits for it
+READY_WAIT_SECS = float(os.getenv("READY_WAIT_SECS", "15"))
+
+preload_task: Optional[asyncio.Task] = None
+
+
+async def preload(boot):
+    """Import the pipeline and load VAD and smart-turn models once before the first call."""
+    await boot.import_modules(PRELOAD_IMPORTS)
+
+    from voice_assistant_inference import inference_pool
+    from voice_assistant_models import analyzer_pool
+
+    await boot.step(
+        "vad_models",
+        analyzer_pool.warmup,
+        smart_turn=True,
+        reserve=int(os.getenv("VAD_POOL_RESERVE", "4")),
+        in_thread=True,
+    )
+    await boot.step("inference_pool", inference_pool.start, in_thread=True)
+
+@app.on_event("startup")
+async def start_preload():
+    """Run the preload in the background so uvicorn binds the port right away."""
+    global preload_task
+    boot.bound()
+    preload_task = asyncio.create_task(boot.run(preload))
 
 @app.get("/")
 async def root():
@@ -43,13 +70,32 @@ async def root():
 @app.get("/health")
 async def health_check():
     """Railway health check endpoint"""
+    if not boot.ready:
+        return {
+            "status": "failed" if boot.error else "starting",
+            "service": "pipecat-voice-assistant",
+            "transport": "twilio",
+            "boot": boot.stats(),
+        }
+
+    from voice_assistant_inference import inference_pool
+    from voice_assistant_models import analyzer_pool
+
     return {
         "status": "healthy",
         "service": "pipecat-voice-assistant",
         "transport": "twilio",
-        "endpoints": ["/", "/health", "/webhook/twilio"]
+        "endpoints": ["/", "/health", "/ready", "/webhook/twilio"],
+        "boot": boot.stats(),
+        "analyzer_pool": analyzer_pool.stats(),
+        "inference": inference_pool.stats(),
     }
 
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 only once the preload is done."""
+    return JSONResponse(boot.stats(), status_code=200 if boot.ready else 503)
+
 @app.post("/webhook/twilio")
 async def twilio_webhook():
     """Twilio webhook endpoint - starts voice assistant session"""
@@ -65,6 +111,15 @@ async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
     logger.info("WebSocket connection accepted for Twilio")
 
+    if not await boot.wait_ready(READY_WAIT_SECS):
+        logger.error("Preload not finished, closing WebSocket")
+        await websocket.close()
+        return
+
+    from pipecat.runner.types import RunnerArguments
+
+    from voice_assistant_official import bot as voice_bot
+
     try:
         # Create runner arguments for Twilio transport
         runner_args = RunnerArguments(
@@ -91,6 +146,7 @@ if __name__ == "__main__":
     logger.info("Available endpoints:")
     logger.info("  GET  / - Root endpoint")
     logger.info("  GET  /health - Health check")
+    logger.info("  GET  /ready - Readiness (after preload)")
     logger.info("  POST /webhook/twilio - Twilio webhook")
     logger.info("  WS   /ws - WebSocket for Twilio streams")
 
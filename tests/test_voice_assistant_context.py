@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+
+from pipecat.processors.aggregators.openai_llm_context import OpenAILLMContext
+
+from voice_assistant_context import SUMMARY_PREFIX, ContextBudget, ContextStats
+
+# 13 geschätzte Tokens pro Nachricht
+TEXT = "x" * 36
+
+
+class FakeLLM:
+    def __init__(self):
+        self.summaries = 0
+
+    async def run_inference(self, context):
+        self.summaries += 1
+        return "Anrufer möchte einen Rückruf."
+
+
+class FakeProcessor:
+    def create_task(self, coroutine):
+        return asyncio.create_task(coroutine)
+
+
+def turns(count: int):
+    messages = []
+    for _ in range(count):
+        messages.append({"role": "user", "content": TEXT})
+        messages.append({"role": "assistant", "content": TEXT})
+    return messages
+
+
+class TestContextBudget(unittest.IsolatedAsyncioTestCase):
+    def budget(self, context: OpenAILLMContext, llm: FakeLLM) -> ContextBudget:
+        budget = ContextBudget(context, llm, max_tokens=200, keep_turns=1, stats=ContextStats())
+        budget._processor = FakeProcessor()
+        return budget
+
+    async def test_summary_after_trim(self):
+        llm = FakeLLM()
+        context = OpenAILLMContext([{"role": "system", "content": TEXT}, *turns(6)])
+        budget = self.budget(context, llm)
+
+        # Über 75% des Budgets: Zusammenfassung im Hintergrund
+        budget.on_turn()
+        await budget._summary_task
+        self.assertEqual(llm.summaries, 1)
+
+        # Über dem Budget, bevor die Zusammenfassung eingesetzt wurde: kürzen
+        context.add_messages(turns(2))
+        budget.on_turn()
+        self.assertEqual(budget._stats.trimmed_turns, 1)
+
+        # Danach wird wieder zusammengefasst
+        self.assertIsNotNone(budget._summary_task)
+        await budget._summary_task
+        self.assertEqual(llm.summaries, 2)
+        budget.on_user_started()
+        self.assertEqual(budget._stats.summaries, 1)
+        self.assertTrue(context.get_messages()[1]["content"].startswith(SUMMARY_PREFIX))
+
+    async def test_trim_discards_running_summary(self):
+        llm = FakeLLM()
+        context = OpenAILLMContext([{"role": "system", "content": TEXT}, *turns(6)])
+        budget = self.budget(context, llm)
+
+        budget.on_turn()
+        running = budget._summary_task
+        context.add_messages(turns(2))
+        budget.on_turn()
+
+        # Die alte Zusammenfassung wird abgebrochen, eine neue läuft
+        summary_task = budget._summary_task
+        self.assertIsNot(summary_task, running)
+        await summary_task
+        self.assertTrue(running.cancelled())
+        budget.on_user_started()
+        self.assertEqual(budget._stats.summaries, 1)
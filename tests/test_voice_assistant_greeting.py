@@ -0,0 +1,26 @@
+import unittest
+from unittest import mock
+
+from voice_assistant_greeting import GreetingCache
+
+TEXT = "Hallo, wie kann ich helfen?"
+OPTIONS = {"api_key": "", "voice_id": "voice", "model": "model", "output_format": "ulaw_8000"}
+
+
+class TestGreetingCache(unittest.IsolatedAsyncioTestCase):
+    async def test_failed_render_backs_off(self):
+        cache = GreetingCache(retry_secs=60)
+        render = mock.AsyncMock(side_effect=Exception("Timeout"))
+        with mock.patch("voice_assistant_greeting.render_elevenlabs_audio", render):
+            self.assertIsNone(await cache.get(TEXT, **OPTIONS))
+            self.assertIsNone(await cache.get(TEXT, **OPTIONS))
+        self.assertEqual(render.await_count, 1)
+
+    async def test_render_retried_after_backoff(self):
+        cache = GreetingCache(retry_secs=0)
+        render = mock.AsyncMock(side_effect=[Exception("Timeout"), b"\xff" * 8000])
+        with mock.patch("voice_assistant_greeting.render_elevenlabs_audio", render):
+            self.assertIsNone(await cache.get(TEXT, **OPTIONS))
+            greeting = await cache.get(TEXT, **OPTIONS)
+        self.assertEqual(greeting.duration_secs, 1.0)
+        self.assertEqual(len(greeting.pcm), 16000)
@@ -0,0 +1,37 @@
+import unittest
+
+from voice_assistant_intents import (
+    DEFAULT_INTENTS,
+    IntentClassifier,
+    IntentFastPath,
+    IntentStats,
+)
+
+GREETING = "Hallo, hier ist Ellie von der Firma. Wie kann ich Ihnen helfen?"
+OPENING_HOURS = DEFAULT_INTENTS[0]
+
+
+class TestIntentFastPath(unittest.TestCase):
+    def setUp(self):
+        self.stats = IntentStats()
+        self.fast_path = IntentFastPath(IntentClassifier(DEFAULT_INTENTS), stats=self.stats)
+
+    def test_faq_after_llm_question(self):
+        messages = [
+            {"role": "assistant", "content": GREETING},
+            {"role": "user", "content": "Mein Abfluss ist verstopft."},
+            {"role": "assistant", "content": "Das klingt ärgerlich. Seit wann ist das so?"},
+            {"role": "user", "content": "Wann haben Sie geöffnet?"},
+        ]
+        self.assertIs(self.fast_path._match(messages), OPENING_HOURS)
+        self.assertEqual(self.stats.follow_ups, 0)
+
+    def test_reply_to_fixed_answer_goes_to_llm(self):
+        messages = [
+            {"role": "assistant", "content": GREETING},
+            {"role": "user", "content": "Wann haben Sie geöffnet?"},
+            {"role": "assistant", "content": OPENING_HOURS.answer},
+            {"role": "user", "content": "Haben Sie auch offen?"},
+        ]
+        self.assertIsNone(self.fast_path._match(messages))
+        self.assertEqual(self.stats.follow_ups, 1)
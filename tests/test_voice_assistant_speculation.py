@@ -0,0 +1,33 @@
+import unittest
+
+from pipecat.processors.aggregators.openai_llm_context import OpenAILLMContext
+
+from voice_assistant_context import estimate_tokens
+from voice_assistant_speculation import Speculation, SpeculationStats, SpeculativeLLM
+
+MESSAGES = [{"role": "system", "content": "Du bist ein freundlicher Telefonassistent."}]
+
+
+class TestSpeculativeLLM(unittest.IsolatedAsyncioTestCase):
+    async def test_discard_counts_prompt_tokens(self):
+        stats = SpeculationStats()
+        speculative = SpeculativeLLM(None, OpenAILLMContext(list(MESSAGES)), stats=stats)
+
+        # Verworfen, bevor ein einziges Token angekommen ist
+        speculation = Speculation("Wann haben Sie geöffnet", list(MESSAGES))
+        speculative._speculation = speculation
+        await speculative.skip_turn()
+
+        prompt = MESSAGES + [{"role": "user", "content": "Wann haben Sie geöffnet"}]
+        self.assertEqual(stats.misses, 1)
+        self.assertEqual(stats.wasted_tokens, estimate_tokens(prompt))
+
+    async def test_failed_replay_counts_prompt_and_completion(self):
+        stats = SpeculationStats()
+        speculative = SpeculativeLLM(None, OpenAILLMContext(list(MESSAGES)), stats=stats)
+
+        speculation = Speculation("Ich möchte einen Termin", list(MESSAGES))
+        speculation.token_count = 3
+        await speculative.replay_finished(speculation, failed=True)
+
+        self.assertEqual(stats.wasted_tokens, speculation.prompt_tokens + 3)
@@ -0,0 +1,23 @@
+import unittest
+
+from pipecat.frames.frames import InputAudioRawFrame
+from pipecat.processors.frame_processor import FrameDirection
+
+from voice_assistant_stt_gate import GatedDeepgramSTTService, STTGateStats
+
+
+def audio_frame() -> InputAudioRawFrame:
+    return InputAudioRawFrame(audio=b"\x00" * 320, sample_rate=8000, num_channels=1)
+
+
+class TestGatedDeepgramSTTService(unittest.IsolatedAsyncioTestCase):
+    async def test_audio_after_report_is_ignored(self):
+        stats = STTGateStats()
+        stt = GatedDeepgramSTTService(api_key="", stats=stats)
+        await stt.process_audio_frame(audio_frame(), FrameDirection.DOWNSTREAM)
+        self.assertEqual(stt.buffered_bytes, 320)
+
+        stt._report()
+        await stt.process_audio_frame(audio_frame(), FrameDirection.DOWNSTREAM)
+        self.assertIsNone(stt._preroll)
+        self.assertEqual(stats.stats()["calls"], 1)
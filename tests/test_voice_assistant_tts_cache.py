@@ -0,0 +1,69 @@
+import tempfile
+import unittest
+
+from pipecat.frames.frames import LLMFullResponseEndFrame, LLMFullResponseStartFrame, LLMTextFrame
+from pipecat.tests.utils import run_test
+
+from voice_assistant_chunking import ClauseTextAggregator
+from voice_assistant_tts_cache import PhraseTTSCache, TTSCacheProcessor
+
+
+class TestTTSCacheProcessor(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self._directory = tempfile.TemporaryDirectory()
+        self.cache = PhraseTTSCache(directory=self._directory.name, render_after=100)
+
+    async def asyncTearDown(self):
+        self._directory.cleanup()
+
+    def processor(self) -> TTSCacheProcessor:
+        return TTSCacheProcessor(
+            self.cache,
+            api_key="",
+            voice_id="voice",
+            model="model",
+            output_format="ulaw_8000",
+            aggregator=ClauseTextAggregator(),
+        )
+
+    async def test_miss_forwards_text_held_by_aggregator(self):
+        tokens = ["Das", " geht", " leider,", " aber", " wir", " rufen", " zurück."]
+        frames_to_send = [
+            LLMFullResponseStartFrame(),
+            *[LLMTextFrame(token) for token in tokens],
+            LLMFullResponseEndFrame(),
+        ]
+        expected_down_frames = [
+            LLMFullResponseStartFrame,
+            LLMTextFrame,  # "Das geht leider, aber"
+            LLMTextFrame,
+            LLMTextFrame,
+            LLMTextFrame,
+            LLMFullResponseEndFrame,
+        ]
+        down_frames, _ = await run_test(
+            self.processor(),
+            frames_to_send=frames_to_send,
+            expected_down_frames=expected_down_frames,
+        )
+        text = "".join(f.text for f in down_frames if isinstance(f, LLMTextFrame))
+        self.assertEqual(text, "".join(tokens))
+
+    async def test_miss_at_response_end_forwards_rest(self):
+        tokens = ["Gerne", " helfe", " ich,", " Ihnen"]
+        frames_to_send = [
+            LLMFullResponseStartFrame(),
+            *[LLMTextFrame(token) for token in tokens],
+            LLMFullResponseEndFrame(),
+        ]
+        expected_down_frames = [
+            LLMFullResponseStartFrame,
+            LLMTextFrame,
+            LLMFullResponseEndFrame,
+        ]
+        down_frames, _ = await run_test(
+            self.processor(),
+            frames_to_send=frames_to_send,
+            expected_down_frames=expected_down_frames,
+        )
+        self.assertEqual(down_frames[1].text, "".join(tokens))
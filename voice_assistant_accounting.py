@@ -0,0 +1,209 @@
+#
+# Ressourcenverbrauch pro Anruf (für /calls)
+#
+# CPU (nur mit CALL_CPU_ACCOUNTING=true): Jeder Schritt eines asyncio Tasks
+# läuft im Context, in dem der Task erstellt wurde. `attribute(usage)` setzt
+# vor dem Start der Pipeline eine ContextVar, alle Tasks, die pipecat für den
+# Anruf startet, erben sie. Ein Hook um asyncio Handle._run misst jeden
+# `sample_every`-ten Schritt mit time.thread_time() und rechnet ihn dem Anruf
+# hochgerechnet zu. Achtung: der Hook ersetzt Handle._run für den ganzen
+# Prozess, jeder Callback jedes Event Loops läuft dann durch ihn (ein Zähler
+# pro Schritt, auch außerhalb von Anrufen). Inferenz in Executor-Threads (VAD,
+# Smart Turn) zählt nicht dazu. Ohne den Hook oder mit einem Event Loop, der
+# nicht auf asyncio.BaseEventLoop aufbaut (z.B. uvloop), bleibt die CPU leer
+# (None).
+#
+# Puffer, Provider-Streams und Tasks werden erst beim Abfragen von /calls
+# erhoben: der Anruf meldet nur Funktionen an, die die Werte liefern.
+#
+
+"""Ressourcenverbrauch pro Anruf (für /calls)."""
+
+import asyncio
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from loguru import logger
+
+current_call: ContextVar[Optional["CallUsage"]] = ContextVar("current_call", default=None)
+
+
+class CallUsage:
+    """Verbrauch eines Anrufs, Puffer und Streams werden beim Abfragen gelesen."""
+
+    def __init__(self, call_sid: str):
+        """Neuer Anruf, Startzeit ist jetzt."""
+        self.call_sid = call_sid
+        self.started = time.time()
+        self.cpu_secs = 0.0
+        self._buffers: Dict[str, Callable[[], int]] = {}
+        self._streams: Dict[str, Callable[[], bool]] = {}
+        self._task_owner: Any = None
+
+    def track_buffer(self, name: str, live_bytes: Callable[[], int]):
+        """Funktion anmelden, die die Bytes eines Puffers liefert."""
+        self._buffers[name] = live_bytes
+
+    def track_stream(self, name: str, is_open: Callable[[], bool]):
+        """Funktion anmelden, die meldet, ob ein Provider-Stream offen ist."""
+        self._streams[name] = is_open
+
+    def track_tasks(self, processor: Any):
+        """Tasks über den Task Manager der Pipeline eines Prozessors zählen."""
+        self._task_owner = processor
+
+    def _tasks(self) -> Optional[int]:
+        try:
+            return sum(
+                1 for task in self._task_owner.task_manager.current_tasks() if not task.done()
+            )
+        except Exception:
+            return None
+
+    def snapshot(self, *, cpu_enabled: bool = True) -> Dict[str, Any]:
+        """Aktueller Verbrauch des Anrufs, CPU nur mit aktivem Hook."""
+        duration = time.time() - self.started
+        buffers = {}
+        for name, live_bytes in self._buffers.items():
+            try:
+                buffers[name] = live_bytes()
+            except Exception as e:
+                logger.debug(f"{self.call_sid}: Puffer {name} nicht lesbar: {e}")
+        streams = {}
+        for name, is_open in self._streams.items():
+            try:
+                streams[name] = bool(is_open())
+            except Exception:
+                streams[name] = False
+        return {
+            "call_sid": self.call_sid,
+            "duration_secs": round(duration, 1),
+            "cpu_ms": round(self.cpu_secs * 1000, 1) if cpu_enabled else None,
+            "cpu_share": round(self.cpu_secs / duration, 4)
+            if cpu_enabled and duration > 0
+            else None,
+            "buffer_bytes": buffers,
+            "live_bytes": sum(buffers.values()),
+            "provider_streams": sum(streams.values()),
+            "streams": streams,
+            "tasks": self._tasks(),
+        }
+
+
+class CallAccounting:
+    """Prozessweite Liste der laufenden Anrufe und der CPU Hook."""
+
+    def __init__(self, *, cpu_sampling: bool = False, sample_every: int = 10):
+        """CPU Hook nur mit cpu_sampling, gemessen wird jeder sample_every-te Schritt."""
+        self._cpu_sampling = cpu_sampling
+        self._sample_every = max(1, sample_every)
+        self._calls: Dict[str, CallUsage] = {}
+        self._steps = 0
+        self._installed = False
+        self.finished_calls = 0
+        self.cpu_secs_finished = 0.0
+
+    def install(self):
+        """CPU Hook installieren, falls aktiviert (im Startup des Workers, gilt prozessweit)."""
+        if not self._cpu_sampling or self._installed:
+            return
+        if not isinstance(asyncio.get_running_loop(), asyncio.BaseEventLoop):
+            return
+        self._installed = True
+        run = asyncio.events.Handle._run
+        accounting = self
+
+        def _run(handle):
+            accounting._steps += 1
+            if accounting._steps % accounting._sample_every:
+                return run(handle)
+            usage = handle._context.get(current_call)
+            if usage is None:
+                return run(handle)
+            started = time.thread_time()
+            try:
+                return run(handle)
+            finally:
+                usage.cpu_secs += (time.thread_time() - started) * accounting._sample_every
+
+        asyncio.events.Handle._run = _run
+
+    def start_call(self, call_sid: str) -> CallUsage:
+        """Anruf in die Liste aufnehmen."""
+        usage = CallUsage(call_sid)
+        self._calls[call_sid] = usage
+        return usage
+
+    @contextmanager
+    def attribute(self, usage: CallUsage):
+        """Alles, was im Block (und in dort gestarteten Tasks) läuft, zählt für den Anruf."""
+        token = current_call.set(usage)
+        try:
+            yield usage
+        finally:
+            current_call.reset(token)
+
+    def end_call(self, usage: CallUsage):
+        """Anruf austragen und seine CPU Zeit in die Summe übernehmen."""
+        if self._calls.pop(usage.call_sid, None) is usage:
+            self.finished_calls += 1
+            self.cpu_secs_finished += usage.cpu_secs
+
+    def snapshot(self) -> List[Dict[str, Any]]:
+        """Verbrauch aller laufenden Anrufe (für /calls)."""
+        cpu_enabled = self._installed
+        return [usage.snapshot(cpu_enabled=cpu_enabled) for usage in self._calls.values()]
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        return {
+            "active_calls": len(self._calls),
+            "finished_calls": self.finished_calls,
+            "cpu_sampling": self._installed,
+            "sample_every": self._sample_every,
+            "avg_cpu_ms_per_call": (
+                round(self.cpu_secs_finished / self.finished_calls * 1000, 1)
+                if self._installed and self.finished_calls
+                else None
+            ),
+        }
+
+
+def context_bytes(messages: List[Any]) -> int:
+    """Größe der LLM Nachrichten als JSON (UTF-8)."""
+    return sum(
+        len(json.dumps(m, ensure_ascii=False, default=str).encode("utf-8")) for m in messages
+    )
+
+
+def output_audio_bytes(output: Any) -> int:
+    """Audio, das im Output Transport auf die Wiedergabe wartet (Queue und Puffer)."""
+    total = 0
+    for sender in getattr(output, "_media_senders", {}).values():
+        total += len(getattr(sender, "_audio_buffer", b""))
+        audio_queue = getattr(sender, "_audio_queue", None)
+        for frame in getattr(audio_queue, "_queue", ()):
+            total += len(getattr(frame, "audio", b""))
+    return total
+
+
+def deepgram_open(connection: Any) -> bool:
+    """Live Verbindung zu Deepgram offen (is_connected() des SDK ist async)."""
+    return getattr(connection, "_socket", None) is not None
+
+
+def websocket_open(websocket: Any) -> bool:
+    """WebSocket zu Twilio noch offen."""
+    state = getattr(websocket, "state", None)
+    return state is not None and getattr(state, "name", "") == "OPEN"
+
+
+# Eine Liste pro Prozess, wird von allen Anrufen geteilt
+call_accounting = CallAccounting(
+    cpu_sampling=os.getenv("CALL_CPU_ACCOUNTING", "false").lower() == "true",
+    sample_every=int(os.getenv("CALL_CPU_SAMPLE_EVERY", "10")),
+)
@@ -0,0 +1,584 @@
+#
+# Archiv der Anrufe: Transkript und (optional) Audio für die Qualitätskontrolle
+#
+# Bisher bleibt von einem Anruf nur, was zufällig im Log steht. Direkt aus der
+# Pipeline auf die Platte zu schreiben würde Disk I/O in den Audio Loop holen.
+# Stattdessen:
+#
+#   - zwei Abgriffe pro Anruf schreiben nur in den Speicher: vor dem User
+#     Aggregator (Transkript und Audio des Anrufers) und hinter dem Output
+#     Transport (Text und Audio von Ellie, so wie es abgespielt wurde)
+#   - Audio liegt als μ-law in einem Ringpuffer pro Spur (`buffer_secs`),
+#     Lücken in Ellies Spur werden mit Stille gefüllt, damit beide Spuren
+#     ab Anrufbeginn gleich lang sind
+#   - ein Task sammelt jede `flush_secs` die Puffer aller Anrufe ein und
+#     übergibt sie einer begrenzten Queue, ein Thread komprimiert (zlib) und
+#     hängt sie an Segment-Dateien an
+#   - ist die Queue voll, bleibt das Audio im Ringpuffer, der dann die ältesten
+#     Bytes überschreibt (gezählt als `dropped_bytes`). Die Pipeline wartet nie.
+#
+# Format (nur anhängen): `<start>-<pid>-<nr>.seg` enthält Records aus Header
+# (RECORD_HEADER), CallSid und zlib Payload. Daneben `.idx` mit einem festen
+# Eintrag (INDEX_ENTRY) pro Record: CallSid, Art, Zeitstempel, Offset, Länge.
+# Ältere Segmente werden nach `retention_secs` bzw. über `max_bytes` gelöscht.
+#
+# Anruf exportieren (Transkript und WAV pro Spur):
+#   python voice_assistant_archive.py CA123... --out export/
+#
+
+"""Archiv der Anrufe: Transkript und (optional) Audio für die Qualitätskontrolle."""
+
+import argparse
+import asyncio
+import audioop
+import glob
+import json
+import os
+import queue
+import struct
+import threading
+import time
+import wave
+import zlib
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from loguru import logger
+from pipecat.frames.frames import (
+    AudioRawFrame,
+    BotStoppedSpeakingFrame,
+    Frame,
+    InputAudioRawFrame,
+    InterruptionFrame,
+    TranscriptionFrame,
+    TTSAudioRawFrame,
+    TTSTextFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+from voice_assistant_memory import AudioRing, buffer_pool
+
+ARCHIVE_SAMPLE_RATE = 8000
+
+KIND_TRANSCRIPT = 0
+KIND_CALLER_AUDIO = 1
+KIND_BOT_AUDIO = 2
+KIND_NAMES = {KIND_TRANSCRIPT: "transcript", KIND_CALLER_AUDIO: "caller", KIND_BOT_AUDIO: "bot"}
+
+# Magic, Art, Länge der CallSid, Zeitstempel (Unix), Länge unkomprimiert, Länge komprimiert
+RECORD_HEADER = struct.Struct("<4sBHdII")
+RECORD_MAGIC = b"VAR1"
+
+# CallSid (Twilio: 34 Zeichen), Art, Zeitstempel, Offset im Segment, Länge des Records
+INDEX_ENTRY = struct.Struct("<34sBdQI")
+
+ULAW_SILENCE = b"\xff"
+
+
+@dataclass
+class ArchiveRecord:
+    """Ein Eintrag im Archiv: Audio einer Spur oder Transkript als JSON."""
+
+    call_sid: str
+    kind: int
+    timestamp: float  # Unix Zeit des ersten Bytes bzw. Eintrags
+    payload: bytes
+    collected_at: float  # monotonic, für die Archiv-Verzögerung
+
+
+class CallRecorder:
+    """Speicherpuffer eines Anrufs, gefüllt von den beiden Pipeline-Abgriffen."""
+
+    def __init__(self, call_sid: str, *, audio: bool, buffer_secs: float):
+        """Mit audio=False nur Transkript, Audio wird buffer_secs lang gepuffert."""
+        self.call_sid = call_sid
+        self.closed = False
+        self._audio = audio
+        self._capacity = int(buffer_secs * ARCHIVE_SAMPLE_RATE)
+        self._started = time.time()
+        self._transcript: List[Dict[str, Any]] = []
+        self._assistant_words: List[str] = []
+        self._assistant_started: Optional[float] = None
+
+        # Pro Spur: Ringpuffer und Position (Bytes seit Anrufbeginn) des ersten Bytes darin
+        self._rings: Dict[int, AudioRing] = {}
+        self._written: Dict[int, int] = {KIND_CALLER_AUDIO: 0, KIND_BOT_AUDIO: 0}
+        self._drained: Dict[int, int] = {KIND_CALLER_AUDIO: 0, KIND_BOT_AUDIO: 0}
+        self.dropped_bytes = 0
+        self.skipped_frames = 0
+
+    @property
+    def buffered_bytes(self) -> int:
+        """Noch nicht geschriebenes Audio in den Ringpuffern."""
+        return sum(len(ring) for ring in self._rings.values())
+
+    def input_tap(self) -> "ArchiveTap":
+        """Prozessor für das Audio des Anrufers (nach dem Input Transport)."""
+        return ArchiveTap(self, output=False)
+
+    def output_tap(self) -> "ArchiveTap":
+        """Prozessor für das Audio des Bots (vor dem Output Transport)."""
+        return ArchiveTap(self, output=True)
+
+    def caller_said(self, text: str):
+        """Finales Transkript des Anrufers festhalten."""
+        self._transcript.append({"t": time.time(), "role": "caller", "text": text})
+
+    def assistant_word(self, text: str):
+        """Gesprochenes Wort des Bots anhängen."""
+        if self._assistant_started is None:
+            self._assistant_started = time.time()
+        self._assistant_words.append(text)
+
+    def assistant_done(self, *, interrupted: bool):
+        """Antwort des Bots abschließen, auch wenn sie unterbrochen wurde."""
+        if not self._assistant_words:
+            return
+        entry = {
+            "t": self._assistant_started,
+            "role": "assistant",
+            "text": " ".join(self._assistant_words),
+        }
+        if interrupted:
+            entry["interrupted"] = True
+        self._transcript.append(entry)
+        self._assistant_words = []
+        self._assistant_started = None
+
+    def audio(self, kind: int, frame: AudioRawFrame):
+        """Audio Frame einer Spur puffern, Lücken werden mit Stille gefüllt."""
+        if not self._audio:
+            return
+        if frame.sample_rate != ARCHIVE_SAMPLE_RATE or frame.num_channels != 1:
+            self.skipped_frames += 1
+            return
+        ring = self._rings.get(kind)
+        if ring is None:
+            ring = self._rings[kind] = AudioRing(buffer_pool, self._capacity)
+        ulaw = audioop.lin2ulaw(frame.audio, 2)
+        if kind == KIND_BOT_AUDIO:
+            # Ellie spricht nicht durchgehend: Pausen (ab 100ms, damit Jitter der
+            # Wiedergabe keine Lücken in Sätze reißt) mit Stille füllen, höchstens ein Puffer
+            now_offset = int((time.time() - self._started) * ARCHIVE_SAMPLE_RATE) - len(ulaw)
+            gap = now_offset - self._written[kind]
+            if gap > ARCHIVE_SAMPLE_RATE // 10:
+                self._fill_gap(kind, ring, gap, len(ulaw))
+        self._write(kind, ring, ulaw)
+
+    def _fill_gap(self, kind: int, ring: AudioRing, gap: int, incoming: int):
+        """Stille für eine Pause, was nicht in den Puffer passt, wird übersprungen."""
+        if gap + incoming > self._capacity - len(ring):
+            # Der Puffer würde ohnehin überschrieben: Rest verwerfen, und was auch
+            # in einen leeren Puffer nicht passt, nur in der Position vorrücken
+            pending = len(ring.read())
+            fill = max(0, min(gap, self._capacity - incoming))
+            skipped = gap - fill
+            self.dropped_bytes += pending + skipped
+            self._written[kind] += skipped
+            self._drained[kind] = self._written[kind]
+            gap = fill
+        if gap:
+            self._write(kind, ring, ULAW_SILENCE * gap)
+
+    def _write(self, kind: int, ring: AudioRing, data: bytes):
+        dropped = ring.write(data)
+        self._written[kind] += len(data)
+        if dropped:
+            self.dropped_bytes += dropped
+            self._drained[kind] += dropped
+
+    def drain(self) -> List[ArchiveRecord]:
+        """Nimmt alles Gepufferte als Records heraus (auf dem Event Loop, nur Speicher)."""
+        collected_at = time.monotonic()
+        if self.closed:
+            self.assistant_done(interrupted=False)
+        records = []
+        if self._transcript:
+            transcript, self._transcript = self._transcript, []
+            payload = json.dumps(transcript, ensure_ascii=False).encode("utf-8")
+            records.append(
+                ArchiveRecord(
+                    self.call_sid, KIND_TRANSCRIPT, transcript[0]["t"], payload, collected_at
+                )
+            )
+        for kind, ring in self._rings.items():
+            if not len(ring):
+                continue
+            timestamp = self._started + self._drained[kind] / ARCHIVE_SAMPLE_RATE
+            payload = ring.read()
+            self._drained[kind] += len(payload)
+            records.append(ArchiveRecord(self.call_sid, kind, timestamp, payload, collected_at))
+        return records
+
+    def release(self):
+        """Puffer zurückgeben, ungeschriebenes Audio zählt als verworfen."""
+        for ring in self._rings.values():
+            self.dropped_bytes += len(ring)
+            ring.close()
+        self._rings.clear()
+
+
+class ArchiveTap(FrameProcessor):
+    """Pipeline-Abgriff: kopiert Transkript und Audio in den CallRecorder, sonst nichts."""
+
+    def __init__(self, recorder: CallRecorder, *, output: bool, **kwargs):
+        """output=True für die Spur des Bots."""
+        super().__init__(**kwargs)
+        self._recorder = recorder
+        self._output = output
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        """Audio und Transkripte an den Recorder geben, Frames laufen unverändert weiter."""
+        await super().process_frame(frame, direction)
+
+        if direction == FrameDirection.DOWNSTREAM:
+            recorder = self._recorder
+            if not self._output:
+                if isinstance(frame, InputAudioRawFrame):
+                    recorder.audio(KIND_CALLER_AUDIO, frame)
+                elif isinstance(frame, TranscriptionFrame) and frame.text.strip():
+                    recorder.caller_said(frame.text)
+            elif isinstance(frame, TTSAudioRawFrame):
+                recorder.audio(KIND_BOT_AUDIO, frame)
+            elif isinstance(frame, TTSTextFrame):
+                recorder.assistant_word(frame.text)
+            elif isinstance(frame, BotStoppedSpeakingFrame):
+                recorder.assistant_done(interrupted=False)
+            elif isinstance(frame, InterruptionFrame):
+                recorder.assistant_done(interrupted=True)
+
+        await self.push_frame(frame, direction)
+
+
+class SegmentWriter:
+    """Schreibt Records in Segment- und Index-Dateien (nur im Writer Thread)."""
+
+    def __init__(
+        self,
+        directory: str,
+        *,
+        segment_bytes: int,
+        max_bytes: int,
+        retention_secs: float,
+        compression_level: int = 6,
+    ):
+        """Segmente bis segment_bytes, insgesamt höchstens max_bytes auf der Platte."""
+        self._directory = directory
+        self._segment_bytes = segment_bytes
+        self._max_bytes = max_bytes
+        self._retention_secs = retention_secs
+        self._compression_level = compression_level
+        self._prefix = f"{int(time.time())}-{os.getpid()}"
+        self._number = 0
+        self._segment = None
+        self._index = None
+        self._offset = 0
+        self.segments = 0
+        self.bytes_written = 0
+        self.raw_bytes = 0
+        self.deleted_segments = 0
+
+    def write(self, records: List[ArchiveRecord]):
+        """Datensätze ans aktuelle Segment anhängen und im Index eintragen."""
+        if self._segment is None or self._offset >= self._segment_bytes:
+            self._rotate()
+        chunks = []
+        entries = []
+        offset = self._offset
+        for record in records:
+            call_sid = record.call_sid.encode("utf-8")
+            payload = zlib.compress(record.payload, self._compression_level)
+            header = RECORD_HEADER.pack(
+                RECORD_MAGIC,
+                record.kind,
+                len(call_sid),
+                record.timestamp,
+                len(record.payload),
+                len(payload),
+            )
+            length = len(header) + len(call_sid) + len(payload)
+            chunks += (header, call_sid, payload)
+            entries.append(
+                INDEX_ENTRY.pack(call_sid[:34], record.kind, record.timestamp, offset, length)
+            )
+            offset += length
+            self.raw_bytes += len(record.payload)
+        # Erst das Segment, dann der Index: ein Index-Eintrag zeigt nie ins Leere
+        self._segment.write(b"".join(chunks))
+        self._segment.flush()
+        self._index.write(b"".join(entries))
+        self._index.flush()
+        self.bytes_written += offset - self._offset
+        self._offset = offset
+
+    def _rotate(self):
+        self.close()
+        os.makedirs(self._directory, exist_ok=True)
+        self._number += 1
+        base = os.path.join(self._directory, f"{self._prefix}-{self._number:06d}")
+        self._segment = open(base + ".seg", "ab")
+        self._index = open(base + ".idx", "ab")
+        self._offset = self._segment.tell()
+        self.segments += 1
+        self._enforce_retention()
+
+    def _enforce_retention(self):
+        # Älteste zuerst. Andere Worker schreiben ggf. noch in ein gelöschtes
+        # Segment weiter, das nur bei sehr kleinem `max_bytes` passiert.
+        segments = sorted(glob.glob(os.path.join(self._directory, "*.seg")), key=os.path.getmtime)
+        current = self._segment.name if self._segment else None
+        sizes = {path: os.path.getsize(path) for path in segments}
+        total = sum(sizes.values())
+        now = time.time()
+        for path in segments:
+            if path == current:
+                continue
+            expired = now - os.path.getmtime(path) > self._retention_secs
+            if not expired and total <= self._max_bytes:
+                break
+            try:
+                os.remove(path)
+                os.remove(path[: -len(".seg")] + ".idx")
+            except FileNotFoundError:
+                pass
+            total -= sizes[path]
+            self.deleted_segments += 1
+
+    def close(self):
+        """Segment und Index schließen."""
+        for file in (self._segment, self._index):
+            if file:
+                file.close()
+        self._segment = self._index = None
+
+
+class CallArchive:
+    """Prozessweites Archiv: Recorder pro Anruf, Sammel-Task und Writer Thread."""
+
+    def __init__(
+        self,
+        *,
+        enabled: bool = False,
+        audio: bool = False,
+        directory: str = "call_archive",
+        buffer_secs: float = 8.0,
+        flush_secs: float = 1.0,
+        max_queue: int = 256,
+        segment_bytes: int = 64 * 1024 * 1024,
+        max_bytes: int = 1024 * 1024 * 1024,
+        retention_secs: float = 7 * 86400,
+    ):
+        """Ohne enabled wird nichts geschrieben, Segmente rotieren bei segment_bytes."""
+        self.enabled = enabled
+        self._audio = audio
+        self._buffer_secs = buffer_secs
+        self._flush_secs = flush_secs
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._writer = SegmentWriter(
+            directory,
+            segment_bytes=segment_bytes,
+            max_bytes=max_bytes,
+            retention_secs=retention_secs,
+        )
+        self._recorders: Dict[str, CallRecorder] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+
+        self.calls = 0
+        self.records_written = 0
+        self.skipped_collections = 0
+        self.dropped_bytes = 0
+        self.write_errors = 0
+        self._lag_secs = 0.0
+        self._max_lag_secs = 0.0
+
+    def recorder(self, call_sid: str) -> Optional[CallRecorder]:
+        """Recorder für einen neuen Anruf (None, wenn das Archiv aus ist)."""
+        if not self.enabled:
+            return None
+        self._start()
+        recorder = CallRecorder(call_sid, audio=self._audio, buffer_secs=self._buffer_secs)
+        self._recorders[call_sid] = recorder
+        self.calls += 1
+        return recorder
+
+    def call_ended(self, recorder: Optional[CallRecorder]):
+        """Der Rest wird beim nächsten Sammeln geschrieben."""
+        if recorder:
+            recorder.closed = True
+
+    def _start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._collect_loop())
+        if self._thread is None:
+            self._thread = threading.Thread(
+                target=self._write_loop, name="call-archive", daemon=True
+            )
+            self._thread.start()
+
+    async def _collect_loop(self):
+        while True:
+            await asyncio.sleep(self._flush_secs)
+            self._collect()
+
+    def _collect(self):
+        for call_sid, recorder in list(self._recorders.items()):
+            if self._queue.full():
+                # Writer hängt hinterher: Daten bleiben im Ringpuffer, die Pipeline merkt nichts
+                self.skipped_collections += 1
+                return
+            records = recorder.drain()
+            if records:
+                self._queue.put_nowait(records)
+            if recorder.closed:
+                recorder.release()
+                self.dropped_bytes += recorder.dropped_bytes
+                del self._recorders[call_sid]
+
+    def _write_loop(self):
+        stopping = False
+        while not stopping:
+            batch = self._queue.get()
+            if batch is None:
+                return
+            # Alles, was schon wartet, in einem Rutsch schreiben
+            while True:
+                try:
+                    more = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if more is None:
+                    stopping = True
+                    break
+                batch += more
+            try:
+                self._writer.write(batch)
+                self.records_written += len(batch)
+            except Exception as e:
+                self.write_errors += 1
+                logger.error(f"Archiv: {len(batch)} Records nicht geschrieben: {e}")
+            self._lag_secs = (
+                time.monotonic() - min(record.collected_at for record in batch) + self._flush_secs
+            )
+            self._max_lag_secs = max(self._max_lag_secs, self._lag_secs)
+
+    async def stop(self):
+        """Letzte Daten einsammeln und schreiben (beim Herunterfahren)."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        for recorder in self._recorders.values():
+            recorder.closed = True
+        self._collect()
+        if self._thread:
+            await asyncio.to_thread(self._queue.put, None)
+            await asyncio.to_thread(self._thread.join, 5.0)
+            self._thread = None
+        self._writer.close()
+
+    def stats(self) -> Dict[str, Any]:
+        """Zähler für /health."""
+        return {
+            "enabled": self.enabled,
+            "audio": self._audio,
+            "calls": self.calls,
+            "active_calls": len(self._recorders),
+            "queue_depth": self._queue.qsize(),
+            "records_written": self.records_written,
+            "bytes_written": self._writer.bytes_written,
+            "raw_bytes": self._writer.raw_bytes,
+            "segments": self._writer.segments,
+            "deleted_segments": self._writer.deleted_segments,
+            "lag_secs": round(self._lag_secs, 3),
+            "max_lag_secs": round(self._max_lag_secs, 3),
+            "skipped_collections": self.skipped_collections,
+            "dropped_bytes": self.dropped_bytes
+            + sum(recorder.dropped_bytes for recorder in self._recorders.values()),
+            "write_errors": self.write_errors,
+        }
+
+
+def iter_call_records(directory: str, call_sid: str) -> Iterator[Tuple[int, float, bytes]]:
+    """(Art, Zeitstempel, Payload) aller Records eines Anrufs, über den Index gesucht."""
+    wanted = call_sid.encode("utf-8")[:34].ljust(34, b"\0")
+    for index_path in sorted(glob.glob(os.path.join(directory, "*.idx"))):
+        with open(index_path, "rb") as index:
+            entries = [
+                entry for entry in INDEX_ENTRY.iter_unpack(index.read()) if entry[0] == wanted
+            ]
+        if not entries:
+            continue
+        with open(index_path[: -len(".idx")] + ".seg", "rb") as segment:
+            for _, kind, timestamp, offset, length in entries:
+                segment.seek(offset)
+                data = segment.read(length)
+                magic, _, sid_length, _, raw_length, _ = RECORD_HEADER.unpack_from(data)
+                if magic != RECORD_MAGIC:
+                    raise ValueError(f"Kein Archiv-Record in {index_path} bei Offset {offset}")
+                payload = zlib.decompress(data[RECORD_HEADER.size + sid_length :])
+                yield kind, timestamp, payload
+
+
+def export_call(directory: str, call_sid: str, out: str) -> List[str]:
+    """Schreibt Transkript (JSON) und eine WAV Datei pro Spur, gibt die Pfade zurück."""
+    records = list(iter_call_records(directory, call_sid))
+    # Audio Records beginnen bei Anrufbeginn plus ihrer Position in der Spur,
+    # der früheste Record ist damit der gemeinsame Anfang beider Spuren
+    started = min((timestamp for _, timestamp, _ in records), default=0.0)
+    transcript: List[Dict[str, Any]] = []
+    audio: Dict[int, bytearray] = {KIND_CALLER_AUDIO: bytearray(), KIND_BOT_AUDIO: bytearray()}
+    for kind, timestamp, payload in records:
+        if kind == KIND_TRANSCRIPT:
+            transcript += json.loads(payload)
+            continue
+        # Verworfenes Audio (voller Puffer, übersprungene Pausen) als Stille,
+        # damit beide Spuren synchron bleiben
+        track = audio[kind]
+        offset = round((timestamp - started) * ARCHIVE_SAMPLE_RATE)
+        if offset > len(track):
+            track += ULAW_SILENCE * (offset - len(track))
+        track += payload
+    length = max(len(track) for track in audio.values())
+    for track in audio.values():
+        if track:
+            track += ULAW_SILENCE * (length - len(track))
+
+    os.makedirs(out, exist_ok=True)
+    paths = []
+    path = os.path.join(out, f"{call_sid}-transcript.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(transcript, f, ensure_ascii=False, indent=2)
+    paths.append(path)
+    for kind, track in audio.items():
+        if not track:
+            continue
+        path = os.path.join(out, f"{call_sid}-{KIND_NAMES[kind]}.wav")
+        with wave.open(path, "wb") as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(ARCHIVE_SAMPLE_RATE)
+            f.writeframes(audioop.ulaw2lin(bytes(track), 2))
+        paths.append(path)
+    return paths
+
+
+# Ein Archiv pro Prozess, wird von allen Anrufen geteilt
+call_archive = CallArchive(
+    enabled=os.getenv("CALL_ARCHIVE", "false").lower() == "true",
+    audio=os.getenv("CALL_ARCHIVE_AUDIO", "false").lower() == "true",
+    directory=os.getenv("CALL_ARCHIVE_DIR", "call_archive"),
+    buffer_secs=float(os.getenv("CALL_ARCHIVE_BUFFER_SECS", "8")),
+    segment_bytes=int(os.getenv("CALL_ARCHIVE_SEGMENT_MB", "64")) * 1024 * 1024,
+    max_bytes=int(os.getenv("CALL_ARCHIVE_MAX_MB", "1024")) * 1024 * 1024,
+    retention_secs=float(os.getenv("CALL_ARCHIVE_RETENTION_DAYS", "7")) * 86400,
+)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Anruf aus dem Archiv exportieren")
+    parser.add_argument("call_sid")
+    parser.add_argument("--dir", default=os.getenv("CALL_ARCHIVE_DIR", "call_archive"))
+    parser.add_argument("--out", default=".")
+    args = parser.parse_args()
+    for path in export_call(args.dir, args.call_sid, args.out):
+        print(path)
@@ -0,0 +1,83 @@
+#
+# Sofortiger Barge-in: Ausgabe leeren, sobald der Anrufer Ellie unterbricht
+#
+# Pipecat unterbricht erst, wenn die InterruptionFrame einmal durch die ganze
+# Pipeline (STT, LLM, TTS) bis zum Output Transport gelaufen ist. Bis dahin
+# laufen gepufferte Frames weiter und Twilio spielt weiter ab. Diese Stufe
+# direkt hinter transport.input() reagiert schon auf den VAD Start:
+#
+#   1. Serializer schaltet die Audio-Ausgabe stumm
+#   2. Twilio `clear` geht sofort raus (Twilio verwirft sein Abspiel-Puffer)
+#   3. Pipecat schickt wie gewohnt die InterruptionFrame, die den LLM Stream
+#      und den ElevenLabs Kontext abbricht und die Output-Queue leert
+#
+# Die Antwort im Kontext enthält nur, was tatsächlich abgespielt wurde: Der
+# Assistant Aggregator sammelt die TTSTextFrames erst, wenn ihr Audio
+# geschrieben ist (ElevenLabs Wort-Zeitstempel, Satz-Cache pro Wort).
+#
+# Gemessen wird ab VAD Start bis `clear` gesendet ist (barge_in) und bis die
+# Unterbrechung am Output angekommen ist (interruption).
+#
+
+"""Sofortiger Barge-in: Ausgabe leeren, sobald der Anrufer Ellie unterbricht."""
+
+import time
+from typing import Optional
+
+from loguru import logger
+from pipecat.frames.frames import (
+    BotStartedSpeakingFrame,
+    BotStoppedSpeakingFrame,
+    Frame,
+    TransportMessageUrgentFrame,
+    VADUserStartedSpeakingFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from pipecat.transports.base_output import BaseOutputTransport
+
+from voice_assistant_metrics import CallMetrics
+from voice_assistant_telephony import TelephonyFrameSerializer
+
+
+class BargeInProcessor(FrameProcessor):
+    """Leert die Twilio Ausgabe beim VAD Start, während Ellie spricht."""
+
+    def __init__(
+        self,
+        serializer: TelephonyFrameSerializer,
+        output: BaseOutputTransport,
+        *,
+        call: Optional[CallMetrics] = None,
+        **kwargs,
+    ):
+        """Serializer und Output Transport des Anrufs."""
+        super().__init__(**kwargs)
+        self._serializer = serializer
+        self._output = output
+        self._call = call
+        self._bot_speaking = False
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        """Wiedergabe verfolgen und beim Einsprechen sofort unterbrechen."""
+        await super().process_frame(frame, direction)
+
+        # Der Output Transport meldet Start/Ende der Wiedergabe auch upstream
+        if isinstance(frame, BotStartedSpeakingFrame):
+            self._bot_speaking = True
+        elif isinstance(frame, BotStoppedSpeakingFrame):
+            self._bot_speaking = False
+        elif isinstance(frame, VADUserStartedSpeakingFrame) and self._bot_speaking:
+            await self._barge_in()
+        await self.push_frame(frame, direction)
+
+    async def _barge_in(self):
+        started = time.monotonic()
+        self._bot_speaking = False
+        message = self._serializer.barge_in(lambda: self._observe("interruption", started))
+        await self._output.send_message(TransportMessageUrgentFrame(message=message))
+        self._observe("barge_in", started)
+        logger.debug("Barge-in: Twilio Ausgabe geleert")
+
+    def _observe(self, stage: str, started: float):
+        if self._call:
+            self._call.observe(stage, time.monotonic() - started)
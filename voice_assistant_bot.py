@@ -4,85 +4,202 @@
 #
 
 import os
-import sys
 import json
+from dataclasses import dataclass
+from typing import List, Tuple
+
 from dotenv import load_dotenv
 from fastapi import WebSocket
 from loguru import logger
 
-from pipecat.audio.vad.silero import SileroVADAnalyzer
 from pipecat.pipeline.pipeline import Pipeline
 from pipecat.pipeline.runner import PipelineRunner
+from pipecat.audio.vad.vad_analyzer import VADAnalyzer
 from pipecat.pipeline.task import PipelineParams, PipelineTask
 from pipecat.processors.aggregators.openai_llm_context import OpenAILLMContext
-from pipecat.serializers.twilio import TwilioFrameSerializer
-from pipecat.services.elevenlabs.tts import ElevenLabsTTSService
-from pipecat.services.deepgram.stt import DeepgramSTTService
-from pipecat.services.openai.llm import OpenAILLMService
+from pipecat.processors.frame_processor import FrameProcessor
+from deepgram import LiveOptions
+from pipecat.services.openai.llm import OpenAIContextAggregatorPair, OpenAILLMService
 from pipecat.transports.websocket.fastapi import (
     FastAPIWebsocketParams,
     FastAPIWebsocketTransport,
 )
+from voice_assistant_accounting import (
+    call_accounting,
+    context_bytes,
+    deepgram_open,
+    output_audio_bytes,
+    websocket_open,
+)
+from voice_assistant_archive import call_archive
+from voice_assistant_barge_in import BargeInProcessor
+from voice_assistant_chunking import chunking_stats, text_aggregator
+from voice_assistant_connections import PooledOpenAILLMService
+from voice_assistant_context import ContextBudget
+from voice_assistant_greeting import ELEVENLABS_API_URL, greeting_cache
+from voice_assistant_hedging import (
+    DeepgramSpeakClient,
+    HedgedElevenLabsTTSService,
+    HedgedOpenAILLMService,
+)
+from voice_assistant_intents import IntentFastPath, intent_classifier
+from voice_assistant_logging import log_pipeline
+from voice_assistant_metrics import TurnLatencyObserver, latency_metrics
+from voice_assistant_inference import inference_pool
+from voice_assistant_memory import gc_policy
+from voice_assistant_models import analyzer_pool
+from voice_assistant_prewarm import PreparedCallRegistry
+from voice_assistant_speculation import SpeculativeLLM
+from voice_assistant_stt_gate import GatedDeepgramSTTService
+from voice_assistant_telephony import (
+    CallerDeepgramSTTService,
+    TelephonyFrameSerializer,
+    UlawElevenLabsTTSService,
+)
+from voice_assistant_tts_cache import PhraseTTSCache, TTSCacheProcessor
 
 load_dotenv(override=True)
 
-logger.remove(0)
-logger.add(sys.stderr, level="DEBUG")
+# stderr (synchron, wie bisher) oder JSON über den Writer Thread, siehe LOG_MODE
+log_pipeline.configure()
 
+# ElevenLabs Einstellungen (auch Schlüssel für den Begrüßungs-Cache)
+ELEVENLABS_VOICE_ID = "EXAVITQu4vr4xnSDxMaL"  # Sarah - Weibliche englische Stimme
+ELEVENLABS_MODEL = "eleven_turbo_v2"  # Deutlich schneller als multilingual_v2
+ELEVENLABS_OUTPUT_FORMAT = "ulaw_8000"  # Optimiert für Twilio
 
-async def run_voice_assistant(websocket_client: WebSocket, stream_sid: str, call_sid: str):
-    """
-    Hauptfunktion für den KI Voice Assistant
-    """
-    # Twilio Serializer Setup
-    serializer = TwilioFrameSerializer(
-        stream_sid=stream_sid,
-        call_sid=call_sid,
-        account_sid=os.getenv("TWILIO_ACCOUNT_SID", ""),
-        auth_token=os.getenv("TWILIO_AUTH_TOKEN", ""),
-    )
+# Satz-Cache vor dem TTS Service (Speicher-LRU + memory-mapped Disk)
+tts_cache = PhraseTTSCache(
+    directory=os.getenv("TTS_CACHE_DIR", "tts_cache"),
+    max_memory_bytes=int(os.getenv("TTS_CACHE_MEMORY_MB", "16")) * 1024 * 1024,
+    max_disk_bytes=int(os.getenv("TTS_CACHE_DISK_MB", "256")) * 1024 * 1024,
+    render_after=int(os.getenv("TTS_CACHE_RENDER_AFTER", "2")),
+)
 
-    # WebSocket Transport für Twilio
-    transport = FastAPIWebsocketTransport(
-        websocket=websocket_client,
-        params=FastAPIWebsocketParams(
-            audio_in_enabled=True,
-            audio_out_enabled=True,
-            add_wav_header=False,
-            vad_analyzer=SileroVADAnalyzer(),
-            serializer=serializer,
-        ),
-    )
+GREETING_TEXT = "Hallo, hier ist Ellie von Momentum Solutions! Wie kann ich Ihnen heute helfen?"
 
-    # OpenAI LLM Service (GPT-3.5-turbo für minimale Latenz)
-    llm = OpenAILLMService(
-        api_key=os.getenv("OPENAI_API_KEY"),
-        model="gpt-3.5-turbo"
+
+async def get_greeting():
+    """Vorgerenderte Begrüßung aus dem Cache (beim ersten Aufruf wird gerendert)."""
+    return await greeting_cache.get(
+        GREETING_TEXT,
+        api_key=os.getenv("ELEVENLABS_API_KEY", ""),
+        voice_id=ELEVENLABS_VOICE_ID,
+        model=ELEVENLABS_MODEL,
+        output_format=ELEVENLABS_OUTPUT_FORMAT,
     )
 
-    # Deepgram Speech-to-Text Service (optimiert für Geschwindigkeit)
-    stt = DeepgramSTTService(
+
+async def prerender_intent_answers():
+    """Rendert die festen FAQ Antworten in den Satz-Cache, damit sie sofort als Audio kommen."""
+    try:
+        for intent in intent_classifier.intents:
+            await tts_cache.prerender(
+                intent.answer,
+                api_key=os.getenv("ELEVENLABS_API_KEY", ""),
+                voice_id=ELEVENLABS_VOICE_ID,
+                model=ELEVENLABS_MODEL,
+                output_format=ELEVENLABS_OUTPUT_FORMAT,
+                aggregator=text_aggregator(),
+            )
+    except Exception as e:
+        # Ohne Vorrendern füllt sich der Satz-Cache wie bisher über Fehlversuche
+        logger.warning(f"FAQ Antworten konnten nicht vorgerendert werden: {e}")
+
+
+@dataclass
+class PreparedCall:
+    """Services, Kontext und Pipeline-Stufen eines Anrufs (ohne Twilio Transport)."""
+
+    call_sid: str
+    stt: CallerDeepgramSTTService
+    llm: OpenAILLMService
+    tts: UlawElevenLabsTTSService
+    context: OpenAILLMContext
+    context_aggregator: OpenAIContextAggregatorPair
+    processors: List[FrameProcessor]  # Zwischen transport.input() und transport.output()
+    vad_analyzer: VADAnalyzer
+
+
+def build_call(call_sid: str) -> PreparedCall:
+    """Baut alles, was ein Anruf außer dem WebSocket braucht."""
+    # OpenAI LLM Service (GPT-3.5-turbo für minimale Latenz)
+    hedge_model = os.getenv("LLM_HEDGE_MODEL", "")
+    if hedge_model:
+        # Langsame Completions zusätzlich bei einem zweiten Modell anfragen
+        llm = HedgedOpenAILLMService(
+            api_key=os.getenv("OPENAI_API_KEY"),
+            model="gpt-3.5-turbo",
+            hedge_model=hedge_model,
+            hedge_api_key=os.getenv("LLM_HEDGE_API_KEY") or None,
+            hedge_base_url=os.getenv("LLM_HEDGE_BASE_URL") or None,
+        )
+    else:
+        llm = PooledOpenAILLMService(  # Geteilter HTTP Client aller Anrufe
+            api_key=os.getenv("OPENAI_API_KEY"),
+            model="gpt-3.5-turbo"
+        )
+
+    # Deepgram Speech-to-Text Service (optimiert für Geschwindigkeit, nur Anrufer-Audio)
+    stt_options = dict(
         api_key=os.getenv("DEEPGRAM_API_KEY"),
-        model="nova-2-general",  # Schneller als nova-2
-        language="de",  # Deutsch
+        base_url=os.getenv("DEEPGRAM_BASE_URL", ""),  # Leer = Deepgram Cloud
         audio_passthrough=True,
-        interim_results=True  # Für schnellere Zwischenergebnisse
+        # Pipecat ignoriert model/language als direkte Argumente, nur live_options wirkt
+        live_options=LiveOptions(
+            model="nova-2-general",  # Schneller als nova-2
+            language="de",  # Deutsch
+            interim_results=True,  # Für schnellere Zwischenergebnisse (und Spekulation)
+        ),
     )
-
-    # ElevenLabs Text-to-Speech Service (Turbo mit deutscher Stimme)
-    tts = ElevenLabsTTSService(
+    if os.getenv("STT_GATE", "true").lower() == "true":
+        # Stille nicht streamen, nur Sprache mit Pre-Roll und Nachlauf (VAD im Transport)
+        stt = GatedDeepgramSTTService(
+            preroll_secs=int(os.getenv("STT_GATE_PREROLL_MS", "500")) / 1000,
+            hangover_secs=int(os.getenv("STT_GATE_HANGOVER_MS", "1000")) / 1000,
+            call_sid=call_sid,
+            **stt_options,
+        )
+    else:
+        stt = CallerDeepgramSTTService(**stt_options)
+
+    # ElevenLabs Text-to-Speech Service (Turbo mit deutscher Stimme, liefert μ-law)
+    tts_options = dict(
         api_key=os.getenv("ELEVENLABS_API_KEY"),
-        voice_id="EXAVITQu4vr4xnSDxMaL",  # Sarah - Weibliche englische Stimme
-        model="eleven_turbo_v2",  # Deutlich schneller als multilingual_v2
+        url=ELEVENLABS_API_URL.replace("http", "ws", 1),  # https -> wss, http -> ws
+        voice_id=ELEVENLABS_VOICE_ID,
+        model=ELEVENLABS_MODEL,
         optimize_streaming_latency=4,  # Maximum Latenz-Optimierung
-        output_format="ulaw_8000"  # Optimiert für Twilio
+        output_format=ELEVENLABS_OUTPUT_FORMAT,
+        text_aggregator=text_aggregator(),  # Erster Chunk schon am Teilsatz
+    )
+    if os.getenv("TTS_HEDGE", "false").lower() == "true":
+        # Verzögertes erstes Audio zusätzlich bei Deepgram Aura anfragen
+        tts = HedgedElevenLabsTTSService(
+            hedge_speaker=DeepgramSpeakClient(
+                api_key=os.getenv("DEEPGRAM_API_KEY", ""),
+                voice=os.getenv("TTS_HEDGE_VOICE", "aura-2-viktoria-de"),
+            ),
+            **tts_options,
+        )
+    else:
+        tts = UlawElevenLabsTTSService(**tts_options)
+
+    # Bereits gerenderte Sätze direkt aus dem Cache abspielen
+    tts_cache_processor = TTSCacheProcessor(
+        tts_cache,
+        api_key=os.getenv("ELEVENLABS_API_KEY", ""),
+        voice_id=ELEVENLABS_VOICE_ID,
+        model=ELEVENLABS_MODEL,
+        output_format=ELEVENLABS_OUTPUT_FORMAT,
+        aggregator=text_aggregator(stats=chunking_stats),  # Erste Stufe nach dem LLM misst
     )
 
     # System Prompt für Ellie - Telefonrezeptionistin
     messages = [
         {
             "role": "system",
-            "content": """Sie sind Ellie, die freundliche und kompetente Telefonrezeptionistin für Momentum Solutions, ein serviceorientierter Fach- und Handwerksbetrieb mit Sitz in Wien, Österreich.
+            "content": f"""Sie sind Ellie, die freundliche und kompetente Telefonrezeptionistin für Momentum Solutions, ein serviceorientierter Fach- und Handwerksbetrieb mit Sitz in Wien, Österreich.
 
 [Identity]
 - Sie sind Ellie, Telefonrezeptionistin bei Momentum Solutions
@@ -111,7 +228,7 @@ async def run_voice_assistant(websocket_client: WebSocket, stream_sid: str, call
 - Daten sammeln: Name, Telefon, gewünschte Zeit, Grund
 - Bestätigen dass jemand zurückrufen wird
 
-Starten Sie IMMER mit: "Hallo, hier ist Ellie von Momentum Solutions! Wie kann ich Ihnen heute helfen?"
+Starten Sie IMMER mit: "{GREETING_TEXT}"
 
 Halten Sie alle Antworten kurz und natürlich - Sie sprechen am Telefon!""",
         },
@@ -121,15 +238,143 @@ Halten Sie alle Antworten kurz und natürlich - Sie sprechen am Telefon!""",
     context = OpenAILLMContext(messages)
     context_aggregator = llm.create_context_aggregator(context)
 
+    # Kontext auf ein Token-Budget begrenzen, ältere Runden zusammenfassen
+    context_budget = ContextBudget(
+        context,
+        llm,
+        max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "4000")),
+        keep_turns=int(os.getenv("CONTEXT_KEEP_TURNS", "4")),
+        call_sid=call_sid,
+    )
+
+    # Pipeline-Stufen zwischen Twilio Input und Output
+    processors = [
+        stt,                        # Deepgram Speech-to-Text
+        context_aggregator.user(),  # User Context
+        context_budget.processor(),  # Token-Budget und Zusammenfassung
+        llm,                        # OpenAI LLM
+        tts_cache_processor,        # Satz-Cache für wiederkehrende Antworten
+        tts,                        # ElevenLabs Text-to-Speech
+    ]
+    # Häufige Fragen lokal beantworten, ohne LLM Roundtrip
+    intents = None
+    if os.getenv("INTENT_FAST_PATH", "true").lower() == "true":
+        intents = IntentFastPath(intent_classifier)
+        processors.insert(processors.index(llm), intents)
+
+    # LLM schon auf stabilen Zwischenergebnissen starten
+    if os.getenv("SPECULATIVE_LLM", "false").lower() == "true":
+        speculation = SpeculativeLLM(
+            llm, context, stable_secs=int(os.getenv("SPECULATION_STABLE_MS", "300")) / 1000
+        )
+        processors.insert(processors.index(context_aggregator.user()), speculation.trigger())
+        processors.insert(processors.index(llm), speculation.gate())
+
+        if intents:
+
+            @intents.event_handler("on_intent_matched")
+            async def on_intent_matched(processor, intent):
+                # Direkt beantwortet, die Spekulation wird nicht mehr gebraucht
+                await speculation.skip_turn()
+
+    return PreparedCall(
+        call_sid=call_sid,
+        stt=stt,
+        llm=llm,
+        tts=tts,
+        context=context,
+        context_aggregator=context_aggregator,
+        processors=processors,
+        vad_analyzer=analyzer_pool.vad_analyzer(),  # Geteiltes Modell aus dem Pool
+    )
+
+
+async def prepare_call(call_sid: str) -> PreparedCall:
+    """Baut den Anruf schon nach dem Twilio Webhook und öffnet die OpenAI Verbindung.
+
+    Der WebSocket Handler muss danach nur noch Transport und Pipeline Task
+    anlegen (siehe prepared_calls).
+    """
+    call = build_call(call_sid)
+    await warm_openai_connection(call.llm)
+    return call
+
+
+async def warm_openai_connection(llm: OpenAILLMService):
+    """Baut die HTTP Verbindung (TLS) zu OpenAI vorab auf, der Client hält sie im Pool."""
+    try:
+        await llm._client.with_options(timeout=2.0).models.list()
+    except Exception as e:
+        # Auch eine Fehlerantwort lässt eine offene Verbindung zurück
+        logger.debug(f"OpenAI Verbindung vorgewärmt ({e.__class__.__name__})")
+
+
+def discard_call(call: PreparedCall):
+    """Gibt einen nie verbundenen Anruf frei (VAD Zustand zurück in den Pool)."""
+    analyzer_pool.release(call.vad_analyzer)
+
+
+# Vorbereitete Anrufe pro Worker-Prozess, der Webhook startet die Vorbereitung
+prepared_calls = PreparedCallRegistry(prepare_call, discard_call)
+
+
+async def run_voice_assistant(websocket_client: WebSocket, stream_sid: str, call_sid: str):
+    """Hauptfunktion für den KI Voice Assistant."""
+    # Vom Webhook vorbereiteten Anruf übernehmen, sonst jetzt bauen
+    call = await prepared_calls.take(call_sid) or build_call(call_sid)
+    context = call.context
+    context_aggregator = call.context_aggregator
+
+    # Twilio Serializer Setup (μ-law <-> PCM ohne Resampler bei 8kHz)
+    serializer = TelephonyFrameSerializer(
+        stream_sid=stream_sid,
+        call_sid=call_sid,
+        account_sid=os.getenv("TWILIO_ACCOUNT_SID", ""),
+        auth_token=os.getenv("TWILIO_AUTH_TOKEN", ""),
+    )
+
+    # WebSocket Transport für Twilio
+    transport = FastAPIWebsocketTransport(
+        websocket=websocket_client,
+        params=FastAPIWebsocketParams(
+            audio_in_enabled=True,
+            audio_out_enabled=True,
+            add_wav_header=False,
+            vad_analyzer=call.vad_analyzer,  # Geteiltes Modell aus dem Pool
+            serializer=serializer,
+        ),
+    )
+    # VAD auf dem gemeinsamen Inferenz-Pool statt in einem Thread pro Anruf
+    inference_pool.attach_transport(transport)
+
+    # Leichtgewichtige Latenzmessung pro Runde statt der Pipecat Metriken
+    observers = []
+    call_metrics = None
+    if latency_metrics.enabled:
+        call_metrics = latency_metrics.start_call(call_sid)
+        observers.append(TurnLatencyObserver(call_metrics, output=transport.output()))
+
+    # Barge-in: Twilio Ausgabe schon beim VAD Start leeren
+    barge_in = []
+    if os.getenv("BARGE_IN", "true").lower() == "true":
+        barge_in.append(BargeInProcessor(serializer, transport.output(), call=call_metrics))
+
+    # Archiv: Transkript und Audio nur in den Speicher, geschrieben wird im Hintergrund
+    processors = list(call.processors)
+    archive_output = []
+    recorder = call_archive.recorder(call_sid)
+    if recorder:
+        processors.insert(processors.index(context_aggregator.user()), recorder.input_tap())
+        archive_output.append(recorder.output_tap())
+
     # Pipeline Setup
     pipeline = Pipeline(
         [
-            transport.input(),           # Twilio Audio Input
-            stt,                        # Deepgram Speech-to-Text
-            context_aggregator.user(),  # User Context
-            llm,                        # OpenAI LLM
-            tts,                        # ElevenLabs Text-to-Speech
-            transport.output(),         # Twilio Audio Output
+            transport.input(),  # Twilio Audio Input
+            *barge_in,  # Sofortiges Leeren der Ausgabe bei Unterbrechung
+            *processors,  # STT, LLM, TTS (vorbereitet)
+            transport.output(),  # Twilio Audio Output
+            *archive_output,  # Abgespieltes Audio und Text von Ellie
             context_aggregator.assistant(),  # Assistant Context
         ]
     )
@@ -146,6 +391,7 @@ Halten Sie alle Antworten kurz und natürlich - Sie sprechen am Telefon!""",
             vad_start_secs=0.1,         # Schnellere Voice Activity Detection
             vad_stop_secs=0.3,          # Kürzere Pause-Erkennung
         ),
+        observers=observers,
     )
 
     @transport.event_handler("on_client_connected")
@@ -153,12 +399,19 @@ Halten Sie alle Antworten kurz und natürlich - Sie sprechen am Telefon!""",
         """Wird ausgeführt, wenn ein Anruf eingeht"""
         logger.info(f"Neuer Anruf verbunden: {call_sid}")
 
-        # Begrüßung starten
+        # Vorgerenderte Begrüßung sofort abspielen und in den Kontext schreiben
+        greeting = await get_greeting()
+        if greeting:
+            context.add_message({"role": "assistant", "content": greeting.text})
+            await task.queue_frames(greeting.frames())
+            return
+
+        # Fallback: Begrüßung über LLM und TTS erzeugen
         greeting_message = {
             "role": "system",
             "content": "Begrüße den Kunden freundlich und frage, wie du helfen kannst."
         }
-        messages.append(greeting_message)
+        context.add_message(greeting_message)
         await task.queue_frames([context_aggregator.user().get_context_frame()])
 
     @transport.event_handler("on_client_disconnected")
@@ -167,15 +420,35 @@ Halten Sie alle Antworten kurz und natürlich - Sie sprechen am Telefon!""",
         logger.info(f"Anruf beendet: {call_sid}")
         await task.cancel()
 
-    # Pipeline Runner starten
-    runner = PipelineRunner(handle_sigint=False, force_gc=True)
-    await runner.run(task)
-
-
-async def handle_twilio_call(websocket: WebSocket):
-    """
-    Handler für eingehende Twilio WebSocket Verbindungen
-    """
+    # Verbrauch für /calls: CPU der Pipeline Tasks, der Rest erst beim Abfragen
+    usage = call_accounting.start_call(call_sid)
+    usage.track_buffer("context", lambda: context_bytes(context.messages))
+    usage.track_buffer("output_audio", lambda: output_audio_bytes(transport.output()))
+    if isinstance(call.stt, GatedDeepgramSTTService):
+        usage.track_buffer("stt_preroll", lambda: call.stt.buffered_bytes)
+    if recorder:
+        usage.track_buffer("archive", lambda: recorder.buffered_bytes)
+    usage.track_stream("stt", lambda: deepgram_open(call.stt._connection))
+    usage.track_stream("tts", lambda: websocket_open(call.tts._websocket))
+    usage.track_tasks(transport.input())
+
+    # Pipeline Runner starten (voller GC nach dem Anruf nur im GC_MODE=default)
+    runner = PipelineRunner(handle_sigint=False, force_gc=gc_policy.force_gc_per_call)
+    gc_policy.call_started()
+    try:
+        with call_accounting.attribute(usage):
+            await runner.run(task)
+    finally:
+        call_accounting.end_call(usage)
+        gc_policy.call_ended()
+        call_archive.call_ended(recorder)
+        # VAD Zustand für den nächsten Anruf zurückgeben
+        analyzer_pool.release_transport(transport)
+        latency_metrics.end_call(call_sid)
+
+
+async def read_twilio_start(websocket: WebSocket) -> Tuple[str, str]:
+    """Liest die ersten beiden Nachrichten des Streams, gibt (StreamSid, CallSid) zurück."""
     logger.info("Neue Twilio WebSocket Verbindung")
 
     # Erste beiden Nachrichten von Twilio lesen
@@ -190,6 +463,11 @@ async def handle_twilio_call(websocket: WebSocket):
     call_sid = call_data["start"]["callSid"]
 
     logger.info(f"Twilio Call Details - CallSid: {call_sid}, StreamSid: {stream_sid}")
+    return stream_sid, call_sid
+
 
-    # Voice Assistant starten
-    await run_voice_assistant(websocket, stream_sid, call_sid)
\ No newline at end of file
+async def handle_twilio_call(websocket: WebSocket, stream_sid: str, call_sid: str):
+    """Handler für eingehende Twilio WebSocket Verbindungen (nach read_twilio_start)."""
+    # Voice Assistant starten, alle Logs des Anrufs tragen die CallSid
+    with log_pipeline.call_context(call_sid):
+        await run_voice_assistant(websocket, stream_sid, call_sid)
\ No newline at end of file
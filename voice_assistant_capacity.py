@@ -0,0 +1,250 @@
+#
+# Admission Control und Worker-Status für den Multi-Prozess Betrieb
+#
+# Jeder uvicorn Worker zählt seine laufenden Anrufe, misst die Verzögerung
+# seines Event Loops und schreibt beides regelmäßig in eine kleine Statusdatei.
+# Der Twilio Webhook kann so vor dem Annehmen eines Anrufs prüfen, ob im
+# gesamten Server (alle Worker) noch Kapazität frei ist.
+#
+# Webhook und Media Stream sind getrennte Verbindungen und landen meist in
+# verschiedenen Workern. Die Reservierung des Webhooks hängt deshalb an der
+# CallSid: übernimmt irgendein Worker den Stream, steht die CallSid in seiner
+# Statusdatei und die Reservierung zählt nirgends mehr. Der Worker mit dem
+# Stream hält sein eigenes Limit (`max_calls`) ein, ist er voll, wird der
+# Stream geschlossen und Twilio spielt die Ausweich-TwiML nach <Connect>.
+#
+# Zusätzlich gilt optional ein Speicherbudget pro Worker (MEMORY_BUDGET_MB):
+# jeder Worker veröffentlicht seinen RSS, der Webhook zählt nur die Plätze von
+# Workern unter ihrem Budget. Landet der Stream trotzdem in einem Worker über
+# dem Budget, lehnt dieser ihn ab wie bei vollem `max_calls`.
+#
+
+"""Admission Control und Worker-Status für den Multi-Prozess Betrieb."""
+
+import asyncio
+import json
+import os
+import tempfile
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from loguru import logger
+
+# Statusdateien älter als das gelten als tot (Worker abgestürzt)
+WORKER_STATE_STALE_SECS = 5.0
+
+# So lange bleibt ein angenommener Anruf reserviert, bis sein WebSocket kommt
+PENDING_CALL_TTL_SECS = 15.0
+
+
+def process_rss_bytes() -> int:
+    """Aktueller RSS des Prozesses (Linux), sonst der bisherige Höchstwert."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _over_memory_budget(worker: Dict[str, Any]) -> bool:
+    budget = worker.get("memory_budget_mb")
+    return bool(budget) and worker.get("rss_mb", 0) >= budget
+
+
+class CallCapacity:
+    """Anrufzähler und Event-Loop-Lag eines Worker-Prozesses."""
+
+    def __init__(
+        self,
+        *,
+        max_calls: int,
+        state_dir: Optional[str] = None,
+        lag_interval_secs: float = 0.5,
+        memory_budget_mb: int = 0,
+    ):
+        """max_calls pro Worker, memory_budget_mb 0 heißt ohne Speicherbudget."""
+        self._max_calls = max_calls
+        self._memory_budget_bytes = memory_budget_mb * 1024 * 1024
+        self._state_dir = state_dir or os.path.join(
+            tempfile.gettempdir(), "voice_assistant_workers"
+        )
+        self._lag_interval_secs = lag_interval_secs
+        self._pid = os.getpid()
+        self._calls: Set[str] = set()  # CallSids der laufenden Anrufe
+        self._pending_calls: Dict[str, float] = {}  # CallSid -> Ablaufzeitpunkt der Reservierung
+        self._released: Dict[str, float] = {}  # Abgelehnte/beendete Streams, CallSid -> Ablauf
+        self._rejected_calls = 0
+        self._rejected_streams = 0
+        self._rejected_memory = 0
+        self._loop_lag_ms = 0.0
+        self._max_loop_lag_ms = 0.0
+        self._monitor_task: Optional[asyncio.Task] = None
+
+    @property
+    def active_calls(self) -> int:
+        """Laufende Anrufe in diesem Worker."""
+        return len(self._calls)
+
+    def call_started(self, call_sid: str) -> bool:
+        """Übernimmt einen Anruf in diesem Worker, False wenn sein Limit erreicht ist.
+
+        Die Reservierung des Webhooks (in welchem Worker auch immer) ist damit
+        aufgelöst.
+        """
+        self._pending_calls.pop(call_sid, None)
+        full = len(self._calls) >= self._max_calls
+        if full or not self.within_memory_budget():
+            self._rejected_streams += 1
+            self._released[call_sid] = time.time() + PENDING_CALL_TTL_SECS
+            reason = (
+                f"{len(self._calls)}/{self._max_calls} Anrufe"
+                if full
+                else f"{process_rss_bytes() / 1048576:.0f}/{self._memory_budget_bytes / 1048576:.0f} MB"
+            )
+            logger.warning(f"Worker voll ({reason}), Stream {call_sid} abgelehnt")
+            self._publish()
+            return False
+        self._calls.add(call_sid)
+        self._publish()
+        return True
+
+    def call_ended(self, call_sid: str):
+        """Wird aufgerufen, wenn ein Anruf in diesem Worker endet."""
+        self._calls.discard(call_sid)
+        self._released[call_sid] = time.time() + PENDING_CALL_TTL_SECS
+        self._publish()
+
+    def within_memory_budget(self) -> bool:
+        """Prüft das Speicherbudget dieses Workers (0 = kein Budget)."""
+        return not self._memory_budget_bytes or process_rss_bytes() < self._memory_budget_bytes
+
+    def try_admit(self, call_sid: str) -> bool:
+        """Prüft, ob über alle Worker hinweg noch ein Anruf angenommen werden kann."""
+        workers = self.cluster_stats()
+        # Reservierungen, deren Stream schon ein Worker übernommen (oder abgelehnt) hat, zählen nicht
+        claimed = self._release_claimed(workers)
+        pending = sum(1 for w in workers for sid in w.get("pending", ()) if sid not in claimed)
+        # Nur Worker unter ihrem Speicherbudget nehmen noch Anrufe an
+        available = [w for w in workers if not _over_memory_budget(w)]
+        if not available:
+            self._rejected_memory += 1
+            logger.warning(
+                "Speicherbudget in allen Workern überschritten ("
+                + ", ".join(f"{w['rss_mb']:.0f}/{w['memory_budget_mb']} MB" for w in workers)
+                + "), Anruf abgelehnt"
+            )
+            return False
+        capacity = sum(w["max_calls"] for w in available)
+        active = sum(w["active_calls"] for w in available) + pending
+        if active < capacity:
+            # Platz reservieren, bis der WebSocket des Anrufs verbunden ist
+            self._pending_calls[call_sid] = time.time() + PENDING_CALL_TTL_SECS
+            self._publish()
+            return True
+        self._rejected_calls += 1
+        logger.warning(f"Kapazität erschöpft ({active}/{capacity} Anrufe), Anruf abgelehnt")
+        return False
+
+    def _release_claimed(self, workers: List[Dict[str, Any]]) -> Set[str]:
+        """CallSids, die ein Worker übernommen oder abgelehnt hat, eigene Reservierungen dafür auflösen."""
+        claimed = {sid for w in workers for sid in (*w.get("calls", ()), *w.get("released", ()))}
+        for sid in claimed.intersection(self._pending_calls):
+            del self._pending_calls[sid]
+        return claimed
+
+    def start(self):
+        """Startet die Event-Loop-Lag Messung (im Startup des Workers aufrufen)."""
+        os.makedirs(self._state_dir, exist_ok=True)
+        self._pid = os.getpid()
+        self._publish()
+        if not self._monitor_task:
+            self._monitor_task = asyncio.create_task(self._monitor_loop_lag())
+
+    async def stop(self):
+        """Beendet die Messung und entfernt die Statusdatei."""
+        if self._monitor_task:
+            self._monitor_task.cancel()
+            self._monitor_task = None
+        try:
+            os.remove(self._state_path())
+        except FileNotFoundError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        """Status dieses Workers."""
+        now = time.time()
+        self._pending_calls = {sid: t for sid, t in self._pending_calls.items() if t > now}
+        self._released = {sid: t for sid, t in self._released.items() if t > now}
+        return {
+            "pid": self._pid,
+            "active_calls": len(self._calls),
+            "pending_calls": len(self._pending_calls),
+            "max_calls": self._max_calls,
+            "rejected_calls": self._rejected_calls,
+            "rejected_streams": self._rejected_streams,
+            "rejected_memory": self._rejected_memory,
+            "rss_mb": round(process_rss_bytes() / 1048576, 1),
+            "memory_budget_mb": round(self._memory_budget_bytes / 1048576) or None,
+            "loop_lag_ms": round(self._loop_lag_ms, 2),
+            "max_loop_lag_ms": round(self._max_loop_lag_ms, 2),
+            "updated": now,
+            "calls": sorted(self._calls),
+            "pending": sorted(self._pending_calls),
+            "released": sorted(self._released),
+        }
+
+    def cluster_stats(self) -> List[Dict[str, Any]]:
+        """Status aller lebenden Worker (inklusive diesem)."""
+        workers = {self._pid: self.stats()}
+        now = time.time()
+        try:
+            names = os.listdir(self._state_dir)
+        except FileNotFoundError:
+            names = []
+        for name in names:
+            if not name.endswith(".json"):
+                continue
+            try:
+                with open(os.path.join(self._state_dir, name)) as f:
+                    state = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if state["pid"] in workers or now - state["updated"] > WORKER_STATE_STALE_SECS:
+                continue
+            workers[state["pid"]] = state
+        return list(workers.values())
+
+    async def _monitor_loop_lag(self):
+        # Die Verzögerung beim Aufwachen aus sleep() ist die Zeit, die andere
+        # Tasks den Loop blockiert haben
+        loop = asyncio.get_running_loop()
+        window_max = 0.0
+        window_start = loop.time()
+        while True:
+            expected = loop.time() + self._lag_interval_secs
+            await asyncio.sleep(self._lag_interval_secs)
+            lag_ms = max(0.0, (loop.time() - expected) * 1000)
+            self._loop_lag_ms = lag_ms
+            window_max = max(window_max, lag_ms)
+            if loop.time() - window_start >= WORKER_STATE_STALE_SECS / 2:
+                self._max_loop_lag_ms = window_max
+                window_max = 0.0
+                window_start = loop.time()
+            if self._pending_calls:
+                self._release_claimed(self.cluster_stats())
+            self._publish()
+
+    def _state_path(self) -> str:
+        return os.path.join(self._state_dir, f"{self._pid}.json")
+
+    def _publish(self):
+        path = self._state_path()
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self.stats(), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.debug(f"Worker Status konnte nicht geschrieben werden: {e}")
@@ -0,0 +1,287 @@
+#
+# Teilsatz-Chunking zwischen LLM und TTS
+#
+# Pipecat gibt Text erst am Satzende an ElevenLabs. Eine Antwort wie "Na ja,
+# das ist leider außerhalb unserer Geschäftszeiten, aber ..." wartet so auf
+# den ganzen Satz, bevor Audio kommt. Hier geht der erste Chunk einer Antwort
+# schon am ersten Teilsatz (Komma, Semikolon, Doppelpunkt, Gedankenstrich)
+# raus, sobald er `first_min_words` Wörter hat, spätestens nach
+# `first_max_words` Wörtern an einer Wortgrenze. Danach wird wieder in ganzen
+# Sätzen (mindestens `min_words` Wörter) gechunkt, damit die Betonung passt.
+#
+# Deutsche Abkürzungen (z.B., d.h., usw., Nr., ...), Ordinalzahlen
+# ("am 3. Mai"), Uhrzeiten und Dezimalzahlen ("8.30", "3,5") beenden keinen
+# Chunk. Eine Grenze zählt erst, wenn das nächste Zeichen (Leerzeichen) da ist.
+#
+# Der Aggregator ersetzt den SimpleTextAggregator im Satz-Cache und im TTS
+# Service, beide chunken damit gleich.
+#
+
+"""Teilsatz-Chunking zwischen LLM und TTS."""
+
+import os
+import re
+import time
+from collections import Counter
+from typing import Any, Dict, Optional, Tuple
+
+from pipecat.utils.text.base_text_aggregator import BaseTextAggregator
+from pipecat.utils.text.simple_text_aggregator import SimpleTextAggregator
+
+from voice_assistant_metrics import LatencyHistogram
+
+# Häufige Abkürzungen (klein geschrieben, ohne den letzten Punkt)
+ABBREVIATIONS = {
+    "z.b",
+    "z. b",
+    "d.h",
+    "d. h",
+    "u.a",
+    "u. a",
+    "o.ä",
+    "u.u",
+    "s.o",
+    "s.u",
+    "i.d.r",
+    "usw",
+    "bzw",
+    "ca",
+    "etc",
+    "evtl",
+    "ggf",
+    "inkl",
+    "exkl",
+    "zzgl",
+    "vgl",
+    "bspw",
+    "dr",
+    "prof",
+    "hr",
+    "fr",
+    "nr",
+    "str",
+    "tel",
+    "mind",
+    "max",
+    "min",
+    "std",
+    "abs",
+    "jan",
+    "feb",
+    "mär",
+    "apr",
+    "jun",
+    "jul",
+    "aug",
+    "sep",
+    "sept",
+    "okt",
+    "nov",
+    "dez",
+    "st",
+    "geb",
+    "verh",
+    "allg",
+    "bzgl",
+}
+
+# Wochentage sind auch normale Wörter ("Ja genau so."): Abkürzung nur vor
+# Datum, Uhrzeit oder einem weiteren Wochentag ("Mo. bis Fr.", "So. 12.5.")
+WEEKDAYS = {"mo", "di", "mi", "do", "fr", "sa", "so"}
+WEEKDAY_FOLLOWERS = {"bis", "und", "-", "–"}
+
+MONTHS = {
+    "januar",
+    "jänner",
+    "februar",
+    "feber",
+    "märz",
+    "april",
+    "mai",
+    "juni",
+    "juli",
+    "august",
+    "september",
+    "oktober",
+    "november",
+    "dezember",
+}
+
+# Satzende bzw. Teilsatzende, jeweils gefolgt von Leerraum
+_SENTENCE_END_RE = re.compile(r"(\.\.\.|…|[.!?])[\"'»«“”)]*(?=\s)")
+_CLAUSE_END_RE = re.compile(r"([,;:]|\s[–—-])[\"'»«“”)]*(?=\s)")
+_WORD_BEFORE_RE = re.compile(r"(\S+)$")
+_NEXT_WORD_RE = re.compile(r"\s+(\S+)\s")
+
+
+def _word_count(text: str) -> int:
+    return len(text.split())
+
+
+def _is_sentence_end(text: str, match: re.Match) -> bool:
+    """Prüft, ob der Punkt an `match` wirklich einen Satz beendet."""
+    if match.group(1) != ".":
+        return True
+    before = _WORD_BEFORE_RE.search(text[: match.start(1)])
+    word = before.group(1).lower().lstrip("(\"'»«“") if before else ""
+    if not word:
+        return True
+    # z.B. / z. B. (zwei Wörter)
+    two_words = text[: match.start(1)].rsplit(None, 2)[-2:]
+    if word in ABBREVIATIONS or " ".join(two_words).lower() in ABBREVIATIONS:
+        return False
+    # Einzelne Buchstaben sind Initialen oder Abkürzungen ("A. Huber")
+    if len(word) == 1 and word.isalpha():
+        return False
+    if word in WEEKDAYS:
+        following = _NEXT_WORD_RE.match(text, match.end())
+        if not following:
+            return False
+        next_word = following.group(1).lower().strip(",.;:!?")
+        return not (
+            next_word[:1].isdigit() or next_word in WEEKDAYS or next_word in WEEKDAY_FOLLOWERS
+        )
+    if word.isdigit():
+        # "am 3. Mai", "der 2. Stock": Ordinalzahl, wenn klein oder ein Monat folgt.
+        # Bis das nächste Wort vollständig da ist, gilt der Punkt nicht als Ende.
+        following = _NEXT_WORD_RE.match(text, match.end())
+        if not following:
+            return False
+        next_word = following.group(1)
+        return next_word[:1].isupper() and next_word.lower().strip(",.;:!?") not in MONTHS
+    return True
+
+
+class ClauseTextAggregator(BaseTextAggregator):
+    """Früher erster Chunk am Teilsatz, danach ganze Sätze.
+
+    `aggregate` gibt alles bis zur letzten passenden Grenze zurück (nicht nur
+    einen Satz), damit kein fertiger Text im Puffer liegen bleibt. Mit
+    `stats` wird die Zeit vom ersten Token bis zum ersten Chunk erfasst (nur
+    an einer Stelle der Pipeline, sonst zählt jede Antwort doppelt).
+    """
+
+    def __init__(
+        self,
+        *,
+        first_min_words: int = 3,
+        first_max_words: int = 10,
+        min_words: int = 6,
+        stats: Optional["ChunkingStats"] = None,
+    ):
+        """Wortgrenzen für den ersten und alle weiteren Abschnitte."""
+        self._first_min_words = first_min_words
+        self._first_max_words = first_max_words
+        self._min_words = min_words
+        self._stats = stats
+        self._text = ""
+        self._first_sent = False
+        self._started_at: Optional[float] = None
+
+    @property
+    def text(self) -> str:
+        """Bisher gesammelter Text."""
+        return self._text
+
+    async def aggregate(self, text: str) -> Optional[str]:
+        """Text sammeln und einen fertigen Abschnitt zurückgeben, falls es einen gibt."""
+        if self._started_at is None:
+            self._started_at = time.perf_counter()
+        self._text += text
+
+        if self._first_sent:
+            end = self._later_chunk_end()
+            reason = None
+        else:
+            end, reason = self._first_chunk_end()
+        if not end:
+            return None
+
+        chunk, self._text = self._text[:end], self._text[end:]
+        if reason:
+            self._first_sent = True
+            if self._stats:
+                self._stats.observe_first_chunk(reason, time.perf_counter() - self._started_at)
+        return chunk
+
+    def _first_chunk_end(self) -> Tuple[int, Optional[str]]:
+        """Ende des ersten Chunks (inkl. folgendem Leerzeichen) und der Grund."""
+        text = self._text
+        for match in _SENTENCE_END_RE.finditer(text):
+            if _is_sentence_end(text, match):
+                return match.end() + 1, "sentence"
+        for match in _CLAUSE_END_RE.finditer(text):
+            if _word_count(text[: match.end()]) >= self._first_min_words:
+                return match.end() + 1, "clause"
+        words = text.split()
+        # Letztes Wort kann noch unvollständig sein, daher erst ab einem Wort mehr
+        if len(words) > self._first_max_words:
+            end = 0
+            for word in words[: self._first_max_words]:
+                end = text.index(word, end) + len(word)
+            return end + 1, "words"
+        return 0, None
+
+    def _later_chunk_end(self) -> int:
+        """Ende des letzten vollständigen Satzes, wenn der Chunk lang genug ist."""
+        text = self._text
+        end = 0
+        for match in _SENTENCE_END_RE.finditer(text):
+            if (
+                _is_sentence_end(text, match)
+                and _word_count(text[: match.end()]) >= self._min_words
+            ):
+                end = match.end() + 1
+        return end
+
+    async def handle_interruption(self):
+        """Bei Unterbrechung den angefangenen Abschnitt verwerfen."""
+        await self.reset()
+
+    async def reset(self):
+        """Für die nächste Antwort zurücksetzen."""
+        self._text = ""
+        self._first_sent = False
+        self._started_at = None
+
+
+class ChunkingStats:
+    """Prozessweite Zähler: Zeit vom ersten Token bis zum ersten Chunk."""
+
+    def __init__(self):
+        """Leere Statistik."""
+        self.first_chunk = LatencyHistogram()
+        self.reasons: Counter = Counter()
+
+    def observe_first_chunk(self, reason: str, secs: float):
+        """Zeit bis zum ersten Abschnitt und den Grund für den Schnitt zählen."""
+        self.reasons[reason] += 1
+        self.first_chunk.observe(secs)
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        count = self.first_chunk.count
+        p95 = self.first_chunk.percentile(95)
+        return {
+            "first_chunks": count,
+            "first_chunk_reasons": dict(self.reasons),
+            "avg_first_chunk_ms": round(self.first_chunk.sum / count * 1000, 1) if count else None,
+            # Über dem größten Bucket ist das Perzentil inf, das kann JSON nicht
+            "p95_first_chunk_secs": p95 if p95 != float("inf") else None,
+        }
+
+
+def text_aggregator(*, stats: Optional[ChunkingStats] = None) -> BaseTextAggregator:
+    """Aggregator nach TTS_CHUNKING (`clause` oder `sentence` wie Pipecat)."""
+    if os.getenv("TTS_CHUNKING", "clause").lower() == "sentence":
+        return SimpleTextAggregator()
+    return ClauseTextAggregator(
+        first_min_words=int(os.getenv("TTS_FIRST_CHUNK_MIN_WORDS", "3")),
+        first_max_words=int(os.getenv("TTS_FIRST_CHUNK_MAX_WORDS", "10")),
+        min_words=int(os.getenv("TTS_CHUNK_MIN_WORDS", "6")),
+        stats=stats,
+    )
+
+
+# Ein Zähler pro Prozess, wird von allen Anrufen geteilt
+chunking_stats = ChunkingStats()
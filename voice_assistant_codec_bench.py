@@ -0,0 +1,181 @@
+#
+# Mikrobenchmark: Twilio media Nachrichten, Codec gegen JSON
+#
+# Simuliert N gleichzeitige Streams im 20ms Takt: pro Takt und Stream wird
+# ein eingehendes media Event (wie Twilio es sendet) zu einem
+# InputAudioRawFrame und ein ausgehender Frame zu einer media Nachricht. Alle
+# Streams laufen auf einem Event Loop, wie im Worker. Verglichen werden:
+#
+#   pipecat   TwilioFrameSerializer (JSON, base64, Resampler)
+#   json      der bisherige 8kHz Weg (json.loads/json.dumps, base64 Modul)
+#   codec     TelephonyFrameSerializer mit voice_assistant_twilio_codec
+#
+# Ausgabe pro Variante: µs pro Nachricht, Anteil eines CPU Kerns bei N
+# Streams in Echtzeit.
+#
+#   python voice_assistant_codec_bench.py --streams 100,200,400 --secs 10
+#
+
+"""Mikrobenchmark: Twilio media Nachrichten, Codec gegen JSON."""
+
+import argparse
+import asyncio
+import audioop
+import base64
+import json
+import time
+from typing import Dict, List
+
+import numpy as np
+from pipecat.frames.frames import InputAudioRawFrame, StartFrame, TTSAudioRawFrame
+from pipecat.serializers.twilio import TwilioFrameSerializer
+
+from voice_assistant_telephony import TELEPHONY_SAMPLE_RATE, TelephonyFrameSerializer
+
+FRAME_SECS = 0.02
+FRAME_SAMPLES = 160
+
+
+class JsonTelephonyFrameSerializer(TelephonyFrameSerializer):
+    """Der 8kHz Weg vor dem Codec (nur für den Vergleich)."""
+
+    def _serialize_ulaw(self, ulaw: bytes) -> str | None:
+        if not ulaw:
+            return None
+        return json.dumps(
+            {
+                "event": "media",
+                "streamSid": self._stream_sid,
+                "media": {"payload": base64.b64encode(ulaw).decode("utf-8")},
+            }
+        )
+
+    async def deserialize(self, data: str | bytes):
+        """Media Nachrichten mit json und base64 dekodieren."""
+        message = json.loads(data)
+        if message["event"] != "media":
+            return await super().deserialize(data)
+        payload = base64.b64decode(message["media"]["payload"])
+        if not payload:
+            return None
+        return InputAudioRawFrame(
+            audio=audioop.ulaw2lin(payload, 2),
+            num_channels=1,
+            sample_rate=TELEPHONY_SAMPLE_RATE,
+        )
+
+
+SERIALIZERS = {
+    "pipecat": TwilioFrameSerializer,
+    "json": JsonTelephonyFrameSerializer,
+    "codec": TelephonyFrameSerializer,
+}
+
+
+def twilio_media_messages(stream_sid: str, frames: int, seed: int) -> List[str]:
+    """Media Events im Format von Twilio (kompaktes JSON, alle Felder)."""
+    rng = np.random.default_rng(seed)
+    messages = []
+    for i in range(frames):
+        pcm = (rng.standard_normal(FRAME_SAMPLES) * 3000).astype(np.int16).tobytes()
+        payload = base64.b64encode(audioop.lin2ulaw(pcm, 2)).decode("ascii")
+        messages.append(
+            json.dumps(
+                {
+                    "event": "media",
+                    "sequenceNumber": str(i + 3),
+                    "media": {
+                        "track": "inbound",
+                        "chunk": str(i + 1),
+                        "timestamp": str(i * 20),
+                        "payload": payload,
+                    },
+                    "streamSid": stream_sid,
+                },
+                separators=(",", ":"),
+            )
+        )
+    return messages
+
+
+async def run_variant(name: str, streams: int, frames: int) -> Dict:
+    """Eine Variante mit der gegebenen Zahl paralleler Streams messen."""
+    serializers = []
+    for i in range(streams):
+        serializer = SERIALIZERS[name](
+            f"MZ{i:032x}", params=TwilioFrameSerializer.InputParams(auto_hang_up=False)
+        )
+        await serializer.setup(
+            StartFrame(
+                audio_in_sample_rate=TELEPHONY_SAMPLE_RATE,
+                audio_out_sample_rate=TELEPHONY_SAMPLE_RATE,
+            )
+        )
+        serializers.append(serializer)
+    # Wenige verschiedene Nachrichten reichen, der Inhalt ändert die Kosten nicht
+    inbound = [twilio_media_messages(f"MZ{i:032x}", 50, i) for i in range(min(streams, 8))]
+    outbound = TTSAudioRawFrame(
+        audio=np.zeros(FRAME_SAMPLES, dtype=np.int16).tobytes(),
+        sample_rate=TELEPHONY_SAMPLE_RATE,
+        num_channels=1,
+    )
+
+    async def stream(index: int):
+        serializer = serializers[index]
+        messages = inbound[index % len(inbound)]
+        for i in range(frames):
+            frame = await serializer.deserialize(messages[i % len(messages)])
+            assert frame is not None and len(frame.audio) == FRAME_SAMPLES * 2
+            assert await serializer.serialize(outbound)
+            # Ein Takt pro Stream, dann kommen die anderen Streams dran
+            await asyncio.sleep(0)
+
+    started_cpu = time.process_time()
+    started = time.perf_counter()
+    await asyncio.gather(*[stream(i) for i in range(streams)])
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - started_cpu
+
+    messages = streams * frames * 2
+    audio_secs = frames * FRAME_SECS
+    return {
+        "variant": name,
+        "streams": streams,
+        "us_per_message": round(elapsed / messages * 1e6, 2),
+        "core_share": round(cpu / audio_secs, 3),
+    }
+
+
+def print_table(results: List[Dict]):
+    """Ergebnisse als Tabelle ausgeben."""
+    header = f"{'Variante':<10}{'Streams':>8}{'µs/Nachricht':>14}{'CPU Kern':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(
+            f"{r['variant']:<10}{r['streams']:>8}{r['us_per_message']:>14}{r['core_share']:>10.1%}"
+        )
+
+
+async def main(args):
+    """Alle Varianten für alle Stream-Zahlen messen."""
+    results = []
+    frames = int(args.secs / FRAME_SECS)
+    for streams in [int(s) for s in args.streams.split(",")]:
+        for name in args.variants.split(","):
+            results.append(await run_variant(name, streams, frames))
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print_table(results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Twilio media Codec gegen JSON")
+    parser.add_argument(
+        "--streams", default="100,200", help="Gleichzeitige Streams pro Stufe, kommagetrennt"
+    )
+    parser.add_argument("--secs", type=float, default=5.0, help="Simulierte Audiodauer pro Stream")
+    parser.add_argument("--variants", default=",".join(SERIALIZERS))
+    parser.add_argument("--json", action="store_true")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,393 @@
+#
+# Prozessweite Verbindungen zu Deepgram, OpenAI und ElevenLabs
+#
+# Bisher baut jeder Anruf eigene Clients und Verbindungen auf (TLS Handshake,
+# HTTP Client, WebSocket Connect). Hier werden HTTP Clients zwischen allen
+# Anrufen geteilt, und pro Anbieter und Konfiguration liegt eine kleine
+# Reserve bereits geöffneter Streaming-Sockets bereit. Ein neuer Anruf (oder
+# ein Reconnect) übernimmt einen davon, die Reserve wird im Hintergrund
+# wieder aufgefüllt. Ungenutzte Sockets werden regelmäßig geprüft und nach
+# `max_idle_secs` ersetzt, bevor der Anbieter sie wegen Inaktivität schließt.
+#
+# Die Pools entstehen beim ersten Anruf mit einer Konfiguration (die z.B. die
+# Sample-Rate aus dem StartFrame enthält), ab dem zweiten Anruf greifen sie.
+#
+
+"""Prozessweite Verbindungen zu Deepgram, OpenAI und ElevenLabs."""
+
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Generic, List, Optional, Tuple, TypeVar
+
+import aiohttp
+import httpx
+from deepgram import DeepgramClient, DeepgramClientOptions, LiveTranscriptionEvents
+from loguru import logger
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from pipecat.services.deepgram.stt import DeepgramSTTService
+from pipecat.services.elevenlabs.tts import ElevenLabsTTSService
+from pipecat.services.openai.llm import OpenAILLMService
+from websockets.asyncio.client import connect as websocket_connect
+from websockets.protocol import State
+
+T = TypeVar("T")
+
+# Intervall der Hintergrundprüfung der Reserve
+MAINTAIN_INTERVAL_SECS = 1.0
+
+# ElevenLabs schließt WebSockets nach 20s ohne Text, Deepgram bleibt per KeepAlive offen
+ELEVENLABS_MAX_IDLE_SECS = 15.0
+DEEPGRAM_MAX_IDLE_SECS = 60.0
+
+# Wie pipecat: maximale Nachrichtengröße für lange Audio-Antworten
+ELEVENLABS_MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+
+class StreamPool(Generic[T]):
+    """Reserve geöffneter, unbenutzter Streaming-Verbindungen für genau eine Konfiguration."""
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        connect: Callable[[], Awaitable[T]],
+        close: Callable[[T], Awaitable[Any]],
+        is_open: Callable[[T], Awaitable[bool]],
+        reserve: int,
+        max_idle_secs: float,
+    ):
+        """connect/close öffnen und schließen eine Verbindung, reserve hält sie vorrätig."""
+        self.name = name
+        self._connect = connect
+        self._close = close
+        self._is_open = is_open
+        self._reserve = reserve
+        self._max_idle_secs = max_idle_secs
+        self._idle: List[Tuple[float, T]] = []  # (geöffnet um, Verbindung)
+        self._connecting = 0
+        self._task: Optional[asyncio.Task] = None
+        self.hits = 0
+        self.misses = 0
+        self.opened = 0
+        self.recycled = 0
+        self.failures = 0
+
+    @property
+    def idle(self) -> int:
+        """Vorrätige Verbindungen."""
+        return len(self._idle)
+
+    def start(self):
+        """Auffüllen im Hintergrund starten."""
+        if self._reserve > 0 and not self._task:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def take(self) -> Optional[T]:
+        """Jüngste gesunde Verbindung aus der Reserve oder None (dann selbst verbinden)."""
+        while self._idle:
+            _, connection = self._idle.pop()
+            if await self._is_open(connection):
+                self.hits += 1
+                return connection
+            self.recycled += 1
+        self.misses += 1
+        return None
+
+    async def _maintain(self):
+        while True:
+            try:
+                await self._recycle()
+                missing = self._reserve - len(self._idle) - self._connecting
+                if missing > 0:
+                    await asyncio.gather(*(self._open() for _ in range(missing)))
+            except Exception as e:
+                logger.warning(f"Verbindungs-Pool {self.name}: {e}")
+            await asyncio.sleep(MAINTAIN_INTERVAL_SECS)
+
+    async def _recycle(self):
+        now = time.monotonic()
+        healthy = []
+        for opened_at, connection in self._idle:
+            if now - opened_at < self._max_idle_secs and await self._is_open(connection):
+                healthy.append((opened_at, connection))
+            else:
+                self.recycled += 1
+                await self._close_quietly(connection)
+        # Während der Prüfung übernommene Verbindungen nicht zurücklegen
+        self._idle = [entry for entry in healthy if entry in self._idle]
+
+    async def _open(self):
+        self._connecting += 1
+        try:
+            connection = await self._connect()
+            self._idle.append((time.monotonic(), connection))
+            self.opened += 1
+        except Exception as e:
+            self.failures += 1
+            logger.debug(f"Verbindungs-Pool {self.name}: Verbindung fehlgeschlagen: {e}")
+        finally:
+            self._connecting -= 1
+
+    async def _close_quietly(self, connection: T):
+        try:
+            await self._close(connection)
+        except Exception:
+            pass
+
+    async def close(self):
+        """Auffüllen beenden und vorrätige Verbindungen schließen."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        idle, self._idle = self._idle, []
+        for _, connection in idle:
+            await self._close_quietly(connection)
+
+
+class ProviderConnections:
+    """Geteilte HTTP Clients und Socket-Pools aller Anrufe eines Worker-Prozesses."""
+
+    def __init__(self, *, reserve: int = 2):
+        """Pro Pool werden reserve Verbindungen vorgeöffnet."""
+        self._reserve = reserve
+        self._openai_clients: Dict[Tuple[str, str], AsyncOpenAI] = {}
+        self._deepgram_clients: Dict[Tuple[str, str], DeepgramClient] = {}
+        self._http_session: Optional[aiohttp.ClientSession] = None
+        self._pools: Dict[Tuple[str, str], StreamPool] = {}
+
+    def openai_client(self, **kwargs) -> AsyncOpenAI:
+        """Ein AsyncOpenAI Client (mit Keep-Alive Verbindungen) pro API Key und Base URL."""
+        key = (str(kwargs.get("api_key")), str(kwargs.get("base_url")))
+        client = self._openai_clients.get(key)
+        if client is None:
+            client = AsyncOpenAI(
+                **kwargs,
+                http_client=DefaultAsyncHttpxClient(
+                    limits=httpx.Limits(
+                        max_keepalive_connections=100, max_connections=1000, keepalive_expiry=None
+                    )
+                ),
+            )
+            self._openai_clients[key] = client
+        return client
+
+    def deepgram_client(self, api_key: str, base_url: str) -> DeepgramClient:
+        """Ein Deepgram Client (mit KeepAlive) pro API Key und Base URL."""
+        key = (api_key, base_url)
+        client = self._deepgram_clients.get(key)
+        if client is None:
+            client = DeepgramClient(
+                api_key, config=DeepgramClientOptions(url=base_url, options={"keepalive": "true"})
+            )
+            self._deepgram_clients[key] = client
+        return client
+
+    def http_session(self) -> aiohttp.ClientSession:
+        """Geteilte aiohttp Session (z.B. für ElevenLabs HTTP Synthese)."""
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = aiohttp.ClientSession()
+        return self._http_session
+
+    def pool(
+        self,
+        provider: str,
+        key: str,
+        *,
+        connect: Callable[[], Awaitable[T]],
+        close: Callable[[T], Awaitable[Any]],
+        is_open: Callable[[T], Awaitable[bool]],
+        max_idle_secs: float,
+    ) -> StreamPool[T]:
+        """Pool für eine Anbieter-Konfiguration, wird beim ersten Aufruf angelegt."""
+        pool = self._pools.get((provider, key))
+        if pool is None:
+            pool = StreamPool(
+                provider,
+                connect=connect,
+                close=close,
+                is_open=is_open,
+                reserve=self._reserve,
+                max_idle_secs=max_idle_secs,
+            )
+            self._pools[(provider, key)] = pool
+            pool.start()
+        return pool
+
+    async def close(self):
+        """Schließt Pools und Sessions (beim Herunterfahren des Workers)."""
+        for pool in self._pools.values():
+            await pool.close()
+        self._pools.clear()
+        if self._http_session:
+            await self._http_session.close()
+        for client in self._openai_clients.values():
+            await client.close()
+        self._openai_clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Reserve und Treffer pro Anbieter für /health."""
+        providers: Dict[str, Dict[str, int]] = {}
+        for pool in self._pools.values():
+            stats = providers.setdefault(
+                pool.name,
+                dict.fromkeys(
+                    ("configs", "idle", "hits", "misses", "opened", "recycled", "failures"), 0
+                ),
+            )
+            stats["configs"] += 1
+            stats["idle"] += pool.idle
+            stats["hits"] += pool.hits
+            stats["misses"] += pool.misses
+            stats["opened"] += pool.opened
+            stats["recycled"] += pool.recycled
+            stats["failures"] += pool.failures
+        return {
+            "reserve": self._reserve,
+            "openai_clients": len(self._openai_clients),
+            "providers": providers,
+        }
+
+
+class PooledOpenAILLMService(OpenAILLMService):
+    """OpenAI LLM auf dem geteilten Client statt eigenem HTTP Client pro Anruf."""
+
+    def create_client(
+        self,
+        api_key=None,
+        base_url=None,
+        organization=None,
+        project=None,
+        default_headers=None,
+        **kwargs,
+    ):
+        """Geteilten Client aus dem Prozess verwenden."""
+        return provider_connections.openai_client(
+            api_key=api_key,
+            base_url=base_url,
+            organization=organization,
+            project=project,
+            default_headers=default_headers,
+        )
+
+
+class PooledDeepgramSTTService(DeepgramSTTService):
+    """Deepgram STT, das eine bereits geöffnete Live-Verbindung aus dem Pool übernimmt."""
+
+    def __init__(self, *, api_key: str, base_url: str = "", **kwargs):
+        """Deepgram Service mit dem geteilten Client."""
+        super().__init__(api_key=api_key, base_url=base_url, **kwargs)
+        # Geteilter Client statt eines eigenen pro Anruf
+        self._client = provider_connections.deepgram_client(api_key, base_url)
+        self._pool_config = (api_key, base_url)
+
+    def _stream_pool(self) -> StreamPool:
+        api_key, base_url = self._pool_config
+        client = self._client
+        settings, addons = dict(self._settings), self._addons
+
+        async def connect():
+            connection = client.listen.asyncwebsocket.v("1")
+            if not await connection.start(options=settings, addons=addons):
+                raise Exception("Deepgram Verbindung fehlgeschlagen")
+            return connection
+
+        async def is_open(connection) -> bool:
+            return await connection.is_connected()
+
+        async def close(connection):
+            await connection.finish()
+
+        key = json.dumps([api_key, base_url, settings, addons], sort_keys=True, default=str)
+        return provider_connections.pool(
+            "deepgram",
+            key,
+            connect=connect,
+            close=close,
+            is_open=is_open,
+            max_idle_secs=DEEPGRAM_MAX_IDLE_SECS,
+        )
+
+    async def _connect(self):
+        connection = await self._stream_pool().take()
+        if connection is None:
+            await super()._connect()
+            return
+
+        logger.debug("Deepgram Verbindung aus dem Pool übernommen")
+        self._connection = connection
+        # Wie DeepgramSTTService._connect, nur ohne start()
+        self._connection.on(
+            LiveTranscriptionEvents(LiveTranscriptionEvents.Transcript), self._on_message
+        )
+        self._connection.on(LiveTranscriptionEvents(LiveTranscriptionEvents.Error), self._on_error)
+        if self.vad_enabled:
+            self._connection.on(
+                LiveTranscriptionEvents(LiveTranscriptionEvents.SpeechStarted),
+                self._on_speech_started,
+            )
+            self._connection.on(
+                LiveTranscriptionEvents(LiveTranscriptionEvents.UtteranceEnd),
+                self._on_utterance_end,
+            )
+
+
+class PooledElevenLabsTTSService(ElevenLabsTTSService):
+    """ElevenLabs WebSocket TTS, das einen bereits geöffneten Socket aus dem Pool übernimmt."""
+
+    def _stream_url(self) -> Optional[str]:
+        """URL wie in ElevenLabsTTSService._connect_websocket (nur für die Standard-Optionen)."""
+        settings = self._settings
+        if (
+            settings["enable_ssml_parsing"]
+            or settings["enable_logging"]
+            or settings["apply_text_normalization"] is not None
+            or settings["language"] is not None
+        ):
+            return None
+        return (
+            f"{self._url}/v1/text-to-speech/{self._voice_id}/multi-stream-input"
+            f"?model_id={self.model_name}&output_format={self._output_format}"
+            f"&auto_mode={settings['auto_mode']}"
+        )
+
+    async def _connect_websocket(self):
+        url = self._stream_url()
+        if not url or (self._websocket and self._websocket.state is State.OPEN):
+            await super()._connect_websocket()
+            return
+
+        api_key = self._api_key
+
+        async def connect():
+            return await websocket_connect(
+                url,
+                max_size=ELEVENLABS_MAX_MESSAGE_BYTES,
+                additional_headers={"xi-api-key": api_key},
+            )
+
+        async def is_open(websocket) -> bool:
+            return websocket.state is State.OPEN
+
+        async def close(websocket):
+            await websocket.close()
+
+        pool = provider_connections.pool(
+            "elevenlabs",
+            f"{url}\x00{api_key}",
+            connect=connect,
+            close=close,
+            is_open=is_open,
+            max_idle_secs=ELEVENLABS_MAX_IDLE_SECS,
+        )
+        websocket = await pool.take()
+        if websocket is None:
+            await super()._connect_websocket()
+            return
+        logger.debug("ElevenLabs Verbindung aus dem Pool übernommen")
+        self._websocket = websocket
+
+
+# Ein Satz Verbindungen pro Worker-Prozess, wird von allen Anrufen geteilt
+provider_connections = ProviderConnections(reserve=int(os.getenv("PROVIDER_SOCKET_RESERVE", "2")))
@@ -0,0 +1,296 @@
+#
+# Begrenzter Gesprächskontext mit Token-Budget und laufender Zusammenfassung
+#
+# Der Kontext wächst sonst über den ganzen Anruf, jede Runde schickt den
+# kompletten Verlauf an OpenAI. Hier bleiben System Prompt und die letzten
+# Runden wörtlich erhalten, ältere Runden werden im Hintergrund (während der
+# Anrufer spricht) zu einer Zusammenfassung verdichtet. Die Zusammenfassung
+# wird erst zu Beginn der nächsten Runde eingesetzt, dazwischen wächst der
+# Kontext nur hinten an. So bleibt der Anfang der Nachrichten byte-gleich und
+# das Prompt Caching bei OpenAI greift.
+#
+# Pipeline: context_aggregator.user() -> context_budget.processor() -> llm
+#
+
+"""Begrenzter Gesprächskontext mit Token-Budget und laufender Zusammenfassung."""
+
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from pipecat.frames.frames import (
+    CancelFrame,
+    EndFrame,
+    Frame,
+    LLMContextFrame,
+    UserStartedSpeakingFrame,
+)
+from pipecat.processors.aggregators.llm_context import LLMContext
+from pipecat.processors.aggregators.openai_llm_context import (
+    OpenAILLMContext,
+    OpenAILLMContextFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from pipecat.services.openai.base_llm import BaseOpenAILLMService
+
+# Ab diesem Anteil des Budgets wird im Hintergrund zusammengefasst
+SUMMARY_THRESHOLD = 0.75
+
+# Grobe Schätzung ohne Tokenizer: ~4 Zeichen pro Token plus Overhead pro Nachricht
+CHARS_PER_TOKEN = 4
+TOKENS_PER_MESSAGE = 4
+
+SUMMARY_PREFIX = "Zusammenfassung des bisherigen Gesprächs:"
+
+SUMMARY_PROMPT = (
+    "Fasse das folgende Telefongespräch zwischen Anrufer und Assistentin in wenigen "
+    "kurzen Sätzen auf Deutsch zusammen. Behalte alle Namen, Telefonnummern, Termine, "
+    "Anliegen und Zusagen. Keine Einleitung, nur die Zusammenfassung."
+)
+
+
+def message_text(message: Any) -> str:
+    """Textinhalt einer Nachricht (auch Tool Calls und Listen-Inhalte)."""
+    if not isinstance(message, dict):
+        return str(message)
+    content = message.get("content")
+    if isinstance(content, list):
+        text = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    else:
+        text = content or ""
+    if message.get("tool_calls"):
+        text += json.dumps(message["tool_calls"], ensure_ascii=False)
+    return text
+
+
+def estimate_tokens(messages: List[Any]) -> int:
+    """Geschätzte Prompt Tokens einer Nachrichtenliste."""
+    return sum(
+        TOKENS_PER_MESSAGE + (len(message_text(m)) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+        for m in messages
+    )
+
+
+def _is_summary(message: Any) -> bool:
+    return (
+        isinstance(message, dict)
+        and message.get("role") == "system"
+        and str(message.get("content", "")).startswith(SUMMARY_PREFIX)
+    )
+
+
+def _is_user(message: Any) -> bool:
+    return isinstance(message, dict) and message.get("role") == "user"
+
+
+def _prompt_end(messages: List[Any]) -> int:
+    """Index nach den führenden System Nachrichten (die Zusammenfassung zählt nicht dazu)."""
+    for i, message in enumerate(messages):
+        if not (isinstance(message, dict) and message.get("role") == "system") or _is_summary(
+            message
+        ):
+            return i
+    return len(messages)
+
+
+class ContextStats:
+    """Prozessweite Zähler für /health."""
+
+    def __init__(self):
+        """Leere Statistik."""
+        self.turns = 0
+        self.prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.summaries = 0
+        self.summary_failures = 0
+        self.trimmed_turns = 0
+
+    def observe_turn(self, tokens: int):
+        """Prompt Tokens eines Turns zählen."""
+        self.turns += 1
+        self.prompt_tokens += tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, tokens)
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        return {
+            "turns": self.turns,
+            "avg_prompt_tokens": round(self.prompt_tokens / self.turns) if self.turns else None,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "summaries": self.summaries,
+            "summary_failures": self.summary_failures,
+            "trimmed_turns": self.trimmed_turns,
+        }
+
+
+class ContextBudget:
+    """Hält den Kontext eines Anrufs unter `max_tokens`.
+
+    Aufteilung der Nachrichten: führende System Nachrichten (Prompt), optional
+    die Zusammenfassung, danach die Runden (jeweils ab einer User Nachricht).
+    Die Zusammenfassung wird bei der nächsten Verdichtung mit zusammengefasst.
+    Die letzten `keep_turns` Runden bleiben immer wörtlich erhalten.
+    """
+
+    def __init__(
+        self,
+        context: LLMContext | OpenAILLMContext,
+        llm: BaseOpenAILLMService,
+        *,
+        max_tokens: int = 4000,
+        keep_turns: int = 4,
+        call_sid: str = "",
+        stats: Optional[ContextStats] = None,
+    ):
+        """Budget für den Kontext eines Anrufs."""
+        self._context = context
+        self._llm = llm
+        self._max_tokens = max_tokens
+        self._keep_turns = keep_turns
+        self._call_sid = call_sid
+        self._stats = stats or context_stats
+        self._processor = ContextBudgetProcessor(self)
+
+        self._summary_task: Optional[asyncio.Task] = None
+        # Fertige Zusammenfassung und die Nachrichten, die sie ersetzt
+        self._pending: Optional[Tuple[List[Any], Dict[str, str]]] = None
+        self.turn_tokens: List[int] = []
+
+    def processor(self) -> FrameProcessor:
+        """Pipeline-Stufe zwischen User-Aggregator und LLM."""
+        return self._processor
+
+    def _split(self, messages: List[Any]) -> Tuple[int, int]:
+        """Ende des Prompts und Beginn der behaltenen Runden."""
+        prefix = _prompt_end(messages)
+        user_starts = [i for i in range(prefix, len(messages)) if _is_user(messages[i])]
+        if len(user_starts) <= self._keep_turns:
+            return prefix, prefix
+        return prefix, user_starts[-self._keep_turns]
+
+    def on_turn(self):
+        """Neuer Kontext geht an das LLM: Tokens zählen, bei Bedarf kürzen/zusammenfassen."""
+        messages = self._context.get_messages()
+        tokens = estimate_tokens(messages)
+        if tokens > self._max_tokens:
+            tokens = self._trim(messages)
+        self.turn_tokens.append(tokens)
+        self._stats.observe_turn(tokens)
+        logger.debug(f"Kontext {self._call_sid}: {tokens} Tokens ({len(messages)} Nachrichten)")
+
+        summarizing = self._summary_task or self._pending
+        if tokens > self._max_tokens * SUMMARY_THRESHOLD and not summarizing:
+            prefix, keep = self._split(self._context.get_messages())
+            old = list(self._context.get_messages()[prefix:keep])
+            # Erst verdichten, wenn sich genug Runden angesammelt haben, damit
+            # sich der Anfang des Kontexts nicht in jeder Runde ändert
+            if sum(1 for m in old if _is_user(m)) >= self._keep_turns:
+                self._summary_task = self._processor.create_task(self._summarize(old))
+
+    def _trim(self, messages: List[Any]) -> int:
+        """Notbremse ohne fertige Zusammenfassung: älteste Runden verwerfen."""
+        messages = list(messages)
+        prefix, keep = self._split(messages)
+        # Die Zusammenfassung bleibt, verworfen wird dahinter
+        if prefix < keep and _is_summary(messages[prefix]):
+            prefix += 1
+        tokens = estimate_tokens(messages)
+        while tokens > self._max_tokens and keep > prefix:
+            end = next(i for i in range(prefix + 1, keep + 1) if i == keep or _is_user(messages[i]))
+            del messages[prefix:end]
+            keep -= end - prefix
+            self._stats.trimmed_turns += 1
+            tokens = estimate_tokens(messages)
+        self._context.set_messages(messages)
+        # Eine laufende oder fertige Zusammenfassung passt nicht mehr zum Kontext
+        self._pending = None
+        if self._summary_task:
+            self._summary_task.cancel()
+            self._summary_task = None
+        return tokens
+
+    async def _summarize(self, old: List[Any]):
+        task = asyncio.current_task()
+        previous = next((m["content"] for m in old if _is_summary(m)), "")
+        transcript = "\n".join(
+            f"{m.get('role')}: {message_text(m)}"
+            for m in old
+            if isinstance(m, dict) and not _is_summary(m) and message_text(m)
+        )
+        if previous:
+            transcript = f"{previous}\n{transcript}"
+        try:
+            summary = await self._llm.run_inference(
+                OpenAILLMContext(
+                    [
+                        {"role": "system", "content": SUMMARY_PROMPT},
+                        {"role": "user", "content": transcript},
+                    ]
+                )
+            )
+        except Exception as e:
+            logger.warning(f"Kontext-Zusammenfassung fehlgeschlagen: {e}")
+            summary = None
+        # Inzwischen gekürzt: die Zusammenfassung gehört zu einem alten Kontext
+        if self._summary_task is not task:
+            return
+        self._summary_task = None
+        if summary:
+            self._pending = (
+                old,
+                {"role": "system", "content": f"{SUMMARY_PREFIX} {summary.strip()}"},
+            )
+        else:
+            self._stats.summary_failures += 1
+
+    def on_user_started(self):
+        """Neue Runde beginnt: fertige Zusammenfassung einsetzen."""
+        if not self._pending:
+            return
+        old, summary = self._pending
+        self._pending = None
+        messages = self._context.get_messages()
+        prefix = _prompt_end(messages)
+        # Der Kontext wurde inzwischen anders verändert (z.B. gekürzt)
+        if messages[prefix : prefix + len(old)] != old:
+            return
+        before = estimate_tokens(messages)
+        messages = messages[:prefix] + [summary] + messages[prefix + len(old) :]
+        self._context.set_messages(messages)
+        self._stats.summaries += 1
+        logger.debug(
+            f"Kontext {self._call_sid} zusammengefasst: {before} -> {estimate_tokens(messages)} Tokens"
+        )
+
+    async def cancel(self):
+        """Laufende Zusammenfassung abbrechen."""
+        self._pending = None
+        if self._summary_task:
+            await self._processor.cancel_task(self._summary_task)
+            self._summary_task = None
+
+
+class ContextBudgetProcessor(FrameProcessor):
+    """Zählt die Tokens jeder Runde und setzt Zusammenfassungen am Rundenbeginn ein."""
+
+    def __init__(self, budget: ContextBudget, **kwargs):
+        """Prozessor vor dem LLM, der das Budget pro Turn prüft."""
+        super().__init__(**kwargs)
+        self._budget = budget
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        """Vor jedem LLM Aufruf den Kontext kürzen, falls nötig."""
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, (OpenAILLMContextFrame, LLMContextFrame)):
+            self._budget.on_turn()
+        elif isinstance(frame, UserStartedSpeakingFrame):
+            self._budget.on_user_started()
+        elif isinstance(frame, (EndFrame, CancelFrame)):
+            await self._budget.cancel()
+        await self.push_frame(frame, direction)
+
+
+# Ein Zähler pro Prozess, wird von allen Anrufen geteilt
+context_stats = ContextStats()
@@ -0,0 +1,135 @@
+#
+# Cache für vorgerenderte Begrüßungs-Audios
+#
+# Die Begrüßung ist immer derselbe Satz. Statt pro Anruf einen LLM Roundtrip
+# plus ElevenLabs Synthese abzuwarten, wird sie einmal als ulaw_8000 Audio
+# gerendert und bei jedem Anruf sofort abgespielt. Schlägt das Rendern fehl,
+# wird es erst nach einer Pause wieder versucht, die Anrufe dazwischen
+# bekommen sofort die normale Begrüßung über LLM und TTS.
+#
+
+"""Cache für vorgerenderte Begrüßungs-Audios."""
+
+import asyncio
+import audioop
+import os
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from pipecat.frames.frames import Frame, TTSAudioRawFrame, TTSStartedFrame, TTSStoppedFrame
+
+from voice_assistant_connections import provider_connections
+
+# Überschreibbar, z.B. für die lokalen Stub-Dienste im Lasttest
+ELEVENLABS_API_URL = os.getenv("ELEVENLABS_API_URL", "https://api.elevenlabs.io")
+
+# 8kHz μ-law, ein Byte pro Sample
+ULAW_SAMPLE_RATE = 8000
+
+GreetingKey = Tuple[str, str, str, str]
+
+
+async def render_elevenlabs_audio(
+    text: str, *, api_key: str, voice_id: str, model: str, output_format: str
+) -> bytes:
+    """Synthetisiert Text einmalig über die ElevenLabs HTTP API."""
+    url = f"{ELEVENLABS_API_URL}/v1/text-to-speech/{voice_id}"
+    headers = {"xi-api-key": api_key, "Content-Type": "application/json"}
+    payload = {"text": text, "model_id": model}
+    # Geteilte Session, damit die Verbindung zu ElevenLabs offen bleibt
+    session = provider_connections.http_session()
+    async with session.post(
+        url, json=payload, headers=headers, params={"output_format": output_format}
+    ) as response:
+        if response.status != 200:
+            raise Exception(f"ElevenLabs Fehler {response.status}: {await response.text()}")
+        return await response.read()
+
+
+@dataclass
+class GreetingAudio:
+    """Vorgerenderte Begrüßung, einmalig dekodiert."""
+
+    text: str
+    pcm: bytes
+    duration_secs: float
+
+    @classmethod
+    def from_ulaw(cls, text: str, ulaw: bytes) -> "GreetingAudio":
+        """Dekodiert das μ-law Audio einmalig."""
+        return cls(
+            text=text,
+            pcm=audioop.ulaw2lin(ulaw, 2),
+            duration_secs=len(ulaw) / ULAW_SAMPLE_RATE,
+        )
+
+    def frames(self) -> List[Frame]:
+        """Neue Pipeline Frames für einen Anruf (Frames werden nicht geteilt)."""
+        return [
+            TTSStartedFrame(),
+            TTSAudioRawFrame(audio=self.pcm, sample_rate=ULAW_SAMPLE_RATE, num_channels=1),
+            TTSStoppedFrame(),
+        ]
+
+
+class GreetingCache:
+    """Begrüßungs-Audios, geschlüsselt nach Prompt, voice_id, Modell und Format."""
+
+    def __init__(self, *, retry_secs: float = 60.0):
+        """Leerer Cache, nach einem Fehler wird frühestens nach retry_secs neu gerendert."""
+        self._entries: Dict[GreetingKey, GreetingAudio] = {}
+        # Zeitpunkt (monotonic), ab dem ein fehlgeschlagener Eintrag neu versucht wird
+        self._retry_at: Dict[GreetingKey, float] = {}
+        self._retry_secs = retry_secs
+        self._lock = asyncio.Lock()
+
+    def _backing_off(self, key: GreetingKey) -> bool:
+        return time.monotonic() < self._retry_at.get(key, 0.0)
+
+    async def get(
+        self, text: str, *, api_key: str, voice_id: str, model: str, output_format: str
+    ) -> Optional[GreetingAudio]:
+        """Liefert die Begrüßung, beim ersten Zugriff wird sie gerendert."""
+        key = (text, voice_id, model, output_format)
+        greeting = self._entries.get(key)
+        if greeting:
+            return greeting
+        # Kürzlich fehlgeschlagen: nicht auf Lock und Timeout warten
+        if self._backing_off(key):
+            return None
+
+        if output_format != "ulaw_8000":
+            logger.warning(f"Begrüßungs-Cache unterstützt nur ulaw_8000, nicht {output_format}")
+            return None
+
+        # Gleichzeitige Anrufe sollen die Begrüßung nicht mehrfach rendern
+        async with self._lock:
+            greeting = self._entries.get(key)
+            if greeting or self._backing_off(key):
+                return greeting
+            try:
+                ulaw = await render_elevenlabs_audio(
+                    text,
+                    api_key=api_key,
+                    voice_id=voice_id,
+                    model=model,
+                    output_format=output_format,
+                )
+            except Exception as e:
+                self._retry_at[key] = time.monotonic() + self._retry_secs
+                logger.error(
+                    f"Begrüßung konnte nicht gerendert werden, "
+                    f"neuer Versuch in {self._retry_secs:.0f}s: {e}"
+                )
+                return None
+            greeting = GreetingAudio.from_ulaw(text, ulaw)
+            self._entries[key] = greeting
+            self._retry_at.pop(key, None)
+            logger.info(f"Begrüßung gerendert ({greeting.duration_secs:.1f}s): {text}")
+            return greeting
+
+
+# Ein Cache pro Prozess, wird von allen Anrufen geteilt
+greeting_cache = GreetingCache()
@@ -0,0 +1,518 @@
+#
+# Abgesicherte Anfragen (Hedging) an LLM und TTS
+#
+# Ein einzelner langsamer OpenAI oder ElevenLabs Aufruf bedeutet Stille am
+# Telefon. Kommt vom primären Anbieter nach einer Schwelle noch kein erstes
+# Token bzw. kein erstes Audio, startet dieselbe Anfrage zusätzlich beim
+# sekundären Anbieter. Wer zuerst liefert, gewinnt, die andere Anfrage wird
+# abgebrochen. Schlägt der primäre Aufruf vorher fehl, startet der sekundäre
+# sofort (Failover).
+#
+# Die Schwelle ist das p95 der letzten Erstantwort-Zeiten des primären
+# Anbieters, begrenzt auf [min_secs, max_secs]. So wird nur der langsame
+# Rand (etwa 5% der Anfragen) doppelt gestellt. Solange zu wenige Werte da
+# sind, gilt max_secs.
+#
+#   LLM: zweites Modell (oder zweiter Endpunkt), der Stream des Gewinners wird
+#        ab dem ersten Chunk weitergereicht
+#   TTS: der erste Chunk einer Antwort geht bei Verzögerung zusätzlich an
+#        Deepgram Aura (REST), gewinnt Deepgram, spricht es die ganze Antwort
+#
+# Hedge-Rate und Gewinnrate stehen unter /health (hedging).
+#
+
+"""Abgesicherte Anfragen (Hedging) an LLM und TTS."""
+
+import asyncio
+import json
+import os
+import time
+from collections import deque
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Deque,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from loguru import logger
+from pipecat.frames.frames import (
+    CancelFrame,
+    EndFrame,
+    Frame,
+    InterruptionFrame,
+    TTSAudioRawFrame,
+    TTSStoppedFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection
+
+from voice_assistant_connections import PooledOpenAILLMService, provider_connections
+from voice_assistant_telephony import UlawElevenLabsTTSService
+
+DEEPGRAM_API_URL = os.getenv("DEEPGRAM_TTS_BASE_URL", "https://api.deepgram.com")
+
+
+class HedgePolicy:
+    """Schwelle und Zähler eines Anbieters, geteilt von allen Anrufen."""
+
+    def __init__(
+        self,
+        name: str,
+        *,
+        min_secs: float,
+        max_secs: float,
+        percentile: float = 95,
+        window: int = 200,
+        min_samples: int = 20,
+    ):
+        """Schwelle als Perzentil der Latenzen, begrenzt auf min_secs bis max_secs."""
+        self.name = name
+        self._min_secs = min_secs
+        self._max_secs = max_secs
+        self._percentile = percentile
+        self._min_samples = min_samples
+        self._samples: Deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.hedged = 0
+        self.primary_wins = 0
+        self.secondary_wins = 0
+        self.failures = 0
+
+    def observe(self, secs: float):
+        """Erstantwort-Zeit des primären Anbieters (bei Abbruch: Zeit bis zum Abbruch)."""
+        self._samples.append(secs)
+
+    def threshold(self) -> float:
+        """Wartezeit bis zur zweiten Anfrage."""
+        if len(self._samples) < self._min_samples:
+            return self._max_secs
+        ordered = sorted(self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * self._percentile / 100))
+        return min(self._max_secs, max(self._min_secs, ordered[index]))
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.requests, 3) if self.requests else None,
+            "primary_wins": self.primary_wins,
+            "secondary_wins": self.secondary_wins,
+            # Anteil der abgesicherten Anfragen, die der sekundäre Anbieter gewonnen hat
+            "win_rate": round(self.secondary_wins / self.hedged, 3) if self.hedged else None,
+            "failures": self.failures,
+            "threshold_ms": round(self.threshold() * 1000, 1),
+        }
+
+
+class HedgeStats:
+    """Prozessweite Hedging-Richtlinien für /health."""
+
+    def __init__(
+        self,
+        *,
+        percentile: float,
+        llm_min_secs: float,
+        llm_max_secs: float,
+        tts_min_secs: float,
+        tts_max_secs: float,
+    ):
+        """Je eine Policy für LLM und TTS."""
+        self.llm = HedgePolicy(
+            "llm", min_secs=llm_min_secs, max_secs=llm_max_secs, percentile=percentile
+        )
+        self.tts = HedgePolicy(
+            "tts", min_secs=tts_min_secs, max_secs=tts_max_secs, percentile=percentile
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        return {"llm": self.llm.stats(), "tts": self.tts.stats()}
+
+
+async def hedge(
+    policy: HedgePolicy,
+    primary: Awaitable[Any],
+    secondary: Callable[[], Awaitable[Any]],
+    *,
+    discard: Optional[Callable[[str, Any], Awaitable[Any]]] = None,
+) -> Tuple[str, Any]:
+    """Wartet bis zur Schwelle auf `primary`, startet dann `secondary()` dazu.
+
+    Gibt ("primary" | "secondary", Ergebnis) des ersten erfolgreichen Aufrufs
+    zurück. Der Verlierer wird abgebrochen, ein trotzdem fertiges Ergebnis geht
+    an `discard`. Schlagen beide fehl, wird der Fehler des primären geworfen.
+    """
+    started = time.monotonic()
+    policy.requests += 1
+    tasks: Dict[str, asyncio.Future] = {"primary": asyncio.ensure_future(primary)}
+    winner: Optional[str] = None
+    try:
+        await asyncio.wait([tasks["primary"]], timeout=policy.threshold())
+        if tasks["primary"].done() and not tasks["primary"].exception():
+            winner = "primary"
+            policy.observe(time.monotonic() - started)
+            return winner, tasks["primary"].result()
+
+        # Zu langsam oder fehlgeschlagen: sekundären Anbieter dazu starten
+        policy.hedged += 1
+        tasks["secondary"] = asyncio.ensure_future(secondary())
+        while True:
+            for name, task in tasks.items():
+                if task.done() and not task.exception():
+                    winner = name
+                    break
+            if winner:
+                break
+            pending = [task for task in tasks.values() if not task.done()]
+            if not pending:
+                policy.failures += 1
+                raise tasks["primary"].exception()
+            await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+
+        if winner == "primary":
+            policy.primary_wins += 1
+        else:
+            policy.secondary_wins += 1
+        policy.observe(time.monotonic() - started)
+        logger.debug(
+            f"Hedging {policy.name}: {winner} gewinnt nach {time.monotonic() - started:.2f}s"
+        )
+        return winner, tasks[winner].result()
+    finally:
+        for name, task in tasks.items():
+            if name == winner:
+                continue
+            task.cancel()
+            result = (await asyncio.gather(task, return_exceptions=True))[0]
+            if discard and not isinstance(result, BaseException):
+                await discard(name, result)
+
+
+#
+# LLM
+#
+
+
+async def _first_chunk(client, params: Dict[str, Any]) -> Tuple[Any, Any]:
+    """Startet eine Completion und wartet auf den ersten Chunk."""
+    stream = await client.chat.completions.create(**params)
+    try:
+        return stream, await stream.__anext__()
+    except BaseException:
+        await stream.close()
+        raise
+
+
+async def _close_stream(name: str, result: Tuple[Any, Any]):
+    await result[0].close()
+
+
+class HedgedStream:
+    """Stream des Gewinners, beginnt mit dem bereits empfangenen ersten Chunk."""
+
+    def __init__(self, stream, first_chunk):
+        """Stream mit bereits gelesenem ersten Chunk."""
+        self._stream = stream
+        self._first_chunk = first_chunk
+
+    async def __aiter__(self):
+        yield self._first_chunk
+        async for chunk in self._stream:
+            yield chunk
+
+    async def close(self):
+        """Darunterliegenden Stream schließen."""
+        await self._stream.close()
+
+
+class HedgedOpenAILLMService(PooledOpenAILLMService):
+    """OpenAI LLM, das langsame Completions zusätzlich bei einem zweiten Modell anfragt."""
+
+    def __init__(
+        self,
+        *,
+        hedge_model: str,
+        hedge_api_key: Optional[str] = None,
+        hedge_base_url: Optional[str] = None,
+        policy: Optional[HedgePolicy] = None,
+        **kwargs,
+    ):
+        """hedge_model für die zweite Anfrage."""
+        super().__init__(**kwargs)
+        self._hedge_model = hedge_model
+        self._hedge_policy = policy or hedge_stats.llm
+        self._hedge_client = provider_connections.openai_client(
+            api_key=hedge_api_key or kwargs.get("api_key"),
+            base_url=hedge_base_url or kwargs.get("base_url"),
+        )
+
+    async def get_chat_completions(self, params_from_context):
+        """Stream der Anfrage, die zuerst einen Chunk liefert."""
+        params = self.build_chat_completion_params(params_from_context)
+        _, (stream, first_chunk) = await hedge(
+            self._hedge_policy,
+            _first_chunk(self._client, params),
+            lambda: _first_chunk(self._hedge_client, {**params, "model": self._hedge_model}),
+            discard=_close_stream,
+        )
+        return HedgedStream(stream, first_chunk)
+
+
+#
+# TTS
+#
+
+
+class DeepgramSpeakClient:
+    """Deepgram Aura über REST (/v1/speak), liefert linear16 Audio gestreamt."""
+
+    def __init__(self, *, api_key: str, voice: str, base_url: str = DEEPGRAM_API_URL):
+        """Client für die Deepgram Speak REST API."""
+        self._api_key = api_key
+        self._voice = voice
+        self._url = f"{base_url.rstrip('/')}/v1/speak"
+
+    async def stream(self, text: str, *, sample_rate: int) -> AsyncIterator[bytes]:
+        """Text als PCM Chunks streamen."""
+        params = {
+            "model": self._voice,
+            "encoding": "linear16",
+            "sample_rate": str(sample_rate),
+            "container": "none",
+        }
+        async with provider_connections.http_session().post(
+            self._url,
+            params=params,
+            headers={"Authorization": f"Token {self._api_key}"},
+            json={"text": text},
+        ) as response:
+            response.raise_for_status()
+            rest = b""
+            async for data in response.content.iter_any():
+                # Nur ganze 16-bit Samples weitergeben
+                data = rest + data
+                cut = len(data) - len(data) % 2
+                rest = data[cut:]
+                if cut:
+                    yield data[:cut]
+
+
+class _SecondaryTurn:
+    """Antwort, die Deepgram übernommen hat (ein Audio-Kontext, Texte der Reihe nach)."""
+
+    def __init__(self, context_id: str):
+        self.context_id = context_id
+        self.texts: asyncio.Queue = asyncio.Queue()
+        self.task: Optional[asyncio.Task] = None
+
+
+class HedgedElevenLabsTTSService(UlawElevenLabsTTSService):
+    """ElevenLabs WebSocket TTS mit Deepgram als Absicherung für das erste Audio.
+
+    Abgesichert wird nur der erste Chunk einer Antwort, dort entsteht die
+    Stille. Gewinnt Deepgram, wird der ElevenLabs Kontext geschlossen und der
+    Rest der Antwort ebenfalls von Deepgram gesprochen (kein Stimmwechsel
+    mitten in der Antwort). Die Wort-Zeitstempel werden dann gleichmäßig über
+    das Audio verteilt.
+    """
+
+    def __init__(
+        self,
+        *,
+        hedge_speaker: DeepgramSpeakClient,
+        policy: Optional[HedgePolicy] = None,
+        **kwargs,
+    ):
+        """hedge_speaker übernimmt, wenn ElevenLabs zu langsam ist."""
+        super().__init__(**kwargs)
+        self._hedge_speaker = hedge_speaker
+        self._hedge_policy = policy or hedge_stats.tts
+        self._watched_context: Optional[str] = None
+        # Weitere Texte der Antwort, die während der Absicherung an ElevenLabs gingen
+        self._watched_texts: List[str] = []
+        self._primary_audio = asyncio.Event()
+        self._watch_task: Optional[asyncio.Task] = None
+        self._secondary_turn: Optional[_SecondaryTurn] = None
+        self._abandoned_contexts: Set[str] = set()
+
+    def audio_context_available(self, context_id: str) -> bool:
+        """Übernommene Kontexte sind für ElevenLabs geschlossen."""
+        # Von Deepgram übernommene Kontexte nehmen kein ElevenLabs Audio mehr an
+        if context_id in self._abandoned_contexts:
+            return False
+        return super().audio_context_available(context_id)
+
+    async def append_to_audio_context(self, context_id: str, frame: TTSAudioRawFrame):
+        """Erstes Audio von ElevenLabs für den beobachteten Kontext melden."""
+        if context_id == self._watched_context:
+            self._primary_audio.set()
+        await super().append_to_audio_context(context_id, frame)
+
+    async def run_tts(self, text: str) -> AsyncGenerator[Frame, None]:
+        """Text sprechen, bei zu langsamem ersten Audio über Deepgram."""
+        turn = self._secondary_turn
+        if turn:
+            turn.texts.put_nowait(text)
+            yield None
+            return
+
+        first_chunk = not self._started
+        if not first_chunk and self._watched_context and self._watched_context == self._context_id:
+            # Gewinnt Deepgram, muss es auch diese Texte sprechen
+            self._watched_texts.append(text)
+        async for frame in super().run_tts(text):
+            yield frame
+        if first_chunk and self._started and self._context_id:
+            self._watched_context = self._context_id
+            self._watched_texts = []
+            self._primary_audio = asyncio.Event()
+            self._watch_task = self.create_task(self._watch_first_audio(self._context_id, text))
+
+    async def _watch_first_audio(self, context_id: str, text: str):
+        try:
+            winner, result = await hedge(
+                self._hedge_policy,
+                self._primary_audio.wait(),
+                lambda: self._secondary_first_audio(text),
+                discard=self._discard_secondary,
+            )
+        except Exception as e:
+            logger.warning(f"{self}: Abgesichertes TTS fehlgeschlagen: {e}")
+            return
+        finally:
+            self._watched_context = None
+            self._watch_task = None
+            watched_texts, self._watched_texts = self._watched_texts, []
+        if winner == "primary":
+            return
+
+        # Deepgram war schneller: ElevenLabs Kontext abbrechen
+        self._abandoned_contexts.add(context_id)
+        if self._context_id == context_id:
+            self._context_id = None
+        try:
+            if self._websocket:
+                await self._websocket.send(
+                    json.dumps({"context_id": context_id, "close_context": True})
+                )
+        except Exception as e:
+            logger.debug(f"{self}: ElevenLabs Kontext nicht geschlossen: {e}")
+
+        turn = _SecondaryTurn(context_id)
+        for watched_text in watched_texts:
+            turn.texts.put_nowait(watched_text)
+        self._secondary_turn = turn
+        audio, first_audio = result
+        turn.task = self.create_task(self._speak_secondary(turn, text, audio, first_audio))
+
+    async def _secondary_first_audio(self, text: str) -> Tuple[AsyncIterator[bytes], bytes]:
+        audio = self._hedge_speaker.stream(text, sample_rate=self.sample_rate)
+        try:
+            return audio, await audio.__anext__()
+        except BaseException:
+            await audio.aclose()
+            raise
+
+    async def _discard_secondary(self, name: str, result: Tuple[AsyncIterator[bytes], bytes]):
+        if name == "secondary":
+            await result[0].aclose()
+
+    async def _speak_secondary(
+        self, turn: _SecondaryTurn, text: str, audio: AsyncIterator[bytes], first_audio: bytes
+    ):
+        """Spielt den ersten Chunk und danach alle weiteren Texte der Antwort über Deepgram."""
+        await self.stop_ttfb_metrics()
+        self.start_word_timestamps()
+        try:
+            await self._append_secondary(turn.context_id, text, audio, first_audio)
+            while True:
+                text = await turn.texts.get()
+                if text is None:
+                    return
+                audio = self._hedge_speaker.stream(text, sample_rate=self.sample_rate)
+                await self._append_secondary(turn.context_id, text, audio)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"{self}: Deepgram TTS fehlgeschlagen: {e}")
+
+    async def _append_secondary(
+        self, context_id: str, text: str, audio: AsyncIterator[bytes], first_audio: bytes = b""
+    ):
+        num_bytes = 0
+        try:
+            async for chunk in _prepend(first_audio, audio):
+                queue = self._contexts.get(context_id)
+                if queue is None:
+                    return  # Unterbrochen
+                num_bytes += len(chunk)
+                await queue.put(TTSAudioRawFrame(chunk, self.sample_rate, 1))
+        finally:
+            await audio.aclose()
+
+        # Wörter gleichmäßig über das Audio verteilen (wie ElevenLabs relativ zur Antwort)
+        duration = num_bytes / (self.sample_rate * 2)
+        words = text.split()
+        if words:
+            step = duration / len(words)
+            await self.add_word_timestamps(
+                [(word, self._cumulative_time + i * step) for i, word in enumerate(words)]
+            )
+        self._cumulative_time += duration
+
+    async def push_frame(self, frame: Frame, direction: FrameDirection = FrameDirection.DOWNSTREAM):
+        """Nach dem Ende einer Antwort die Übernahme beenden."""
+        await super().push_frame(frame, direction)
+        if isinstance(frame, TTSStoppedFrame) and self._secondary_turn:
+            # Antwort zu Ende: übrige Texte noch sprechen, danach wieder ElevenLabs
+            self._secondary_turn.texts.put_nowait(None)
+            self._secondary_turn = None
+
+    async def _handle_interruption(self, frame: InterruptionFrame, direction: FrameDirection):
+        await self._stop_hedging()
+        await super()._handle_interruption(frame, direction)
+
+    async def _stop_hedging(self):
+        if self._watch_task:
+            await self.cancel_task(self._watch_task)
+            self._watch_task = None
+        if self._secondary_turn and self._secondary_turn.task:
+            await self.cancel_task(self._secondary_turn.task)
+        self._secondary_turn = None
+        self._watched_context = None
+        self._abandoned_contexts.clear()
+
+    async def stop(self, frame: EndFrame):
+        """Hedging beenden, dann den Service stoppen."""
+        await self._stop_hedging()
+        await super().stop(frame)
+
+    async def cancel(self, frame: CancelFrame):
+        """Hedging beenden, dann den Service abbrechen."""
+        await self._stop_hedging()
+        await super().cancel(frame)
+
+
+async def _prepend(first_audio: bytes, audio: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    if first_audio:
+        yield first_audio
+    async for chunk in audio:
+        yield chunk
+
+
+# Eine Richtlinie pro Anbieter und Prozess, wird von allen Anrufen geteilt
+hedge_stats = HedgeStats(
+    percentile=float(os.getenv("HEDGE_PERCENTILE", "95")),
+    llm_min_secs=int(os.getenv("LLM_HEDGE_MIN_MS", "300")) / 1000,
+    llm_max_secs=int(os.getenv("LLM_HEDGE_MAX_MS", "1500")) / 1000,
+    tts_min_secs=int(os.getenv("TTS_HEDGE_MIN_MS", "200")) / 1000,
+    tts_max_secs=int(os.getenv("TTS_HEDGE_MAX_MS", "1000")) / 1000,
+)
@@ -0,0 +1,333 @@
+#
+# Gemeinsamer Worker-Pool für VAD- und Smart-Turn-Inferenz
+#
+# Pipecat rechnet Silero VAD in einem eigenen Thread pro Anruf und die
+# Smart-Turn Vorhersage direkt im Event Loop. Bei vielen Anrufen bremst das
+# die WebSocket Ein- und Ausgabe aller anderen Anrufe (hörbarer Jitter).
+# Hier laufen beide auf einem gemeinsamen, begrenzten Pool:
+#
+#   off:     Verhalten von Pipecat (ein VAD Thread pro Anruf, Smart-Turn im Loop)
+#   thread:  VAD und Smart-Turn auf `workers` geteilten Threads (ONNX gibt das GIL frei)
+#   process: Smart-Turn in `workers` Prozessen mit eigenem Modell, VAD auf Threads
+#            (der VAD Zustand liegt pro Anruf im Hauptprozess)
+#
+# VAD Aufträge eines Anrufs laufen immer in Reihenfolge nacheinander. Sind
+# mehr als `max_pending` Aufträge offen, gehen neue Aufträge auf einen
+# eigenen Überlauf-Pool statt die Warteschlange weiter wachsen zu lassen.
+# Nie im Aufrufer: `analyze_audio` wird aus dem Event Loop eingereicht, dort
+# würde die Inferenz alle Anrufe blockieren.
+#
+
+"""Gemeinsamer Worker-Pool für VAD- und Smart-Turn-Inferenz."""
+
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+from pipecat.audio.turn.smart_turn.base_smart_turn import BaseSmartTurn
+from pipecat.transports.base_transport import BaseTransport
+
+from voice_assistant_vad_batch import BatchedVADExecutor
+
+INFERENCE_MODES = ("off", "thread", "process")
+
+# Smart-Turn Modell im Worker-Prozess (Modus "process")
+_worker_model: Optional[BaseSmartTurn] = None
+
+
+def _run_sync(coroutine) -> Any:
+    """Führt eine Coroutine ohne echte awaits (Pipecat Modell-Aufrufe) synchron aus."""
+    try:
+        coroutine.send(None)
+    except StopIteration as e:
+        return e.value
+    coroutine.close()
+    raise RuntimeError("Inferenz wartet auf I/O und kann nicht im Worker laufen")
+
+
+def _init_worker():
+    global _worker_model
+    from pipecat.audio.turn.smart_turn.local_smart_turn_v3 import LocalSmartTurnAnalyzerV3
+
+    _worker_model = LocalSmartTurnAnalyzerV3()
+
+
+def _predict_in_worker(audio_array: np.ndarray) -> Dict[str, Any]:
+    return _run_sync(_worker_model._predict_endpoint(audio_array))
+
+
+class InferenceStats:
+    """Laufzeit und Wartezeit pro Modell."""
+
+    __slots__ = ("runs", "total_secs", "max_secs", "wait_secs", "overflow")
+
+    def __init__(self):
+        """Leere Statistik."""
+        self.runs = 0
+        self.total_secs = 0.0
+        self.max_secs = 0.0
+        self.wait_secs = 0.0
+        self.overflow = 0
+
+    def observe(self, wait_secs: float, secs: float):
+        """Wartezeit und Laufzeit eines Aufrufs zählen."""
+        self.runs += 1
+        self.total_secs += secs
+        self.max_secs = max(self.max_secs, secs)
+        self.wait_secs += wait_secs
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        return {
+            "runs": self.runs,
+            "avg_ms": round(self.total_secs / self.runs * 1000, 3) if self.runs else None,
+            "max_ms": round(self.max_secs * 1000, 3),
+            "avg_wait_ms": round(self.wait_secs / self.runs * 1000, 3) if self.runs else None,
+            "overflow": self.overflow,
+        }
+
+
+class SerialCallExecutor(Executor):
+    """Executor eines Anrufs: Aufträge laufen nacheinander auf dem geteilten Pool.
+
+    Ersetzt den Thread pro Anruf, den Pipecat für `analyze_audio` anlegt.
+    """
+
+    def __init__(self, pool: "InferencePool", kind: str):
+        """Aufrufe eines Anrufs nacheinander auf dem Pool ausführen."""
+        self._pool = pool
+        self._kind = kind
+        self._lock = threading.Lock()
+        self._queue: Deque[Tuple[Future, float, Callable, tuple, dict]] = deque()
+        self._running = False
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        """Aufruf einreihen, er startet nach dem vorherigen."""
+        future: Future = Future()
+        with self._lock:
+            saturated = self._pool.saturated()
+            self._queue.append((future, time.perf_counter(), fn, args, kwargs))
+            self._pool.enqueued()
+            if self._running:
+                return future
+            self._running = True
+        # Warteschlange voll: auf dem Überlauf-Pool abarbeiten, die Reihenfolge
+        # bleibt erhalten, weil immer nur ein _drain pro Anruf läuft
+        if saturated:
+            self._pool.stats_for(self._kind).overflow += 1
+            self._pool.overflow_executor.submit(self._drain)
+        else:
+            self._pool.thread_executor.submit(self._drain)
+        return future
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._queue:
+                    self._running = False
+                    return
+                future, queued_at, fn, args, kwargs = self._queue.popleft()
+            self._pool.run(self._kind, future, queued_at, fn, args, kwargs)
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        """Wartende Aufrufe nur mit cancel_futures abbrechen, der Pool bleibt."""
+        if not cancel_futures:
+            return
+        with self._lock:
+            while self._queue:
+                future = self._queue.popleft()[0]
+                future.cancel()
+                self._pool.dequeued()
+
+
+class InferencePool:
+    """Begrenzter Pool für Modell-Inferenz, geteilt von allen Anrufen eines Prozesses."""
+
+    def __init__(self, *, mode: str = "thread", workers: int = 2, max_pending: int = 64):
+        """Modus off, thread oder process, max_pending begrenzt die Warteschlange."""
+        if mode not in INFERENCE_MODES:
+            raise ValueError(f"Unbekannter Inferenz-Modus {mode!r}, erlaubt: {INFERENCE_MODES}")
+        self._mode = mode
+        self._workers = workers
+        self._max_pending = max_pending
+        self._lock = threading.Lock()
+        self._thread_executor: Optional[ThreadPoolExecutor] = None
+        self._overflow_executor: Optional[ThreadPoolExecutor] = None
+        self._process_executor: Optional[ProcessPoolExecutor] = None
+        self._pending = 0
+        self._max_seen = 0
+        self._stats = {"vad": InferenceStats(), "turn": InferenceStats()}
+
+    @property
+    def mode(self) -> str:
+        """Konfigurierter Modus."""
+        return self._mode
+
+    @property
+    def thread_executor(self) -> ThreadPoolExecutor:
+        """Thread Pool, beim ersten Zugriff erstellt."""
+        with self._lock:
+            if self._thread_executor is None:
+                self._thread_executor = ThreadPoolExecutor(
+                    max_workers=self._workers, thread_name_prefix="inference"
+                )
+            return self._thread_executor
+
+    @property
+    def overflow_executor(self) -> ThreadPoolExecutor:
+        """Threads für Aufträge bei voller Warteschlange, beim ersten Zugriff erstellt."""
+        with self._lock:
+            if self._overflow_executor is None:
+                self._overflow_executor = ThreadPoolExecutor(
+                    max_workers=self._workers, thread_name_prefix="inference-overflow"
+                )
+            return self._overflow_executor
+
+    def stats_for(self, kind: str) -> InferenceStats:
+        """Statistik eines Modells (vad oder turn)."""
+        return self._stats[kind]
+
+    def _process_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._process_executor is None:
+                # spawn statt fork: der Hauptprozess hat schon ONNX und Loop Threads
+                self._process_executor = ProcessPoolExecutor(
+                    max_workers=self._workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+            return self._process_executor
+
+    def start(self):
+        """Startet die Worker vorab (beim Serverstart), statt beim ersten Anruf."""
+        if self._mode == "off":
+            return
+        self.thread_executor
+        if self._mode == "process":
+            # Jeder Worker lädt sein Modell im Initializer
+            pool = self._process_pool()
+            for _ in range(self._workers):
+                pool.submit(int)
+        logger.info(f"Inferenz-Pool gestartet: {self._mode}, {self._workers} Worker")
+
+    def shutdown(self):
+        """Pools beenden."""
+        with self._lock:
+            thread_executor, self._thread_executor = self._thread_executor, None
+            overflow_executor, self._overflow_executor = self._overflow_executor, None
+            process_executor, self._process_executor = self._process_executor, None
+        for executor in (thread_executor, overflow_executor):
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+        if process_executor:
+            process_executor.shutdown(wait=False, cancel_futures=True)
+
+    def saturated(self) -> bool:
+        """Warteschlange voll."""
+        return self._pending >= self._max_pending
+
+    def enqueued(self):
+        """Wartenden Aufruf zählen."""
+        with self._lock:
+            self._pending += 1
+            self._max_seen = max(self._max_seen, self._pending)
+
+    def dequeued(self):
+        """Aufruf ist gestartet."""
+        with self._lock:
+            self._pending -= 1
+
+    def run(self, kind: str, future: Future, queued_at: float, fn, args, kwargs):
+        """Führt einen Auftrag im Worker aus und erfasst Warte- und Rechenzeit."""
+        try:
+            if not future.set_running_or_notify_cancel():
+                return
+            started = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+            self._stats[kind].observe(started - queued_at, time.perf_counter() - started)
+        finally:
+            self.dequeued()
+
+    def attach_transport(self, transport: BaseTransport):
+        """Lässt die VAD eines Transports auf dem geteilten Pool rechnen."""
+        if self._mode == "off":
+            return
+        transport_input = transport.input()
+        # Pipecat legt pro Transport einen eigenen Thread für analyze_audio an
+        own_executor = getattr(transport_input, "_executor", None)
+        if own_executor is None or isinstance(
+            own_executor, (SerialCallExecutor, BatchedVADExecutor)
+        ):
+            return
+        own_executor.shutdown(wait=False)
+        batch_engine = getattr(transport_input.vad_analyzer, "batch_engine", None)
+        if batch_engine:
+            # Gebündelte VAD: kein Worker wartet, die Engine meldet sich zurück
+            transport_input._executor = BatchedVADExecutor(
+                transport_input.vad_analyzer, batch_engine
+            )
+        else:
+            transport_input._executor = SerialCallExecutor(self, "vad")
+
+    async def predict_turn(self, model: BaseSmartTurn, audio_array: np.ndarray) -> Dict[str, Any]:
+        """Smart-Turn Vorhersage außerhalb des Event Loops."""
+        if self._mode == "off":
+            return await model._predict_endpoint(audio_array)
+
+        saturated = self.saturated()
+        self.enqueued()
+        queued_at = time.perf_counter()
+        if saturated:
+            # Warteschlange voll: im Überlauf-Pool mit dem Modell dieses Prozesses
+            self._stats["turn"].overflow += 1
+            executor = self.overflow_executor
+        elif self._mode == "process":
+            try:
+                result = await asyncio.wrap_future(
+                    self._process_pool().submit(_predict_in_worker, audio_array)
+                )
+            finally:
+                self.dequeued()
+            # Im Prozess sind Warte- und Rechenzeit nicht getrennt messbar
+            self._stats["turn"].observe(0.0, time.perf_counter() - queued_at)
+            return result
+        else:
+            executor = self.thread_executor
+        future: Future = Future()
+        executor.submit(self._run_turn, future, queued_at, model._predict_endpoint, audio_array)
+        return await asyncio.wrap_future(future)
+
+    def _run_turn(self, future: Future, queued_at: float, predict, audio_array: np.ndarray):
+        self.run("turn", future, queued_at, lambda: _run_sync(predict(audio_array)), (), {})
+
+    def stats(self) -> Dict[str, Any]:
+        """Warteschlange und Inferenzzeiten für /health."""
+        return {
+            "mode": self._mode,
+            "workers": self._workers,
+            "queue_depth": self._pending,
+            "max_queue_depth": self._max_seen,
+            "max_pending": self._max_pending,
+            "vad": self._stats["vad"].stats(),
+            "turn": self._stats["turn"].stats(),
+        }
+
+
+# Ein Pool pro Prozess, wird von allen Anrufen geteilt
+inference_pool = InferencePool(
+    mode=os.getenv("ANALYZER_EXECUTOR", "thread"),
+    workers=int(os.getenv("ANALYZER_WORKERS", "2")),
+    max_pending=int(os.getenv("ANALYZER_MAX_PENDING", "64")),
+)
@@ -0,0 +1,335 @@
+#
+# Lokaler Fast-Path für häufige Fragen (Geschäftszeiten, Wochenende, Notdienst, ...)
+#
+# Die Antworten stehen ohnehin fest im System Prompt. Passt das finale
+# Transkript sicher zu einem Eintrag der Intent-Tabelle, wird die feste
+# Antwort direkt als LLM Antwort ausgegeben, ohne OpenAI Roundtrip. Der
+# Satz-Cache spielt sie als vorgerendertes Audio ab, der Assistant
+# Aggregator schreibt sie wie jede andere Antwort in den Kontext.
+#
+# Erkannt wird mit Schlüsselwörtern plus Zeichen-Trigrammen (Kosinus-
+# Ähnlichkeit zu Beispielsätzen), ohne zusätzliche Modelle. Nur Fragen werden
+# direkt beantwortet, keine verneinten Äußerungen ("Ich will keinen
+# Kostenvoranschlag") und keine Antworten direkt nach einer festen Antwort:
+# die enden selbst mit einer Frage, "Ja, nehmen Sie das auf" darf nicht
+# wieder dieselbe Antwort auslösen. Antworten des LLM enden fast immer mit
+# einer Rückfrage ("Kann ich sonst noch helfen?"), danach bleibt der
+# Fast-Path aktiv.
+#
+# Pipeline: context_aggregator.user() -> IntentFastPath(intent_classifier) -> llm
+#
+
+"""Lokaler Fast-Path für häufige Fragen (Geschäftszeiten, Wochenende, Notdienst, ...)."""
+
+import json
+import math
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from loguru import logger
+from pipecat.frames.frames import (
+    Frame,
+    LLMContextFrame,
+    LLMFullResponseEndFrame,
+    LLMFullResponseStartFrame,
+    LLMTextFrame,
+)
+from pipecat.processors.aggregators.openai_llm_context import OpenAILLMContextFrame
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+from voice_assistant_speculation import normalize_transcript
+
+# Längere Äußerungen enthalten meist mehr als eine Frage, die gehen ans LLM
+MAX_WORDS = 16
+
+# Anteil von Trigramm-Ähnlichkeit und Schlüsselwort-Treffer am Score
+SIMILARITY_WEIGHT = 0.6
+KEYWORD_WEIGHT = 0.4
+
+# Abstand zum zweitbesten Intent, darunter ist die Zuordnung unsicher
+MIN_MARGIN = 0.1
+
+# Verneinte Äußerungen gehen ans LLM
+NEGATIONS = {"kein", "keine", "keinen", "keinem", "keiner", "keines", "nicht", "nichts", "nein"}
+
+# Womit Fragen anfangen (Transkripte haben nicht immer ein Fragezeichen)
+QUESTION_STARTS = {
+    "wann",
+    "wie",
+    "was",
+    "wo",
+    "wer",
+    "welche",
+    "welcher",
+    "welches",
+    "warum",
+    "wieso",
+    "bis",
+    "ab",
+    "haben",
+    "hat",
+    "habt",
+    "ist",
+    "sind",
+    "gibt",
+    "kann",
+    "können",
+    "könnte",
+    "könnten",
+    "machen",
+    "macht",
+    "arbeiten",
+    "bieten",
+    "kostet",
+    "kommen",
+    "kommt",
+    "muss",
+    "darf",
+    "wäre",
+}
+
+# Füllwörter vor der eigentlichen Frage ("Ja hallo, wann haben Sie ...")
+LEADING_FILLERS = {
+    "ja",
+    "hallo",
+    "äh",
+    "ähm",
+    "also",
+    "und",
+    "ok",
+    "okay",
+    "gut",
+    "dann",
+    "noch",
+    "eine",
+    "frage",
+}
+
+
+@dataclass
+class Intent:
+    """Eintrag der Intent-Tabelle mit fester Antwort."""
+
+    name: str
+    answer: str
+    keywords: List[str] = field(default_factory=list)
+    examples: List[str] = field(default_factory=list)
+
+
+# Antworten aus dem System Prompt in voice_assistant_bot.py
+DEFAULT_INTENTS = [
+    Intent(
+        name="opening_hours",
+        answer="Wir sind Montag bis Freitag von 8 bis 17 Uhr für Sie da. Kann ich sonst noch was für Sie tun?",
+        keywords=[
+            "geöffnet",
+            "öffnungszeiten",
+            "geschäftszeiten",
+            "offen",
+            "erreichbar",
+            "aufhaben",
+        ],
+        examples=[
+            "Wann haben Sie geöffnet?",
+            "Wie sind Ihre Öffnungszeiten?",
+            "Was sind Ihre Geschäftszeiten?",
+            "Bis wann sind Sie heute erreichbar?",
+            "Haben Sie heute offen?",
+        ],
+    ),
+    Intent(
+        name="weekend",
+        answer="Am Wochenende haben wir leider geschlossen. Termine gibt es Montag bis Freitag von 8 bis 17 Uhr.",
+        keywords=["samstag", "sonntag", "wochenende"],
+        examples=[
+            "Haben Sie am Samstag offen?",
+            "Kann ich am Sonntag vorbeikommen?",
+            "Arbeiten Sie auch am Wochenende?",
+            "Kann ich am Samstag einen Termin bekommen?",
+        ],
+    ),
+    Intent(
+        name="emergency",
+        answer="Bei echten Notfällen ist unser Notdienst rund um die Uhr für Sie da. Was ist denn passiert?",
+        keywords=["notfall", "notdienst", "dringend", "rohrbruch", "überschwemmung"],
+        examples=[
+            "Haben Sie einen Notdienst?",
+            "Gibt es einen Notdienst in der Nacht?",
+            "Kommen Sie auch bei einem Notfall?",
+            "Ist Ihr Notdienst bei einem Rohrbruch erreichbar?",
+        ],
+    ),
+    Intent(
+        name="free_estimate",
+        answer="Na ja, der Kostenvoranschlag ist bei uns kostenlos. Soll ich Ihre Anfrage gleich aufnehmen?",
+        keywords=["kostenvoranschlag", "angebot", "kostenlos", "gratis", "kosten"],
+        examples=[
+            "Ist der Kostenvoranschlag kostenlos?",
+            "Was kostet ein Kostenvoranschlag?",
+            "Kann ich ein Angebot bekommen?",
+            "Machen Sie kostenlose Kostenvoranschläge?",
+        ],
+    ),
+]
+
+
+def load_intents(path: Optional[str]) -> List[Intent]:
+    """Intent-Tabelle aus einer JSON Datei (Liste von Objekten) oder die Standard-Tabelle."""
+    if not path:
+        return DEFAULT_INTENTS
+    with open(path, encoding="utf-8") as f:
+        return [Intent(**entry) for entry in json.load(f)]
+
+
+def is_question(text: str) -> bool:
+    """Fragezeichen am Ende oder Fragewort bzw. Verb am Anfang (nach Füllwörtern)."""
+    if text.rstrip().endswith("?"):
+        return True
+    for word in normalize_transcript(text).split():
+        if word not in LEADING_FILLERS:
+            return word in QUESTION_STARTS
+    return False
+
+
+def _trigrams(text: str) -> Counter:
+    padded = f" {text} "
+    return Counter(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def _cosine(a: Counter, b: Counter) -> float:
+    dot = sum(count * b[gram] for gram, count in a.items() if gram in b)
+    if not dot:
+        return 0.0
+    norm = math.sqrt(sum(c * c for c in a.values())) * math.sqrt(sum(c * c for c in b.values()))
+    return dot / norm
+
+
+class IntentClassifier:
+    """Ordnet ein Transkript einem Intent zu, wenn der Score über `threshold` liegt."""
+
+    def __init__(self, intents: List[Intent], *, threshold: float = 0.6):
+        """Treffer ab threshold."""
+        self._intents = intents
+        self._threshold = threshold
+        self._keywords = [[normalize_transcript(k) for k in i.keywords] for i in intents]
+        self._examples = [[_trigrams(normalize_transcript(e)) for e in i.examples] for i in intents]
+
+    @property
+    def intents(self) -> List[Intent]:
+        """Bekannte Intents."""
+        return self._intents
+
+    def scores(self, text: str) -> List[Tuple[float, Intent]]:
+        """Score pro Intent, absteigend sortiert."""
+        normalized = normalize_transcript(text)
+        grams = _trigrams(normalized)
+        words = f" {normalized} "
+        scores = []
+        for intent, keywords, examples in zip(self._intents, self._keywords, self._examples):
+            similarity = max((_cosine(grams, e) for e in examples), default=0.0)
+            keyword = any(f" {k} " in words or (" " in k and k in normalized) for k in keywords)
+            scores.append((SIMILARITY_WEIGHT * similarity + KEYWORD_WEIGHT * keyword, intent))
+        return sorted(scores, key=lambda s: s[0], reverse=True)
+
+    def classify(self, text: str) -> Optional[Intent]:
+        """Bester Intent oder None (zu lang, keine Frage, verneint, zu unsicher oder nicht eindeutig)."""
+        if not text.strip() or len(text.split()) > MAX_WORDS or not self._intents:
+            return None
+        if not is_question(text) or NEGATIONS.intersection(normalize_transcript(text).split()):
+            return None
+        scores = self.scores(text)
+        best_score, best = scores[0]
+        runner_up = scores[1][0] if len(scores) > 1 else 0.0
+        if best_score < self._threshold or best_score - runner_up < MIN_MARGIN:
+            return None
+        return best
+
+
+class IntentStats:
+    """Prozessweite Zähler für /health."""
+
+    def __init__(self):
+        """Leere Statistik."""
+        self.matches: Counter = Counter()
+        self.misses = 0
+        self.follow_ups = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        matched = sum(self.matches.values())
+        total = matched + self.misses
+        return {
+            "matches": dict(self.matches),
+            "misses": self.misses,
+            "follow_ups": self.follow_ups,
+            "match_rate": round(matched / total, 3) if total else None,
+        }
+
+
+class IntentFastPath(FrameProcessor):
+    """Beantwortet erkannte Fragen direkt, alle anderen Kontexte gehen an das LLM.
+
+    Event `on_intent_matched(processor, intent)` wird nach jeder direkt
+    beantworteten Runde ausgelöst.
+    """
+
+    def __init__(
+        self, classifier: IntentClassifier, *, stats: Optional[IntentStats] = None, **kwargs
+    ):
+        """Prozessor vor dem LLM."""
+        super().__init__(**kwargs)
+        self._classifier = classifier
+        self._stats = stats or intent_stats
+        self._answers = {intent.answer for intent in classifier.intents}
+        self._register_event_handler("on_intent_matched")
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        """Bei einem Treffer die feste Antwort sprechen statt das LLM zu fragen."""
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, (OpenAILLMContextFrame, LLMContextFrame)):
+            intent = self._match(frame.context.get_messages())
+            if intent:
+                await self._answer(intent)
+                return
+        await self.push_frame(frame, direction)
+
+    def _match(self, messages: List[Any]) -> Optional[Intent]:
+        last = messages[-1] if messages else None
+        if not isinstance(last, dict) or last.get("role") != "user":
+            return None
+        if self._awaits_reply(messages[:-1]):
+            # Antwort auf eine Rückfrage, die Gesprächslage kennt nur das LLM
+            self._stats.follow_ups += 1
+            return None
+        intent = self._classifier.classify(str(last.get("content") or ""))
+        if intent:
+            self._stats.matches[intent.name] += 1
+        else:
+            self._stats.misses += 1
+        return intent
+
+    def _awaits_reply(self, messages: List[Any]) -> bool:
+        """Letzte Antwort von Ellie war eine feste Antwort (mit Rückfrage)."""
+        assistant = [m for m in messages if isinstance(m, dict) and m.get("role") == "assistant"]
+        if not assistant:
+            return False
+        return str(assistant[-1].get("content") or "").strip() in self._answers
+
+    async def _answer(self, intent: Intent):
+        logger.debug(f"Intent {intent.name} direkt beantwortet")
+        # Wie der LLM Service, damit Satz-Cache, TTS und Aggregator nichts merken
+        await self.push_frame(LLMFullResponseStartFrame())
+        await self.push_frame(LLMTextFrame(intent.answer))
+        await self.push_frame(LLMFullResponseEndFrame())
+        await self._call_event_handler("on_intent_matched", intent)
+
+
+# Tabelle und Zähler pro Prozess, werden von allen Anrufen geteilt
+intent_classifier = IntentClassifier(
+    load_intents(os.getenv("INTENTS_FILE")),
+    threshold=float(os.getenv("INTENT_THRESHOLD", "0.6")),
+)
+intent_stats = IntentStats()
@@ -0,0 +1,246 @@
+#
+# Logging ohne Schreibzugriffe auf dem Event Loop
+#
+# Bisher schreibt loguru jede Zeile (inkl. pipecat DEBUG Ausgaben pro Frame)
+# synchron nach stderr, auf demselben Event Loop, der das Audio taktet. Hängt
+# stderr (volle Pipe, langsamer Log-Collector), hängen alle Anrufe. Im Modus
+# `async`:
+#
+#   - der Sink legt den Record nur in eine begrenzte Queue, ein Thread
+#     schreibt gesammelt JSON Zeilen (ein Objekt pro Record)
+#   - ist die Queue voll, wird verworfen und gezählt statt zu warten
+#   - pro Anruf und Log-Stelle gehen nur `sample_burst` Zeilen pro Sekunde
+#     durch, danach jede `sample_every`-te (WARNING und höher immer)
+#   - `call_context(call_sid)` bindet die CallSid an alle Logs des Anrufs,
+#     auch in den Tasks, die pipecat für die Pipeline startet
+#
+# Im Modus `stderr` bleibt es beim bisherigen Verhalten. Zähler der Queue
+# stehen unter /health (logging).
+#
+
+"""Logging ohne Schreibzugriffe auf dem Event Loop."""
+
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+from typing import Any, Dict, List, Optional, TextIO
+
+from loguru import logger
+
+LOG_MODES = ("stderr", "async")
+
+# Ab diesem Level wird nie gesampelt oder verworfen (loguru: WARNING = 30)
+UNSAMPLED_LEVEL = 30
+
+
+class AsyncJsonSink:
+    """loguru Sink: begrenzte Queue, Writer Thread, JSON Zeilen in Batches."""
+
+    def __init__(
+        self,
+        stream: TextIO,
+        *,
+        max_queue: int = 10000,
+        batch_size: int = 256,
+        flush_secs: float = 0.2,
+        sample_burst: int = 20,
+        sample_every: int = 100,
+    ):
+        """Schreibt in stream, höchstens max_queue Einträge warten."""
+        self._stream = stream
+        self._queue: queue.Queue = queue.Queue(maxsize=max_queue)
+        self._batch_size = batch_size
+        self._flush_secs = flush_secs
+        self._sample_burst = sample_burst
+        self._sample_every = sample_every
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+
+        # Stichproben pro (CallSid, Log-Stelle), Fenster von einer Sekunde
+        self._window_at = time.monotonic()
+        self._window: Counter = Counter()
+
+        self.enqueued = 0
+        self.dropped = 0
+        self.sampled_out = 0
+        self.written = 0
+        self.batches = 0
+        self.write_errors = 0
+
+    def start(self):
+        """Schreib-Thread starten."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 2.0):
+        """Schreibt den Rest der Queue und beendet den Thread."""
+        if self._thread is not None:
+            self._stopping.set()
+            self._thread.join(timeout)
+            self._thread = None
+
+    def filter(self, record: Dict[str, Any]) -> bool:
+        """Stichproben häufiger Log-Stellen pro Anruf (läuft im Thread des Aufrufers)."""
+        if record["level"].no >= UNSAMPLED_LEVEL:
+            return True
+        now = time.monotonic()
+        if now - self._window_at >= 1.0:
+            self._window_at = now
+            self._window.clear()
+        key = (record["extra"].get("call_sid"), record["name"], record["line"])
+        count = self._window[key] = self._window[key] + 1
+        if count <= self._sample_burst or count % self._sample_every == 0:
+            return True
+        self.sampled_out += 1
+        return False
+
+    def __call__(self, message):
+        """Loguru Sink: Eintrag einreihen, bei voller Queue verwerfen."""
+        record = message.record
+        try:
+            self._queue.put_nowait(record)
+            self.enqueued += 1
+        except queue.Full:
+            if record["level"].no < UNSAMPLED_LEVEL:
+                self.dropped += 1
+                return
+            # Warnungen und Fehler lieber kurz warten als verlieren
+            try:
+                self._queue.put(record, timeout=0.05)
+                self.enqueued += 1
+            except queue.Full:
+                self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch:
+                self._write(batch)
+            elif self._stopping.is_set():
+                return
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        try:
+            batch = [self._queue.get(timeout=self._flush_secs)]
+        except queue.Empty:
+            return []
+        while len(batch) < self._batch_size:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch: List[Dict[str, Any]]):
+        lines = []
+        for record in batch:
+            try:
+                lines.append(json.dumps(self._serialize(record), default=str, ensure_ascii=False))
+            except Exception as e:
+                lines.append(
+                    json.dumps(
+                        {"level": "ERROR", "message": f"Log Record nicht serialisierbar: {e}"}
+                    )
+                )
+        lines.append("")
+        try:
+            self._stream.write("\n".join(lines))
+            self._stream.flush()
+            self.written += len(batch)
+            self.batches += 1
+        except Exception:
+            self.write_errors += 1
+
+    @staticmethod
+    def _serialize(record: Dict[str, Any]) -> Dict[str, Any]:
+        entry = {
+            "time": record["time"].isoformat(),
+            "level": record["level"].name,
+            "message": record["message"],
+            "logger": record["name"],
+            "function": record["function"],
+            "line": record["line"],
+            "thread": record["thread"].name,
+        }
+        if record["extra"]:
+            entry.update(record["extra"])
+        exception = record["exception"]
+        if exception is not None:
+            entry["exception"] = "".join(
+                traceback.format_exception(exception.type, exception.value, exception.traceback)
+            )
+        return entry
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        return {
+            "queue_depth": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "sampled_out": self.sampled_out,
+            "write_errors": self.write_errors,
+        }
+
+
+class LogPipeline:
+    """Konfiguration von loguru für den Prozess."""
+
+    def __init__(
+        self, *, mode: str = "stderr", level: str = "DEBUG", sink: Optional[AsyncJsonSink] = None
+    ):
+        """Modus stderr oder async."""
+        if mode not in LOG_MODES:
+            raise ValueError(f"Unbekannter Log Modus {mode!r}, erlaubt: {LOG_MODES}")
+        self._mode = mode
+        self._level = level
+        self._sink = sink
+        self._configured = False
+
+    def configure(self):
+        """Ersetzt den Standard-Handler von loguru (einmal pro Prozess)."""
+        if self._configured:
+            return
+        self._configured = True
+        logger.remove()
+        if self._mode == "async":
+            self._sink.start()
+            logger.add(self._sink, level=self._level, filter=self._sink.filter, format="{message}")
+        else:
+            logger.add(sys.stderr, level=self._level)
+
+    def call_context(self, call_sid: str):
+        """Bindet die CallSid an alle Logs im Block (auch in dort gestarteten Tasks)."""
+        return logger.contextualize(call_sid=call_sid)
+
+    def stop(self):
+        """Ausstehende Einträge schreiben und beenden."""
+        if self._mode == "async":
+            self._sink.stop()
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        stats: Dict[str, Any] = {"mode": self._mode, "level": self._level}
+        if self._mode == "async":
+            stats.update(self._sink.stats())
+        return stats
+
+
+# Ein Writer pro Prozess, wird von allen Anrufen geteilt
+log_pipeline = LogPipeline(
+    mode=os.getenv("LOG_MODE", "stderr"),
+    level=os.getenv("LOG_LEVEL", "DEBUG"),
+    sink=AsyncJsonSink(
+        sys.stderr,
+        max_queue=int(os.getenv("LOG_QUEUE_SIZE", "10000")),
+        sample_burst=int(os.getenv("LOG_SAMPLE_BURST", "20")),
+        sample_every=int(os.getenv("LOG_SAMPLE_EVERY", "100")),
+    ),
+)
@@ -0,0 +1,339 @@
+#
+# Speicher-Modus: Puffer-Pools und eine GC-Richtlinie mit Pausenbudget
+#
+# Bisher läuft nach jedem Anruf ein voller gc.collect() (PipelineRunner mit
+# force_gc=True). Der hält den Event Loop für alle anderen laufenden Anrufe
+# an, und je mehr langlebige Objekte (Modelle, Module, Frames in Queues) im
+# Prozess sind, desto länger dauert er. Im Modus `budget`:
+#
+#   - nach dem Serverstart wandern alle vorhandenen Objekte per gc.freeze()
+#     in die permanente Generation, volle Läufe durchsuchen nur noch die
+#     Objekte der Anrufe
+#   - automatische volle Läufe sind abgeschaltet, junge Generationen laufen
+#     wie bisher in kleinen Schritten
+#   - ein voller Lauf startet, wenn kein Anruf läuft, oder wenn der letzte
+#     volle Lauf ins Pausenbudget gepasst hat, spätestens aber nach
+#     `max_full_interval_secs` (damit Zyklen nicht unbegrenzt wachsen)
+#
+# Audio, das länger gehalten wird (z.B. Pre-Roll), liegt als Bytes in
+# wiederverwendeten bytearrays fester Größenklassen statt als Frame-Objekte.
+# Pipecat Frames selbst werden nicht wiederverwendet: Sie hängen gleichzeitig
+# in Queues, Observern und Executoren, ein recycelter Frame würde Audio
+# überschreiben, das noch unterwegs ist.
+#
+# GC Pausen pro Generation, verschobene Läufe, Allokationsrate und Pool-Treffer
+# stehen unter /health (memory).
+#
+
+"""Speicher-Modus: Puffer-Pools und eine GC-Richtlinie mit Pausenbudget."""
+
+import asyncio
+import gc
+import os
+import sys
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+
+from voice_assistant_metrics import LatencyHistogram
+
+GC_MODES = ("default", "budget")
+
+# Buckets der GC Pausen in Sekunden
+GC_PAUSE_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.25, 0.5)
+
+# So viele gen1 Läufe seit dem letzten vollen Lauf, bevor einer fällig ist (wie CPython)
+FULL_GC_MIN_PENDING = 10
+
+# Praktisch nie: automatische volle Läufe übernimmt die Richtlinie
+FULL_GC_THRESHOLD_DISABLED = 1_000_000
+
+
+class BufferPool:
+    """Wiederverwendbare bytearrays in Größenklassen (Zweierpotenzen)."""
+
+    def __init__(self, *, min_size: int = 256, max_size: int = 64 * 1024, per_class: int = 64):
+        """Größenklassen von min_size bis max_size, je höchstens per_class Puffer."""
+        self._min_size = min_size
+        self._max_size = max_size
+        self._per_class = per_class
+        self._free: Dict[int, List[bytearray]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.oversized = 0
+
+    def _size_class(self, size: int) -> int:
+        size_class = self._min_size
+        while size_class < size:
+            size_class <<= 1
+        return size_class
+
+    def acquire(self, size: int) -> bytearray:
+        """Bytearray mit mindestens `size` Bytes (Inhalt undefiniert)."""
+        if size > self._max_size:
+            self.oversized += 1
+            return bytearray(size)
+        size_class = self._size_class(size)
+        free = self._free.get(size_class)
+        if free:
+            self.hits += 1
+            return free.pop()
+        self.misses += 1
+        return bytearray(size_class)
+
+    def release(self, buffer: bytearray):
+        """Puffer für die Wiederverwendung zurückgeben."""
+        size_class = len(buffer)
+        if size_class > self._max_size or size_class != self._size_class(size_class):
+            return
+        free = self._free.setdefault(size_class, [])
+        if len(free) < self._per_class:
+            free.append(buffer)
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 3) if requests else None,
+            "oversized": self.oversized,
+            "free_buffers": sum(len(free) for free in self._free.values()),
+            "free_bytes": sum(size * len(free) for size, free in self._free.items()),
+        }
+
+
+class AudioRing:
+    """Ringpuffer fester Größe auf einem Pool-Buffer, der älteste Bytes überschreibt."""
+
+    __slots__ = ("_pool", "_buffer", "_capacity", "_start", "_size")
+
+    def __init__(self, pool: BufferPool, capacity: int):
+        """Puffer mit capacity Bytes aus dem Pool."""
+        self._pool = pool
+        self._buffer = pool.acquire(capacity)
+        self._capacity = capacity
+        self._start = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def write(self, data: bytes) -> int:
+        """Hängt `data` an und gibt zurück, wie viele alte Bytes verworfen wurden."""
+        capacity = self._capacity
+        if len(data) >= capacity:
+            dropped = self._size + len(data) - capacity
+            self._buffer[:capacity] = data[-capacity:]
+            self._start, self._size = 0, capacity
+            return dropped
+        dropped = max(0, self._size + len(data) - capacity)
+        if dropped:
+            self._start = (self._start + dropped) % capacity
+            self._size -= dropped
+        end = (self._start + self._size) % capacity
+        first = min(len(data), capacity - end)
+        self._buffer[end : end + first] = data[:first]
+        if first < len(data):
+            self._buffer[: len(data) - first] = data[first:]
+        self._size += len(data)
+        return dropped
+
+    def read(self) -> bytes:
+        """Inhalt in Reihenfolge, danach ist der Puffer leer."""
+        end = self._start + self._size
+        if end <= self._capacity:
+            data = bytes(self._buffer[self._start : end])
+        else:
+            data = bytes(self._buffer[self._start : self._capacity]) + bytes(
+                self._buffer[: end - self._capacity]
+            )
+        self._start = self._size = 0
+        return data
+
+    def close(self):
+        """Gibt den Buffer an den Pool zurück."""
+        if self._buffer is not None:
+            self._pool.release(self._buffer)
+            self._buffer = None
+            self._size = 0
+
+
+class GCPolicy:
+    """GC Steuerung und Messung eines Worker-Prozesses."""
+
+    def __init__(
+        self,
+        *,
+        mode: str = "budget",
+        gen0_threshold: int = 5000,
+        pause_budget_secs: float = 0.005,
+        max_full_interval_secs: float = 300.0,
+        check_secs: float = 1.0,
+    ):
+        """Modus default oder budget, Schwellen und Pausenbudget der Richtlinie."""
+        if mode not in GC_MODES:
+            raise ValueError(f"Unbekannter GC Modus {mode!r}, erlaubt: {GC_MODES}")
+        self._mode = mode
+        self._gen0_threshold = gen0_threshold
+        self._pause_budget_secs = pause_budget_secs
+        self._max_full_interval_secs = max_full_interval_secs
+        self._check_secs = check_secs
+        self._task: Optional[asyncio.Task] = None
+        self._active_calls = 0
+
+        self._pauses = [LatencyHistogram(GC_PAUSE_BUCKETS) for _ in range(3)]
+        self._max_pause = [0.0, 0.0, 0.0]
+        self._collected = 0
+        self._uncollectable = 0
+        self._gc_started: Optional[float] = None
+        self._last_full_at = time.monotonic()
+        self._last_full_pause = 0.0
+        self._full_reasons: Counter = Counter()
+        self._deferred = 0
+
+        # Allokationsrate aus den gen0 Läufen (netto neue GC-Objekte)
+        self._rate_at = time.monotonic()
+        self._rate_gen0 = 0
+        self._rate_count0 = 0
+        self._rate_blocks = sys.getallocatedblocks()
+        self._objects_per_sec = 0.0
+        self._blocks_per_sec = 0.0
+
+    @property
+    def mode(self) -> str:
+        """Konfigurierter Modus."""
+        return self._mode
+
+    @property
+    def force_gc_per_call(self) -> bool:
+        """Ob der PipelineRunner nach jedem Anruf voll sammeln soll (bisheriges Verhalten)."""
+        return self._mode == "default"
+
+    def start(self):
+        """Nach dem Warmup im Startup des Workers aufrufen."""
+        if self._on_gc not in gc.callbacks:
+            gc.callbacks.append(self._on_gc)
+        if self._mode == "budget":
+            gc.collect()
+            # Modelle, Module und Caches nie wieder durchsuchen
+            gc.freeze()
+            _, threshold1, _ = gc.get_threshold()
+            gc.set_threshold(self._gen0_threshold, threshold1, FULL_GC_THRESHOLD_DISABLED)
+            logger.info(f"GC Richtlinie: {gc.get_freeze_count()} Objekte eingefroren")
+        if not self._task:
+            self._task = asyncio.create_task(self._maintain())
+
+    async def stop(self):
+        """Hintergrund Task beenden."""
+        if self._task:
+            self._task.cancel()
+            self._task = None
+        if self._on_gc in gc.callbacks:
+            gc.callbacks.remove(self._on_gc)
+
+    def call_started(self):
+        """Laufenden Anruf zählen."""
+        self._active_calls += 1
+
+    def call_ended(self):
+        """Beendeten Anruf austragen."""
+        self._active_calls -= 1
+
+    def _on_gc(self, phase: str, info: Dict[str, int]):
+        if phase == "start":
+            self._gc_started = time.perf_counter()
+            return
+        if self._gc_started is None:
+            return
+        pause = time.perf_counter() - self._gc_started
+        self._gc_started = None
+        generation = info["generation"]
+        self._pauses[generation].observe(pause)
+        self._max_pause[generation] = max(self._max_pause[generation], pause)
+        self._collected += info["collected"]
+        self._uncollectable += info["uncollectable"]
+        if generation == 2:
+            self._last_full_at = time.monotonic()
+            self._last_full_pause = pause
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(self._check_secs)
+            self._update_rates()
+            if self._mode != "budget" or gc.get_count()[2] < FULL_GC_MIN_PENDING:
+                continue
+            if not self._active_calls:
+                reason = "idle"
+            elif self._last_full_pause <= self._pause_budget_secs:
+                reason = "budget"
+            elif time.monotonic() - self._last_full_at >= self._max_full_interval_secs:
+                reason = "overdue"
+            else:
+                self._deferred += 1
+                continue
+            self._full_reasons[reason] += 1
+            gc.collect()
+
+    def _update_rates(self):
+        now = time.monotonic()
+        elapsed = now - self._rate_at
+        if elapsed <= 0:
+            return
+        gen0 = self._pauses[0].count
+        count0 = gc.get_count()[0]
+        blocks = sys.getallocatedblocks()
+        threshold0 = gc.get_threshold()[0]
+        new_objects = (gen0 - self._rate_gen0) * threshold0 + count0 - self._rate_count0
+        self._objects_per_sec = max(0.0, new_objects) / elapsed
+        self._blocks_per_sec = (blocks - self._rate_blocks) / elapsed
+        self._rate_at, self._rate_gen0, self._rate_count0, self._rate_blocks = (
+            now,
+            gen0,
+            count0,
+            blocks,
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        generations = {}
+        for generation, histogram in enumerate(self._pauses):
+            count = histogram.count
+            generations[f"gen{generation}"] = {
+                "collections": count,
+                "avg_pause_ms": round(histogram.sum / count * 1000, 3) if count else None,
+                "p99_pause_ms": (
+                    round(histogram.percentile(99) * 1000, 3)
+                    if count and histogram.percentile(99) != float("inf")
+                    else None
+                ),
+                "max_pause_ms": round(self._max_pause[generation] * 1000, 3),
+            }
+        return {
+            "mode": self._mode,
+            "thresholds": gc.get_threshold(),
+            "counts": gc.get_count(),
+            "frozen_objects": gc.get_freeze_count(),
+            "pauses": generations,
+            "collected": self._collected,
+            "uncollectable": self._uncollectable,
+            "full_runs": dict(self._full_reasons),
+            "full_deferred": self._deferred,
+            "pause_budget_ms": round(self._pause_budget_secs * 1000, 3),
+            "new_gc_objects_per_sec": round(self._objects_per_sec, 1),
+            "allocated_blocks": sys.getallocatedblocks(),
+            "allocated_blocks_per_sec": round(self._blocks_per_sec, 1),
+            "buffer_pool": buffer_pool.stats(),
+        }
+
+
+# Ein Pool und eine Richtlinie pro Prozess, werden von allen Anrufen geteilt
+buffer_pool = BufferPool(per_class=int(os.getenv("BUFFER_POOL_PER_CLASS", "64")))
+gc_policy = GCPolicy(
+    mode=os.getenv("GC_MODE", "budget"),
+    gen0_threshold=int(os.getenv("GC_GEN0_THRESHOLD", "5000")),
+    pause_budget_secs=float(os.getenv("GC_PAUSE_BUDGET_MS", "5")) / 1000,
+    max_full_interval_secs=float(os.getenv("GC_MAX_FULL_INTERVAL_SECS", "300")),
+)
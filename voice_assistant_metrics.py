@@ -0,0 +1,224 @@
+#
+# Latenzmessung pro Gesprächsrunde mit /metrics Export
+#
+# Statt der Pipecat Metriken (enable_metrics) beobachtet ein Observer nur
+# wenige feste Punkte einer Runde: Ende der Nutzer-Sprache (VAD Stop),
+# finales Transkript, erstes LLM Token, erstes TTS Audio und erstes an Twilio
+# geschriebenes Audio. Die Abstände landen in vorab angelegten Histogrammen
+# pro Anruf und pro Prozess, die als Prometheus Text ausgegeben werden.
+#
+
+"""Latenzmessung pro Gesprächsrunde mit /metrics Export."""
+
+import os
+from bisect import bisect_left
+from typing import Dict, List, Optional, Tuple
+
+from loguru import logger
+from pipecat.frames.frames import (
+    BotStartedSpeakingFrame,
+    LLMFullResponseStartFrame,
+    LLMTextFrame,
+    TranscriptionFrame,
+    TTSAudioRawFrame,
+    UserStartedSpeakingFrame,
+    UserStoppedSpeakingFrame,
+)
+from pipecat.observers.base_observer import BaseObserver, FramePushed
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+
+# Obergrenzen der Histogramm-Buckets in Sekunden (+Inf kommt dazu)
+LATENCY_BUCKETS = (0.025, 0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 5.0)
+
+# Abschnitte einer Runde, jeweils vom vorherigen Messpunkt aus
+#   stt:       VAD Stop -> finales Transkript
+#   llm:       VAD Stop bzw. Transkript -> erstes LLM Token
+#   tts:       erstes LLM Token -> erstes TTS Audio
+#   transport: erstes TTS Audio -> erstes an Twilio geschriebenes Audio
+#   turn:      VAD Stop -> erstes an Twilio geschriebenes Audio
+#   barge_in:     VAD Start während Ellie spricht -> Twilio `clear` gesendet
+#   interruption: VAD Start während Ellie spricht -> Unterbrechung am Output angekommen
+STAGES = ("stt", "llm", "tts", "transport", "turn", "barge_in", "interruption")
+
+
+class LatencyHistogram:
+    """Histogramm mit festen Buckets, ohne Allokation pro Messwert."""
+
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...] = LATENCY_BUCKETS):
+        """Histogramm mit festen Buckets in Sekunden."""
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, secs: float):
+        """Messwert einsortieren."""
+        self.counts[bisect_left(self.buckets, secs)] += 1
+        self.sum += secs
+        self.count += 1
+
+    def percentile(self, p: float) -> Optional[float]:
+        """Obergrenze des Buckets, in dem das Perzentil liegt."""
+        if not self.count:
+            return None
+        target = p / 100 * self.count
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return bound
+        return float("inf")
+
+
+class CallMetrics:
+    """Histogramme eines Anrufs, jeder Messwert geht auch in die Prozess-Histogramme."""
+
+    def __init__(self, call_sid: str, process: Dict[str, LatencyHistogram]):
+        """Histogramme des Anrufs, Werte gehen auch in die des Prozesses."""
+        self.call_sid = call_sid
+        self.turns = 0
+        self.histograms = {stage: LatencyHistogram() for stage in STAGES}
+        self._process = process
+
+    def observe(self, stage: str, secs: float):
+        """Latenz einer Stufe für Anruf und Prozess zählen."""
+        self.histograms[stage].observe(secs)
+        self._process[stage].observe(secs)
+
+    def summary(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """p50/p95 pro Abschnitt (Bucket-Genauigkeit)."""
+        return {
+            stage: {"p50": h.percentile(50), "p95": h.percentile(95), "count": h.count}
+            for stage, h in self.histograms.items()
+        }
+
+
+class LatencyMetrics:
+    """Prozessweite Histogramme und die Messungen der laufenden Anrufe."""
+
+    def __init__(self):
+        """Aktiv, solange LATENCY_METRICS nicht false ist."""
+        self.enabled = os.getenv("LATENCY_METRICS", "true").lower() == "true"
+        self._process = {stage: LatencyHistogram() for stage in STAGES}
+        self._calls: Dict[str, CallMetrics] = {}
+        self._turns = 0
+
+    def start_call(self, call_sid: str) -> CallMetrics:
+        """Legt die Histogramme für einen neuen Anruf an."""
+        call = CallMetrics(call_sid, self._process)
+        self._calls[call_sid] = call
+        return call
+
+    def end_call(self, call_sid: str):
+        """Schreibt die Zusammenfassung des Anrufs ins Log und gibt ihn frei."""
+        call = self._calls.pop(call_sid, None)
+        if call and call.turns:
+            self._turns += call.turns
+            logger.info(f"Latenzen Anruf {call_sid} ({call.turns} Runden): {call.summary()}")
+
+    def render_prometheus(self) -> str:
+        """Prometheus Text Format (Version 0.0.4)."""
+        pid = os.getpid()
+        name = "voice_assistant_stage_latency_seconds"
+        lines: List[str] = [
+            f"# HELP {name} Latenz pro Abschnitt einer Gesprächsrunde",
+            f"# TYPE {name} histogram",
+        ]
+        for stage, histogram in self._process.items():
+            labels = f'stage="{stage}",pid="{pid}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        active_turns = sum(call.turns for call in self._calls.values())
+        lines += [
+            "# HELP voice_assistant_turns_total Gemessene Gesprächsrunden",
+            "# TYPE voice_assistant_turns_total counter",
+            f'voice_assistant_turns_total{{pid="{pid}"}} {self._turns + active_turns}',
+            "# HELP voice_assistant_active_calls Laufende Anrufe mit Latenzmessung",
+            "# TYPE voice_assistant_active_calls gauge",
+            f'voice_assistant_active_calls{{pid="{pid}"}} {len(self._calls)}',
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class TurnLatencyObserver(BaseObserver):
+    """Erfasst die Messpunkte einer Runde anhand weniger Frame-Typen.
+
+    Die Zeitstempel stammen von der Pipeline-Uhr beim Pushen des Frames,
+    die Auswertung selbst läuft asynchron in der Observer Queue.
+    """
+
+    def __init__(self, call: CallMetrics, *, output: FrameProcessor, **kwargs):
+        """Observer für einen Anruf, output ist der Output Transport."""
+        super().__init__(**kwargs)
+        self._call = call
+        self._output = output
+        self._reset_turn()
+
+    def _reset_turn(self):
+        self._vad_stop: Optional[int] = None
+        self._transcript: Optional[int] = None
+        self._first_token: Optional[int] = None
+        self._first_tts_audio: Optional[int] = None
+        self._awaiting_token = False
+
+    async def on_push_frame(self, data: FramePushed):
+        """Zeitpunkte der Frames für die Latenzen festhalten."""
+        frame = data.frame
+        if data.direction != FrameDirection.DOWNSTREAM:
+            return
+
+        if isinstance(frame, UserStartedSpeakingFrame):
+            self._reset_turn()
+        elif isinstance(frame, UserStoppedSpeakingFrame):
+            self._vad_stop = data.timestamp
+        elif isinstance(frame, TranscriptionFrame):
+            # Vor dem VAD Stop zählt das letzte, danach das erste Transkript
+            if (
+                self._vad_stop is None
+                or self._transcript is None
+                or self._transcript < self._vad_stop
+            ):
+                self._transcript = data.timestamp
+        elif isinstance(frame, LLMFullResponseStartFrame):
+            self._awaiting_token = self._vad_stop is not None
+        elif isinstance(frame, LLMTextFrame):
+            if self._awaiting_token and self._first_token is None:
+                self._first_token = data.timestamp
+        elif isinstance(frame, TTSAudioRawFrame):
+            if self._vad_stop is None:
+                return
+            if data.source is not self._output:
+                if self._first_tts_audio is None:
+                    self._first_tts_audio = data.timestamp
+            else:
+                # Der Output Transport pusht jeden Frame direkt vor dem Schreiben
+                self._finish_turn(data.timestamp)
+        elif isinstance(frame, BotStartedSpeakingFrame) and self._vad_stop is not None:
+            # Falls kein TTSAudioRawFrame beobachtet wurde (z.B. anderes Audio)
+            self._finish_turn(data.timestamp)
+
+    def _finish_turn(self, first_output: int):
+        vad_stop = self._vad_stop
+        transcript = max(self._transcript or vad_stop, vad_stop)
+        self._call.turns += 1
+        self._call.observe("stt", (transcript - vad_stop) / 1e9)
+        if self._first_token is not None:
+            self._call.observe("llm", (self._first_token - transcript) / 1e9)
+            if self._first_tts_audio is not None:
+                self._call.observe("tts", (self._first_tts_audio - self._first_token) / 1e9)
+        if self._first_tts_audio is not None:
+            self._call.observe("transport", (first_output - self._first_tts_audio) / 1e9)
+        self._call.observe("turn", (first_output - vad_stop) / 1e9)
+        self._reset_turn()
+
+
+# Ein Register pro Prozess, /metrics liest daraus
+latency_metrics = LatencyMetrics()
@@ -0,0 +1,277 @@
+#
+# Prozessweiter Pool für VAD- und Smart-Turn-Modelle
+#
+# Die ONNX-Modelle werden einmal pro Prozess geladen (idealerweise beim
+# Serverstart). Jeder Anruf bekommt nur noch ein leichtgewichtiges
+# Per-Stream Objekt mit eigenem Zustand, das beim Auflegen zurückgegeben wird.
+#
+# Mit VAD_BATCH rechnet die gemeinsame Batch-Engine (voice_assistant_vad_batch)
+# die Silero Fenster aller Anrufe gebündelt.
+#
+
+"""Prozessweiter Pool für VAD- und Smart-Turn-Modelle."""
+
+import os
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+import numpy as np
+from loguru import logger
+from pipecat.audio.turn.smart_turn.base_smart_turn import BaseSmartTurn, SmartTurnParams
+from pipecat.audio.vad.silero import SileroOnnxModel, SileroVADAnalyzer
+from pipecat.audio.vad.vad_analyzer import VADAnalyzer, VADParams
+from pipecat.transports.base_transport import BaseTransport
+
+from voice_assistant_inference import inference_pool
+from voice_assistant_vad_batch import BatchedVADExecutor, VADBatchEngine, vad_batch_engine
+
+
+class SileroStreamModel(SileroOnnxModel):
+    """Per-Stream Silero Zustand (RNN-State und Kontext) auf einer geteilten ONNX Session."""
+
+    def __init__(self, session):
+        """Zustand eines Streams auf der geteilten Session."""
+        self.session = session
+        self.sample_rates = [8000, 16000]
+        self.reset_states()
+
+
+class PooledSileroVADAnalyzer(SileroVADAnalyzer):
+    """Silero VAD ohne eigenes Modell-Laden, der Zustand kommt aus dem Pool."""
+
+    def __init__(
+        self,
+        model: SileroStreamModel,
+        *,
+        sample_rate: Optional[int] = None,
+        params: Optional[VADParams] = None,
+    ):
+        """VAD auf dem geteilten Modell, ohne es neu zu laden."""
+        # SileroVADAnalyzer.__init__ würde das ONNX Modell erneut laden
+        VADAnalyzer.__init__(self, sample_rate=sample_rate, params=params)
+        self._model = model
+        self._last_reset_time = 0
+
+    def reset(self, *, sample_rate: Optional[int] = None, params: Optional[VADParams] = None):
+        """Setzt den Analyzer für einen neuen Anruf zurück."""
+        VADAnalyzer.__init__(self, sample_rate=sample_rate, params=params)
+        self._model.reset_states()
+        self._last_reset_time = 0
+
+
+class BatchedSileroVADAnalyzer(PooledSileroVADAnalyzer):
+    """Silero VAD, dessen Inferenz die gemeinsame Batch-Engine übernimmt."""
+
+    def __init__(
+        self,
+        model: SileroStreamModel,
+        engine: VADBatchEngine,
+        *,
+        sample_rate: Optional[int] = None,
+        params: Optional[VADParams] = None,
+    ):
+        """VAD, dessen Fenster engine gebündelt auswertet."""
+        super().__init__(model, sample_rate=sample_rate, params=params)
+        self._engine = engine
+        # Vom Batch-Executor vorab berechnete Wahrscheinlichkeiten, in Reihenfolge
+        self._confidences: Deque[float] = deque()
+
+    @property
+    def batch_engine(self) -> VADBatchEngine:
+        """Engine, die die Fenster auswertet."""
+        return self._engine
+
+    @property
+    def stream_model(self) -> SileroStreamModel:
+        """Zustand des Streams."""
+        return self._model
+
+    @property
+    def last_reset_time(self) -> float:
+        """Zeitpunkt des letzten Resets des Modellzustands."""
+        return self._last_reset_time
+
+    @last_reset_time.setter
+    def last_reset_time(self, value: float):
+        self._last_reset_time = value
+
+    def reset(self, *, sample_rate: Optional[int] = None, params: Optional[VADParams] = None):
+        """Zurücksetzen und vorab berechnete Werte verwerfen."""
+        super().reset(sample_rate=sample_rate, params=params)
+        self._confidences.clear()
+
+    def pending_windows(self, buffer: bytes) -> List[bytes]:
+        """Fenster, die `analyze_audio(buffer)` auswerten wird."""
+        data = self._vad_buffer + buffer
+        size = self._vad_frames_num_bytes
+        return [data[i : i + size] for i in range(0, len(data) - size + 1, size)]
+
+    def add_confidence(self, confidence: float):
+        """Vom Batch berechneten Wert einreihen."""
+        self._confidences.append(confidence)
+
+    def voice_confidence(self, buffer) -> float:
+        """Vorab berechneten Wert nehmen, sonst auf den Batch warten."""
+        if self._confidences:
+            return self._confidences.popleft()
+        # Ohne Batch-Executor (z.B. Pipecat Thread pro Anruf) auf den Batch warten
+        return self._engine.confidence(self, buffer)
+
+
+class PooledSmartTurnAnalyzer(BaseSmartTurn):
+    """Smart-Turn Analyzer mit eigenem Audio-Puffer und geteiltem v3 Modell."""
+
+    def __init__(
+        self,
+        model: BaseSmartTurn,
+        *,
+        sample_rate: Optional[int] = None,
+        params: Optional[SmartTurnParams] = None,
+    ):
+        """Smart Turn auf dem geteilten Modell."""
+        super().__init__(sample_rate=sample_rate, params=params)
+        self._model = model
+
+    def reset(self, *, sample_rate: Optional[int] = None, params: Optional[SmartTurnParams] = None):
+        """Setzt den Analyzer für einen neuen Anruf zurück."""
+        BaseSmartTurn.__init__(self, sample_rate=sample_rate, params=params)
+
+    async def _predict_endpoint(self, audio_array: np.ndarray) -> Dict[str, Any]:
+        # Die Vorhersage des geladenen Modells ist zustandslos und kann geteilt werden,
+        # sie läuft auf dem Inferenz-Pool statt im Event Loop
+        return await inference_pool.predict_turn(self._model, audio_array)
+
+
+class AnalyzerPool:
+    """Hält die geladenen Modelle und wiederverwendbare Per-Stream Analyzer.
+
+    Ein "Hit" bedeutet, dass ein freier Analyzer wiederverwendet wurde, ein
+    "Miss", dass ein neuer Per-Stream Zustand angelegt werden musste.
+    """
+
+    def __init__(self, *, batch_engine: Optional[VADBatchEngine] = None):
+        """Modelle werden erst bei warmup() oder dem ersten Anruf geladen."""
+        self._lock = threading.Lock()
+        self._batch_engine = batch_engine
+        self._vad_session = None
+        self._smart_turn_model: Optional[BaseSmartTurn] = None
+        self._free_vad: List[PooledSileroVADAnalyzer] = []
+        self._free_turn: List[PooledSmartTurnAnalyzer] = []
+        self._vad_in_use = 0
+        self._turn_in_use = 0
+        self._hits = 0
+        self._misses = 0
+
+    def warmup(self, *, smart_turn: bool = False, reserve: int = 0):
+        """Lädt die Modelle und legt `reserve` freie Per-Stream Analyzer an."""
+        self._load_vad_model()
+        if smart_turn:
+            self._load_smart_turn_model()
+
+        with self._lock:
+            while len(self._free_vad) < reserve:
+                self._free_vad.append(self._new_vad_analyzer(self._vad_session))
+            while smart_turn and len(self._free_turn) < reserve:
+                self._free_turn.append(PooledSmartTurnAnalyzer(self._smart_turn_model))
+
+        logger.info(f"Analyzer Pool vorgewärmt: {self.stats()}")
+
+    def vad_analyzer(
+        self, *, sample_rate: Optional[int] = None, params: Optional[VADParams] = None
+    ) -> PooledSileroVADAnalyzer:
+        """Holt einen Silero VAD Analyzer für einen Anruf aus dem Pool."""
+        session = self._load_vad_model()
+        with self._lock:
+            self._vad_in_use += 1
+            if self._free_vad:
+                self._hits += 1
+                analyzer = self._free_vad.pop()
+                analyzer.reset(sample_rate=sample_rate, params=params)
+                return analyzer
+            self._misses += 1
+        return self._new_vad_analyzer(session, sample_rate=sample_rate, params=params)
+
+    def _new_vad_analyzer(self, session, **kwargs) -> PooledSileroVADAnalyzer:
+        if self._batch_engine:
+            return BatchedSileroVADAnalyzer(
+                SileroStreamModel(session), self._batch_engine, **kwargs
+            )
+        return PooledSileroVADAnalyzer(SileroStreamModel(session), **kwargs)
+
+    def turn_analyzer(
+        self, *, sample_rate: Optional[int] = None, params: Optional[SmartTurnParams] = None
+    ) -> PooledSmartTurnAnalyzer:
+        """Holt einen Smart-Turn v3 Analyzer für einen Anruf aus dem Pool."""
+        model = self._load_smart_turn_model()
+        with self._lock:
+            self._turn_in_use += 1
+            if self._free_turn:
+                self._hits += 1
+                analyzer = self._free_turn.pop()
+                analyzer.reset(sample_rate=sample_rate, params=params)
+                return analyzer
+            self._misses += 1
+        return PooledSmartTurnAnalyzer(model, sample_rate=sample_rate, params=params)
+
+    def release(self, analyzer):
+        """Gibt einen Analyzer nach dem Anruf an den Pool zurück."""
+        with self._lock:
+            if isinstance(analyzer, PooledSileroVADAnalyzer):
+                self._vad_in_use -= 1
+                self._free_vad.append(analyzer)
+            elif isinstance(analyzer, PooledSmartTurnAnalyzer):
+                self._turn_in_use -= 1
+                self._free_turn.append(analyzer)
+
+    def release_transport(self, transport: BaseTransport):
+        """Gibt VAD- und Turn-Analyzer eines beendeten Transports zurück."""
+        transport_input = transport.input()
+        self.release(transport_input.turn_analyzer)
+        vad_analyzer = transport_input.vad_analyzer
+        executor = getattr(transport_input, "_executor", None)
+        if isinstance(executor, BatchedVADExecutor):
+            # Fenster in der Engine schreiben noch in den Zustand des Analyzers,
+            # erst danach darf ihn der nächste Anruf bekommen
+            executor.close(lambda: self.release(vad_analyzer))
+        else:
+            self.release(vad_analyzer)
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool-Größe und Hit/Miss Zähler für /health."""
+        with self._lock:
+            return {
+                "vad_model_loaded": self._vad_session is not None,
+                "smart_turn_model_loaded": self._smart_turn_model is not None,
+                "vad_in_use": self._vad_in_use,
+                "vad_idle": len(self._free_vad),
+                "turn_in_use": self._turn_in_use,
+                "turn_idle": len(self._free_turn),
+                "hits": self._hits,
+                "misses": self._misses,
+                "vad_batch": self._batch_engine.stats() if self._batch_engine else None,
+            }
+
+    def _load_vad_model(self):
+        with self._lock:
+            if self._vad_session is None:
+                # Einmal regulär laden, danach wird nur noch die Session geteilt
+                self._vad_session = SileroVADAnalyzer()._model.session
+            return self._vad_session
+
+    def _load_smart_turn_model(self) -> BaseSmartTurn:
+        with self._lock:
+            if self._smart_turn_model is None:
+                # Import erst hier, damit transformers nur bei Bedarf geladen wird
+                from pipecat.audio.turn.smart_turn.local_smart_turn_v3 import (
+                    LocalSmartTurnAnalyzerV3,
+                )
+
+                self._smart_turn_model = LocalSmartTurnAnalyzerV3()
+            return self._smart_turn_model
+
+
+# Ein Pool pro Prozess, wird von allen Anrufen geteilt
+analyzer_pool = AnalyzerPool(
+    batch_engine=vad_batch_engine if os.getenv("VAD_BATCH", "true").lower() == "true" else None
+)
@@ -11,8 +11,6 @@ from dotenv import load_dotenv
 from loguru import logger
 
 from pipecat.audio.turn.smart_turn.base_smart_turn import SmartTurnParams
-from pipecat.audio.turn.smart_turn.local_smart_turn_v3 import LocalSmartTurnAnalyzerV3
-from pipecat.audio.vad.silero import SileroVADAnalyzer
 from pipecat.audio.vad.vad_analyzer import VADParams
 from pipecat.frames.frames import LLMRunFrame
 from pipecat.pipeline.pipeline import Pipeline
@@ -22,37 +20,46 @@ from pipecat.processors.aggregators.llm_context import LLMContext
 from pipecat.processors.aggregators.llm_response_universal import LLMContextAggregatorPair
 from pipecat.runner.types import RunnerArguments
 from pipecat.runner.utils import create_transport
-from pipecat.services.deepgram.stt import DeepgramSTTService
 from pipecat.services.deepgram.tts import DeepgramTTSService
-from pipecat.services.openai.llm import OpenAILLMService
 from pipecat.transports.base_transport import BaseTransport, TransportParams
-from pipecat.transports.daily.transport import DailyParams
 from pipecat.transports.websocket.fastapi import FastAPIWebsocketParams
+from voice_assistant_connections import PooledDeepgramSTTService, PooledOpenAILLMService
+from voice_assistant_context import ContextBudget
+from voice_assistant_inference import inference_pool
+from voice_assistant_models import analyzer_pool
 
 load_dotenv(override=True)
 
 
-# We store functions so objects (e.g. SileroVADAnalyzer) don't get
-# instantiated. The function will be called when the desired transport gets
-# selected.
-transport_params = {
-    "daily": lambda: DailyParams(
+def daily_params() -> TransportParams:
+    """Transport params for Daily."""
+    # Imported only when Daily is selected, daily-python is an optional dependency
+    from pipecat.transports.daily.transport import DailyParams
+
+    return DailyParams(
         audio_in_enabled=True,
         audio_out_enabled=True,
-        vad_analyzer=SileroVADAnalyzer(params=VADParams(stop_secs=0.2)),
-        turn_analyzer=LocalSmartTurnAnalyzerV3(params=SmartTurnParams()),
-    ),
+        vad_analyzer=analyzer_pool.vad_analyzer(params=VADParams(stop_secs=0.2)),
+        turn_analyzer=analyzer_pool.turn_analyzer(params=SmartTurnParams()),
+    )
+
+
+# We store functions so analyzers only get checked out of the pool when the
+# desired transport gets selected. Models are loaded once per process, each
+# session only gets its own per-stream state.
+transport_params = {
+    "daily": daily_params,
     "twilio": lambda: FastAPIWebsocketParams(
         audio_in_enabled=True,
         audio_out_enabled=True,
-        vad_analyzer=SileroVADAnalyzer(params=VADParams(stop_secs=0.2)),
-        turn_analyzer=LocalSmartTurnAnalyzerV3(params=SmartTurnParams()),
+        vad_analyzer=analyzer_pool.vad_analyzer(params=VADParams(stop_secs=0.2)),
+        turn_analyzer=analyzer_pool.turn_analyzer(params=SmartTurnParams()),
     ),
     "webrtc": lambda: TransportParams(
         audio_in_enabled=True,
         audio_out_enabled=True,
-        vad_analyzer=SileroVADAnalyzer(params=VADParams(stop_secs=0.2)),
-        turn_analyzer=LocalSmartTurnAnalyzerV3(params=SmartTurnParams()),
+        vad_analyzer=analyzer_pool.vad_analyzer(params=VADParams(stop_secs=0.2)),
+        turn_analyzer=analyzer_pool.turn_analyzer(params=SmartTurnParams()),
     ),
 }
 
@@ -60,11 +67,15 @@ transport_params = {
 async def run_bot(transport: BaseTransport, runner_args: RunnerArguments):
     logger.info(f"Starting bot")
 
-    stt = DeepgramSTTService(api_key=os.getenv("DEEPGRAM_API_KEY"))
+    # Run VAD on the shared inference pool instead of one thread per session
+    inference_pool.attach_transport(transport)
+
+    # Shared clients and pre-opened streaming sockets across sessions
+    stt = PooledDeepgramSTTService(api_key=os.getenv("DEEPGRAM_API_KEY"))
 
     tts = DeepgramTTSService(api_key=os.getenv("DEEPGRAM_API_KEY"), voice="aura-2-andromeda-en")
 
-    llm = OpenAILLMService(api_key=os.getenv("OPENAI_API_KEY"))
+    llm = PooledOpenAILLMService(api_key=os.getenv("OPENAI_API_KEY"))
 
     messages = [
         {
@@ -76,11 +87,20 @@ async def run_bot(transport: BaseTransport, runner_args: RunnerArguments):
     context = LLMContext(messages)
     context_aggregator = LLMContextAggregatorPair(context)
 
+    # Keep the context within a token budget, older turns get summarized
+    context_budget = ContextBudget(
+        context,
+        llm,
+        max_tokens=int(os.getenv("CONTEXT_MAX_TOKENS", "4000")),
+        keep_turns=int(os.getenv("CONTEXT_KEEP_TURNS", "4")),
+    )
+
     pipeline = Pipeline(
         [
             transport.input(),  # Transport user input
             stt,  # STT
             context_aggregator.user(),  # User responses
+            context_budget.processor(),  # Context token budget
             llm,  # LLM
             tts,  # TTS
             transport.output(),  # Transport bot output
@@ -111,7 +131,10 @@ async def run_bot(transport: BaseTransport, runner_args: RunnerArguments):
 
     runner = PipelineRunner(handle_sigint=runner_args.handle_sigint)
 
-    await runner.run(task)
+    try:
+        await runner.run(task)
+    finally:
+        analyzer_pool.release_transport(transport)
 
 
 async def bot(runner_args: RunnerArguments):
@@ -123,4 +146,6 @@ async def bot(runner_args: RunnerArguments):
 if __name__ == "__main__":
     from pipecat.runner.run import main
 
+    analyzer_pool.warmup(smart_turn=True)
+    inference_pool.start()
     main()
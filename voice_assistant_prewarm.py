@@ -0,0 +1,98 @@
+#
+# Vorbereitete Anrufe, geschlüsselt nach CallSid
+#
+# Zwischen Twilio Webhook und WebSocket vergehen ein bis zwei Sekunden
+# (<Say> Ansage). In dieser Zeit werden Services, Kontext, VAD Zustand und
+# Pipeline-Stufen eines Anrufs schon gebaut und hier kurz geparkt. Der
+# WebSocket Handler übernimmt sie, statt alles erst nach den ersten
+# Twilio Nachrichten aufzubauen.
+#
+# Landen Webhook und WebSocket in verschiedenen Worker-Prozessen, findet der
+# WebSocket nichts und baut wie bisher selbst, der vorbereitete Anruf läuft
+# nach `ttl_secs` ab und wird freigegeben.
+#
+
+"""Vorbereitete Anrufe, geschlüsselt nach CallSid."""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Generic, Optional, TypeVar
+
+from loguru import logger
+
+T = TypeVar("T")
+
+# So lange wartet ein vorbereiteter Anruf auf seinen WebSocket
+PREPARED_CALL_TTL_SECS = 15.0
+
+
+class PreparedCallRegistry(Generic[T]):
+    """Baut Anrufe im Voraus und gibt sie genau einmal an den WebSocket Handler heraus."""
+
+    def __init__(
+        self,
+        prepare: Callable[[str], Awaitable[T]],
+        discard: Callable[[T], None],
+        *,
+        ttl_secs: float = PREPARED_CALL_TTL_SECS,
+    ):
+        """prepare/discard bauen und verwerfen, Einträge leben ttl_secs."""
+        self._prepare = prepare
+        self._discard = discard
+        self._ttl_secs = ttl_secs
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._expiry: Dict[str, asyncio.TimerHandle] = {}
+        self._prepared = 0
+        self._attached = 0
+        self._expired = 0
+        self._misses = 0
+        self._failed = 0
+
+    async def prepare(self, call_sid: str):
+        """Startet die Vorbereitung im Hintergrund (als BackgroundTask der Webhook Antwort)."""
+        if not call_sid or call_sid in self._tasks:
+            return
+        loop = asyncio.get_running_loop()
+        self._tasks[call_sid] = loop.create_task(self._prepare(call_sid))
+        self._expiry[call_sid] = loop.call_later(self._ttl_secs, self._expire, call_sid)
+        self._prepared += 1
+
+    async def take(self, call_sid: str) -> Optional[T]:
+        """Vorbereiteter Anruf (wartet ggf. auf die laufende Vorbereitung) oder None."""
+        task = self._tasks.pop(call_sid, None)
+        expiry = self._expiry.pop(call_sid, None)
+        if expiry:
+            expiry.cancel()
+        if not task:
+            self._misses += 1
+            return None
+        try:
+            call = await task
+        except Exception as e:
+            self._failed += 1
+            logger.warning(f"Vorbereitung für {call_sid} fehlgeschlagen: {e}")
+            return None
+        self._attached += 1
+        return call
+
+    def _expire(self, call_sid: str):
+        self._expiry.pop(call_sid, None)
+        task = self._tasks.pop(call_sid, None)
+        if not task:
+            return
+        self._expired += 1
+        logger.debug(f"Vorbereiteter Anruf {call_sid} abgelaufen")
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and not task.exception():
+            self._discard(task.result())
+
+    def stats(self) -> Dict[str, Any]:
+        """Zähler für /health."""
+        return {
+            "waiting": len(self._tasks),
+            "prepared": self._prepared,
+            "attached": self._attached,
+            "expired": self._expired,
+            "misses": self._misses,
+            "failed": self._failed,
+        }
@@ -1,19 +1,105 @@
 #
 # FastAPI Server für KI Voice Assistant mit Twilio Integration
 #
+# Beim Import nur FastAPI und leichte Module, damit uvicorn den Port sofort
+# bindet. Pipeline, Modelle und Caches lädt die Preload Phase danach (siehe
+# voice_assistant_startup.py), /ready meldet den Worker erst dann bereit.
+#
+
+from voice_assistant_startup import boot
 
+import asyncio
 import os
+from typing import Optional
+
 import uvicorn
 from dotenv import load_dotenv
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from starlette.background import BackgroundTask
 from loguru import logger
-from voice_assistant_bot import handle_twilio_call
+from voice_assistant_accounting import call_accounting
+from voice_assistant_capacity import CallCapacity
+from voice_assistant_logging import log_pipeline
 
 load_dotenv(override=True)
+log_pipeline.configure()
 
 app = FastAPI(title="KI Voice Assistant", description="Twilio Voice Assistant mit ElevenLabs, Deepgram und OpenAI")
 
+# Anruflimit pro Worker-Prozess (SERVER_WORKERS Prozesse teilen sich den Port)
+capacity = CallCapacity(
+    max_calls=int(os.getenv("MAX_CALLS_PER_WORKER", "20")),
+    state_dir=os.getenv("WORKER_STATE_DIR"),
+    memory_budget_mb=int(os.getenv("MEMORY_BUDGET_MB", "0")),
+)
+
+# Schwere Module, die erst nach dem Binden des Ports geladen werden (in dieser
+# Reihenfolge, die Zeit pro Eintrag steht im Boot-Bericht)
+PRELOAD_IMPORTS = [
+    "pipecat.pipeline.task",
+    "voice_assistant_connections",
+    "voice_assistant_models",
+    "voice_assistant_intents",
+    "voice_assistant_bot",
+]
+
+# So lange wartet ein Twilio Stream, der vor dem Ende des Preloads ankommt
+READY_WAIT_SECS = float(os.getenv("READY_WAIT_SECS", "15"))
+
+preload_task: Optional[asyncio.Task] = None
+
+
+async def preload(boot):
+    """Lädt Pipeline, VAD Modelle und rendert Begrüßung und FAQ Antworten vor dem ersten Anruf."""
+    await boot.import_modules(PRELOAD_IMPORTS)
+
+    from voice_assistant_bot import get_greeting, prerender_intent_answers
+    from voice_assistant_inference import inference_pool
+    from voice_assistant_memory import gc_policy
+    from voice_assistant_models import analyzer_pool
+
+    await boot.step(
+        "vad_models",
+        analyzer_pool.warmup,
+        reserve=int(os.getenv("VAD_POOL_RESERVE", "4")),
+        in_thread=True,
+    )
+    await boot.step("inference_pool", inference_pool.start, in_thread=True)
+    await boot.step("greeting", get_greeting)
+    await boot.step("intent_answers", prerender_intent_answers)
+    # Nach dem Warmup: Modelle und Caches aus den GC Läufen nehmen
+    await boot.step("gc_freeze", gc_policy.start)
+
+
+@app.on_event("startup")
+async def start_worker():
+    """Startet die Preload Phase im Hintergrund, uvicorn bindet danach sofort den Port."""
+    global preload_task
+    capacity.start()
+    call_accounting.install()
+    boot.bound()
+    preload_task = asyncio.create_task(boot.run(preload))
+
+
+@app.on_event("shutdown")
+async def shutdown_worker():
+    """Meldet den Worker aus der Kapazitätsberechnung ab und schließt die Verbindungen."""
+    await capacity.stop()
+    if preload_task:
+        preload_task.cancel()
+    if boot.done("voice_assistant_bot"):
+        from voice_assistant_archive import call_archive
+        from voice_assistant_connections import provider_connections
+        from voice_assistant_inference import inference_pool
+        from voice_assistant_memory import gc_policy
+
+        await call_archive.stop()
+        await gc_policy.stop()
+        await provider_connections.close()
+        inference_pool.shutdown()
+    log_pipeline.stop()
+
 
 @app.get("/")
 async def root():
@@ -26,7 +112,105 @@ async def health_check():
     """Health Check Endpoint"""
     # Für Railway Deployment sind alle API Keys optional beim Health Check
     # Sie werden zur Laufzeit bei der ersten Verwendung validiert
-    return {"status": "healthy", "message": "Voice Assistant Server läuft", "port": os.getenv("PORT", "8000")}
+    if not boot.ready:
+        return {
+            "status": "failed" if boot.error else "starting",
+            "message": "Voice Assistant Server lädt",
+            "port": os.getenv("PORT", "8000"),
+            "boot": boot.stats(),
+            "worker": capacity.stats(),
+        }
+
+    from voice_assistant_archive import call_archive
+    from voice_assistant_bot import prepared_calls, tts_cache
+    from voice_assistant_chunking import chunking_stats
+    from voice_assistant_connections import provider_connections
+    from voice_assistant_context import context_stats
+    from voice_assistant_hedging import hedge_stats
+    from voice_assistant_inference import inference_pool
+    from voice_assistant_intents import intent_stats
+    from voice_assistant_memory import gc_policy
+    from voice_assistant_models import analyzer_pool
+    from voice_assistant_speculation import speculation_stats
+    from voice_assistant_stt_gate import stt_gate_stats
+
+    return {
+        "status": "healthy",
+        "message": "Voice Assistant Server läuft",
+        "port": os.getenv("PORT", "8000"),
+        "boot": boot.stats(),
+        "analyzer_pool": analyzer_pool.stats(),
+        "inference": inference_pool.stats(),
+        "tts_cache": tts_cache.stats(),
+        "chunking": chunking_stats.stats(),
+        "speculation": speculation_stats.stats(),
+        "hedging": hedge_stats.stats(),
+        "stt_gate": stt_gate_stats.stats(),
+        "memory": gc_policy.stats(),
+        "logging": log_pipeline.stats(),
+        "archive": call_archive.stats(),
+        "context": context_stats.stats(),
+        "intents": intent_stats.stats(),
+        "prepared_calls": prepared_calls.stats(),
+        "connections": provider_connections.stats(),
+        "accounting": call_accounting.stats(),
+        "worker": capacity.stats(),
+        "workers": capacity.cluster_stats(),
+    }
+
+
+@app.get("/calls")
+async def active_calls():
+    """Laufende Anrufe dieses Workers mit CPU, Puffern, Provider-Streams und Tasks."""
+    worker = capacity.stats()
+    return {
+        "pid": worker["pid"],
+        "rss_mb": worker["rss_mb"],
+        "memory_budget_mb": worker["memory_budget_mb"],
+        "calls": call_accounting.snapshot(),
+    }
+
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness: 200 erst nach dem Preload, für den Health Check des Deployments."""
+    return JSONResponse(boot.stats(), status_code=200 if boot.ready else 503)
+
+
+@app.get("/metrics")
+async def metrics():
+    """Latenz-Histogramme pro Abschnitt im Prometheus Format (pro Worker-Prozess)."""
+    if not boot.ready:
+        return PlainTextResponse("Preload läuft\n", status_code=503)
+
+    from voice_assistant_metrics import latency_metrics
+
+    return PlainTextResponse(
+        latency_metrics.render_prometheus(), media_type="text/plain; version=0.0.4"
+    )
+
+
+def stream_fallback_twiml() -> str:
+    """TwiML nach <Connect>: läuft, wenn der Server den Stream schließt (Worker voll, Preload)."""
+    overflow_number = os.getenv("OVERFLOW_NUMBER")
+    if overflow_number:
+        return f"<Dial>{overflow_number}</Dial>"
+    return """<Say language="de-DE">Leider ist gerade keine Verbindung möglich. Bitte rufen Sie später noch einmal an.</Say>
+    <Hangup />"""
+
+
+def overloaded_twiml() -> str:
+    """TwiML für Anrufe, die wegen voller Kapazität (Anrufe oder Speicher) nicht angenommen werden."""
+    overflow_number = os.getenv("OVERFLOW_NUMBER")
+    if overflow_number:
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Dial>{overflow_number}</Dial>
+</Response>"""
+    return """<?xml version="1.0" encoding="UTF-8"?>
+<Response>
+    <Reject reason="busy" />
+</Response>"""
 
 
 @app.post("/webhook/twilio")
@@ -37,7 +221,15 @@ async def twilio_webhook(request: Request):
     """
     logger.info("🔥 TWILIO WEBHOOK AUFGERUFEN!")
     form_data = await request.form()
-    logger.info(f"Twilio Form Data: {dict(form_data)}")
+    logger.debug(f"Twilio Form Data: {dict(form_data)}")
+
+    # Bei erschöpfter Kapazität oder überschrittenem Speicherbudget (oder vor dem
+    # Ende des Preloads) ablehnen oder an eine Ausweichnummer weiterleiten, bevor
+    # die Audioqualität aller Anrufe leidet
+    call_sid = form_data.get("CallSid", "")
+    if not boot.ready or not capacity.try_admit(call_sid):
+        return Response(content=overloaded_twiml(), media_type="application/xml")
+
     # TwiML Response für Twilio
     # Dynamische Domain für Produktion/Development
     domain = os.getenv("SERVER_DOMAIN", "localhost:8000")
@@ -48,12 +240,16 @@ async def twilio_webhook(request: Request):
     <Connect>
         <Stream url="wss://{domain}/ws/twilio" />
     </Connect>
+    {stream_fallback_twiml()}
 </Response>"""
 
-    from fastapi.responses import Response
+    # Während Twilio die Ansage spielt, wird der Anruf schon aufgebaut
+    from voice_assistant_bot import prepared_calls
+
     return Response(
         content=twiml_response,
-        media_type="application/xml"
+        media_type="application/xml",
+        background=BackgroundTask(prepared_calls.prepare, call_sid),
     )
 
 
@@ -64,17 +260,40 @@ async def twilio_websocket(websocket: WebSocket):
     Hier wird die Echtzeit-Audiokommunikation abgewickelt
     """
     logger.info(f"WebSocket connection attempt from: {websocket.client}")
-    logger.info(f"WebSocket headers: {websocket.headers}")
+    logger.debug(f"WebSocket headers: {websocket.headers}")
     await websocket.accept()
     logger.info("Twilio WebSocket Verbindung akzeptiert")
 
+    if not await boot.wait_ready(READY_WAIT_SECS):
+        logger.error("Preload nicht abgeschlossen, Twilio WebSocket wird geschlossen")
+        await websocket.close()
+        return
+
+    from voice_assistant_bot import handle_twilio_call, read_twilio_start
+
+    try:
+        stream_sid, call_sid = await read_twilio_start(websocket)
+    except (WebSocketDisconnect, StopAsyncIteration):
+        logger.info("Twilio WebSocket vor dem Start beendet")
+        return
+    except Exception as e:
+        logger.error(f"Ungültiger Start des Twilio Streams: {e}")
+        await websocket.close()
+        return
+
+    # Der Stream landet nicht unbedingt im Worker des Webhooks: hier gilt das
+    # Limit dieses Workers, Twilio spielt sonst die Ausweich-TwiML
+    if not capacity.call_started(call_sid):
+        await websocket.close()
+        return
     try:
-        await handle_twilio_call(websocket)
+        await handle_twilio_call(websocket, stream_sid, call_sid)
     except WebSocketDisconnect:
         logger.info("Twilio WebSocket Verbindung beendet")
     except Exception as e:
         logger.error(f"Fehler in Twilio WebSocket: {e}")
     finally:
+        capacity.call_ended(call_sid)
         logger.info("Twilio WebSocket Handler beendet")
 
 
@@ -94,8 +313,10 @@ if __name__ == "__main__":
     # Server-Konfiguration
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8000"))
+    # Mehrere Worker-Prozesse verteilen die Anrufe auf mehrere CPU-Kerne
+    workers = int(os.getenv("SERVER_WORKERS", "1"))
 
-    logger.info(f"Starte KI Voice Assistant Server auf {host}:{port}")
+    logger.info(f"Starte KI Voice Assistant Server auf {host}:{port} mit {workers} Worker(n)")
 
     # Server starten
     uvicorn.run(
@@ -103,5 +324,6 @@ if __name__ == "__main__":
         host=host,
         port=port,
         reload=False,  # DISABLED for stable production
+        workers=workers,
         log_level="info"
     )
\ No newline at end of file
@@ -0,0 +1,340 @@
+#
+# Spekulative LLM Antworten auf stabilen Deepgram Zwischenergebnissen
+#
+# Sobald sich das Transkript (finale Teile plus Zwischenergebnis) für ein
+# einstellbares Fenster nicht mehr ändert, startet bereits eine OpenAI
+# Completion. Kommt der User-Kontext vom Aggregator mit demselben
+# (normalisierten) Text an, wird die laufende Antwort übernommen statt eine
+# neue zu starten. Sonst wird sie verworfen und das LLM läuft wie bisher.
+#
+# Pipeline: stt -> speculation.trigger() -> context_aggregator.user()
+#               -> speculation.gate() -> llm
+#
+
+"""Spekulative LLM Antworten auf stabilen Deepgram Zwischenergebnissen."""
+
+import asyncio
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from loguru import logger
+from pipecat.adapters.services.open_ai_adapter import OpenAILLMInvocationParams
+from pipecat.frames.frames import (
+    CancelFrame,
+    EndFrame,
+    Frame,
+    InterimTranscriptionFrame,
+    InterruptionFrame,
+    LLMFullResponseEndFrame,
+    LLMFullResponseStartFrame,
+    LLMTextFrame,
+    TranscriptionFrame,
+)
+from pipecat.processors.aggregators.openai_llm_context import (
+    OpenAILLMContext,
+    OpenAILLMContextFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from pipecat.services.openai.base_llm import BaseOpenAILLMService
+
+from voice_assistant_context import estimate_tokens
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]")
+_WHITESPACE_RE = re.compile(r"\s+")
+
+# Markiert das Ende bzw. den Abbruch (z.B. Tool Call) einer Spekulation in der Queue
+_DONE = object()
+_FAILED = object()
+
+
+def normalize_transcript(text: str) -> str:
+    """Vergleichsform eines Transkripts (ohne Satzzeichen und Groß-/Kleinschreibung)."""
+    text = unicodedata.normalize("NFC", text)
+    text = _PUNCTUATION_RE.sub("", text.casefold())
+    return _WHITESPACE_RE.sub(" ", text).strip()
+
+
+class SpeculationStats:
+    """Prozessweite Zähler für /health."""
+
+    def __init__(self):
+        """Leere Statistik."""
+        self.started = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted_tokens = 0
+        self.turns_without_speculation = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        decided = self.hits + self.misses
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / decided, 3) if decided else None,
+            "wasted_tokens": self.wasted_tokens,
+            "turns_without_speculation": self.turns_without_speculation,
+        }
+
+
+class Speculation:
+    """Eine laufende spekulative Completion und ihre bisher empfangenen Tokens."""
+
+    def __init__(self, text: str, base_messages: List[Dict[str, Any]]):
+        """Spekulative Anfrage für text auf dem Kontext base_messages."""
+        self.text = text
+        self.normalized = normalize_transcript(text)
+        self.base_messages = base_messages
+        self.messages = base_messages + [{"role": "user", "content": text}]
+        # Den Prompt bezahlt auch eine verworfene Spekulation
+        self.prompt_tokens = estimate_tokens(self.messages)
+        self.tokens: asyncio.Queue = asyncio.Queue()
+        self.token_count = 0
+        self.task: Optional[asyncio.Task] = None
+
+    @property
+    def total_tokens(self) -> int:
+        """Prompt und bisher empfangene Completion Tokens."""
+        return self.prompt_tokens + self.token_count
+
+
+class SpeculativeLLM:
+    """Gemeinsamer Zustand der beiden Pipeline-Stufen.
+
+    Der Trigger sitzt vor dem User-Aggregator und sieht die Transkripte, das
+    Gate sitzt dahinter und entscheidet beim Kontext-Frame über Treffer oder
+    Fehlschlag.
+    """
+
+    def __init__(
+        self,
+        llm: BaseOpenAILLMService,
+        context: OpenAILLMContext,
+        *,
+        stable_secs: float = 0.3,
+        stats: Optional[SpeculationStats] = None,
+    ):
+        """Startet eine Anfrage, wenn das Interim Transkript stable_secs stabil ist."""
+        self._llm = llm
+        self._context = context
+        self._stable_secs = stable_secs
+        self._stats = stats or speculation_stats
+        self._trigger = SpeculationTrigger(self)
+        self._gate = SpeculationGate(self)
+
+        # Transkript der laufenden Runde
+        self._finals: List[str] = []
+        self._interim = ""
+        self._stable_task: Optional[asyncio.Task] = None
+        self._speculation: Optional[Speculation] = None
+        # Übernommene Spekulation, die gerade ausgespielt wird
+        self._active: Optional[Speculation] = None
+
+    def trigger(self) -> FrameProcessor:
+        """Pipeline-Stufe zwischen STT und User-Aggregator."""
+        return self._trigger
+
+    def gate(self) -> FrameProcessor:
+        """Pipeline-Stufe zwischen User-Aggregator und LLM."""
+        return self._gate
+
+    @property
+    def _candidate(self) -> str:
+        return " ".join(self._finals + ([self._interim] if self._interim else []))
+
+    async def on_interim(self, text: str):
+        """Neues Interim Transkript."""
+        self._interim = text.strip()
+        await self._transcript_changed()
+
+    async def on_final(self, text: str):
+        """Finales Transkript anhängen."""
+        if text.strip():
+            self._finals.append(text.strip())
+        self._interim = ""
+        await self._transcript_changed()
+
+    async def _transcript_changed(self):
+        candidate = self._candidate
+        if self._stable_task:
+            await self._trigger.cancel_task(self._stable_task)
+            self._stable_task = None
+        # Läuft bereits eine Spekulation für genau diesen Text, weiterlaufen lassen
+        if self._speculation and self._speculation.normalized == normalize_transcript(candidate):
+            return
+        await self._discard()
+        if candidate:
+            self._stable_task = self._trigger.create_task(self._start_when_stable(candidate))
+
+    async def _start_when_stable(self, text: str):
+        await asyncio.sleep(self._stable_secs)
+        self._stable_task = None
+        speculation = Speculation(text, list(self._context.get_messages()))
+        speculation.task = self._trigger.create_task(self._run(speculation))
+        self._speculation = speculation
+        self._stats.started += 1
+        logger.debug(f"Spekulative LLM Antwort gestartet für: {text}")
+
+    async def _run(self, speculation: Speculation):
+        stream = None
+        try:
+            stream = await self._llm.get_chat_completions(
+                OpenAILLMInvocationParams(
+                    messages=speculation.messages,
+                    tools=self._context.tools,
+                    tool_choice=self._context.tool_choice,
+                )
+            )
+            async for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta:
+                    continue
+                delta = chunk.choices[0].delta
+                if delta.tool_calls:
+                    # Tool Calls übernimmt das LLM selbst
+                    speculation.tokens.put_nowait(_FAILED)
+                    return
+                if delta.content:
+                    speculation.token_count += 1
+                    speculation.tokens.put_nowait(delta.content)
+            speculation.tokens.put_nowait(_DONE)
+        except Exception as e:
+            logger.warning(f"Spekulative LLM Antwort fehlgeschlagen: {e}")
+            speculation.tokens.put_nowait(_FAILED)
+        finally:
+            if stream is not None:
+                await stream.close()
+
+    async def _discard(self):
+        """Verwirft die laufende Spekulation (Fehlschlag)."""
+        speculation = self._speculation
+        self._speculation = None
+        if not speculation:
+            return
+        if speculation.task:
+            await self._trigger.cancel_task(speculation.task)
+        self._stats.misses += 1
+        self._stats.wasted_tokens += speculation.total_tokens
+
+    async def take(self, context: OpenAILLMContext) -> Optional[Speculation]:
+        """Liefert die Spekulation, wenn sie zum neuen User-Kontext passt, und beendet die Runde."""
+        speculation = self._speculation
+        messages = context.get_messages()
+        matches = (
+            speculation is not None
+            and len(messages) == len(speculation.base_messages) + 1
+            and messages[-1].get("role") == "user"
+            and normalize_transcript(str(messages[-1].get("content", ""))) == speculation.normalized
+            and messages[:-1] == speculation.base_messages
+        )
+        if not speculation:
+            self._stats.turns_without_speculation += 1
+        elif not matches:
+            await self._discard()
+        await self.reset_turn()
+        if not matches:
+            return None
+        self._speculation = None
+        self._active = speculation
+        return speculation
+
+    async def skip_turn(self):
+        """Die Runde wurde ohne LLM beantwortet (z.B. Intent Fast-Path)."""
+        await self._discard()
+        await self.reset_turn()
+
+    def replay_started(self, speculation: Speculation):
+        """Die Spekulation wird als Antwort ausgespielt (Treffer)."""
+        self._stats.hits += 1
+
+    async def replay_finished(self, speculation: Speculation, *, failed: bool):
+        """Ausspielen beendet, bei `failed` (z.B. Tool Call) übernimmt das LLM."""
+        self._active = None
+        if failed:
+            self._stats.misses += 1
+            self._stats.wasted_tokens += speculation.total_tokens
+
+    async def reset_turn(self):
+        """Beginnt eine neue Runde (nach Übergabe an das LLM oder am Ende des Anrufs)."""
+        self._finals = []
+        self._interim = ""
+        if self._stable_task:
+            await self._trigger.cancel_task(self._stable_task)
+            self._stable_task = None
+
+    async def interrupt(self):
+        """Unterbrechung durch den Anrufer: laufende Spekulation und Ausspielen abbrechen."""
+        await self._discard()
+        active = self._active
+        self._active = None
+        if active and active.task:
+            await self._trigger.cancel_task(active.task)
+
+    async def cancel(self):
+        """Verwirft alles am Ende des Anrufs."""
+        await self.reset_turn()
+        await self.interrupt()
+
+
+class SpeculationTrigger(FrameProcessor):
+    """Beobachtet die Transkripte und startet Spekulationen, Frames laufen unverändert durch."""
+
+    def __init__(self, speculative: SpeculativeLLM, **kwargs):
+        """Prozessor nach dem STT."""
+        super().__init__(**kwargs)
+        self._speculative = speculative
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        """Transkripte an SpeculativeLLM weitergeben."""
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, InterimTranscriptionFrame):
+            await self._speculative.on_interim(frame.text)
+        elif isinstance(frame, TranscriptionFrame):
+            await self._speculative.on_final(frame.text)
+        elif isinstance(frame, (EndFrame, CancelFrame)):
+            await self._speculative.cancel()
+        await self.push_frame(frame, direction)
+
+
+class SpeculationGate(FrameProcessor):
+    """Ersetzt den LLM Aufruf durch die passende Spekulation oder reicht den Kontext durch."""
+
+    def __init__(self, speculative: SpeculativeLLM, **kwargs):
+        """Prozessor vor dem LLM."""
+        super().__init__(**kwargs)
+        self._speculative = speculative
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        """Passende Spekulation statt einer neuen Anfrage verwenden."""
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, OpenAILLMContextFrame) and direction == FrameDirection.DOWNSTREAM:
+            speculation = await self._speculative.take(frame.context)
+            if not speculation or not await self._replay(speculation):
+                await self.push_frame(frame, direction)
+        elif isinstance(frame, InterruptionFrame):
+            await self._speculative.interrupt()
+            await self.push_frame(frame, direction)
+        else:
+            await self.push_frame(frame, direction)
+
+    async def _replay(self, speculation: Speculation) -> bool:
+        # Wie der LLM Service: Start, Tokens (auch die noch eintreffenden), Ende
+        token = await speculation.tokens.get()
+        if token is _FAILED:
+            await self._speculative.replay_finished(speculation, failed=True)
+            return False
+        self._speculative.replay_started(speculation)
+        await self.push_frame(LLMFullResponseStartFrame())
+        while token is not _DONE and token is not _FAILED:
+            await self.push_frame(LLMTextFrame(token))
+            token = await speculation.tokens.get()
+        await self.push_frame(LLMFullResponseEndFrame())
+        await self._speculative.replay_finished(speculation, failed=False)
+        return True
+
+
+# Ein Zähler pro Prozess, wird von allen Anrufen geteilt
+speculation_stats = SpeculationStats()
@@ -0,0 +1,143 @@
+#
+# Kaltstart: erst den Port binden, dann vorladen
+#
+# Bisher importieren die Server-Einstiegspunkte den ganzen pipecat Stack
+# (scipy, openai, deepgram, onnxruntime, ...) beim Laden des Moduls und
+# laden im Startup Event die Modelle. uvicorn bindet den Port erst danach,
+# bis dahin beantwortet der Worker nicht einmal /health. Jetzt:
+#
+#   - beim Import nur FastAPI und leichte Module, der Port ist sofort offen
+#   - danach läuft die Preload Phase als Task: schwere Imports und das
+#     Laden der Modelle in einem Thread (der Event Loop bleibt frei),
+#     Begrüßung und FAQ Antworten auf dem Loop
+#   - /ready antwortet erst nach dem Preload mit 200, /health schon vorher
+#     (mit dem Stand des Preloads)
+#
+# Die Zeiten pro Import und Preload Schritt stehen nach dem Start im Log
+# und unter /health bzw. /ready (boot).
+#
+
+"""Kaltstart: erst den Port binden, dann vorladen."""
+
+import asyncio
+import importlib
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from loguru import logger
+
+# Zeitpunkt des ersten Imports dieses Moduls (direkt am Anfang der Einstiegspunkte)
+BOOT_STARTED = time.perf_counter()
+
+
+class BootReport:
+    """Import- und Preload Zeiten eines Worker-Prozesses und sein Bereitschaftsstatus."""
+
+    def __init__(self, started: float = BOOT_STARTED):
+        """Zeiten relativ zu started."""
+        self._started = started
+        self._bound_at: Optional[float] = None
+        self._ready_at: Optional[float] = None
+        self._phases: List[Dict[str, Any]] = []
+        self._done: set = set()
+        self._ready: Optional[asyncio.Event] = None
+        self.error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        """Alle Phasen abgeschlossen."""
+        return self._ready_at is not None
+
+    def done(self, name: str) -> bool:
+        """Phase name abgeschlossen."""
+        return name in self._done
+
+    def bound(self):
+        """Im Startup Event: ab hier nimmt uvicorn Verbindungen an."""
+        self._bound_at = time.perf_counter()
+        self._ready = asyncio.Event()
+        logger.info(f"Port gebunden nach {self._bound_at - self._started:.2f}s, Preload startet")
+
+    def _record(self, kind: str, name: str, started: float):
+        self._phases.append(
+            {"kind": kind, "name": name, "secs": round(time.perf_counter() - started, 3)}
+        )
+        self._done.add(name)
+
+    async def import_modules(self, modules: List[str]):
+        """Importiert die Module der Reihe nach in einem Thread, Zeit pro Modul."""
+        for module in modules:
+            started = time.perf_counter()
+            await asyncio.to_thread(importlib.import_module, module)
+            self._record("import", module, started)
+
+    async def step(
+        self, name: str, func: Callable[..., Any], *args, in_thread: bool = False, **kwargs
+    ):
+        """Ein Preload Schritt: synchron (optional im Thread) oder Coroutine."""
+        started = time.perf_counter()
+        if in_thread:
+            result = await asyncio.to_thread(func, *args, **kwargs)
+        else:
+            result = func(*args, **kwargs)
+        if isinstance(result, Awaitable):
+            result = await result
+        self._record("preload", name, started)
+        return result
+
+    async def run(self, preload: Callable[["BootReport"], Awaitable[None]]):
+        """Führt die Preload Phase aus und meldet den Worker danach bereit."""
+        try:
+            await preload(self)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # Nicht bereit melden: der Health Check des Deployments schlägt fehl
+            self.error = f"{type(e).__name__}: {e}"
+            logger.exception(f"Preload fehlgeschlagen: {e}")
+            return
+        self._ready_at = time.perf_counter()
+        self._ready.set()
+        self.log_summary()
+
+    async def wait_ready(self, timeout: float) -> bool:
+        """Höchstens timeout Sekunden auf den Start warten."""
+        if self.ready:
+            return True
+        if self._ready is None or self.error:
+            return False
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def log_summary(self):
+        """Dauer der Phasen loggen."""
+
+        def phases(kind: str) -> str:
+            return ", ".join(f"{p['name']} {p['secs']}s" for p in self._phases if p["kind"] == kind)
+
+        stats = self.stats()
+        logger.info(
+            f"Bereit nach {stats['ready_secs']}s (Port nach {stats['bound_secs']}s) | "
+            f"Imports: {phases('import')} | Preload: {phases('preload')}"
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+
+        def since_start(at: Optional[float]) -> Optional[float]:
+            return round(at - self._started, 3) if at is not None else None
+
+        return {
+            "ready": self.ready,
+            "error": self.error,
+            "bound_secs": since_start(self._bound_at),
+            "ready_secs": since_start(self._ready_at),
+            "phases": list(self._phases),
+        }
+
+
+# Ein Bericht pro Prozess
+boot = BootReport()
@@ -0,0 +1,190 @@
+#
+# Stille nicht zu Deepgram streamen
+#
+# Bisher geht jeder 20ms Frame des Anrufers für die ganze Dauer des Anrufs an
+# Deepgram, auch lange Pausen und Wartezeiten. Der Gate-Modus richtet sich
+# nach der VAD im Transport:
+#
+#   Sprache (VAD Start bis VAD Stop plus `hangover_secs`): Audio geht raus
+#   Stille: Audio wird nur im Pre-Roll Puffer (`preroll_secs`) gehalten,
+#           alle `keepalive_secs` geht ein KeepAlive statt Audio raus
+#
+# Beim VAD Start wird zuerst der Pre-Roll gesendet, weil die VAD erst nach
+# `start_secs` (0.2s) anschlägt. So wird der Anfang eines Wortes nie
+# abgeschnitten. Der Nachlauf deckt das Finalize am Ende der Nutzer-Sprache
+# ab. Die Zeitstempel in den Deepgram Ergebnissen beziehen sich danach auf
+# das gesendete Audio, nicht mehr auf die Anrufdauer.
+#
+# Gesendete und unterdrückte Bytes stehen pro Anruf im Log und gesamt unter
+# /health (stt_gate).
+#
+
+"""Stille nicht zu Deepgram streamen."""
+
+import time
+from typing import Any, Dict, Optional
+
+from loguru import logger
+from pipecat.frames.frames import (
+    AudioRawFrame,
+    CancelFrame,
+    EndFrame,
+    Frame,
+    InputAudioRawFrame,
+    VADUserStartedSpeakingFrame,
+    VADUserStoppedSpeakingFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection
+
+from voice_assistant_memory import AudioRing, buffer_pool
+from voice_assistant_telephony import CallerDeepgramSTTService
+
+
+class STTGateStats:
+    """Prozessweite Zähler für /health."""
+
+    def __init__(self):
+        """Leere Statistik."""
+        self.calls = 0
+        self.bytes_sent = 0
+        self.bytes_suppressed = 0
+        self.keepalives = 0
+
+    def observe_call(self, sent: int, suppressed: int, keepalives: int):
+        """Bytes eines beendeten Anrufs zählen."""
+        self.calls += 1
+        self.bytes_sent += sent
+        self.bytes_suppressed += suppressed
+        self.keepalives += keepalives
+
+    def stats(self) -> Dict[str, Any]:
+        """Zusammenfassung für /health."""
+        total = self.bytes_sent + self.bytes_suppressed
+        return {
+            "calls": self.calls,
+            "bytes_sent": self.bytes_sent,
+            "bytes_suppressed": self.bytes_suppressed,
+            "suppressed_ratio": round(self.bytes_suppressed / total, 3) if total else None,
+            "keepalives": self.keepalives,
+        }
+
+
+class GatedDeepgramSTTService(CallerDeepgramSTTService):
+    """Deepgram STT, das nur während Sprache (plus Pre-Roll und Nachlauf) Audio sendet."""
+
+    def __init__(
+        self,
+        *,
+        preroll_secs: float = 0.5,
+        hangover_secs: float = 1.0,
+        keepalive_secs: float = 4.0,
+        call_sid: str = "",
+        stats: Optional[STTGateStats] = None,
+        **kwargs,
+    ):
+        """preroll_secs vor und hangover_secs nach der Sprache gehen an Deepgram."""
+        super().__init__(**kwargs)
+        self._preroll_secs = preroll_secs
+        self._hangover_secs = hangover_secs
+        self._keepalive_secs = keepalive_secs
+        self._call_sid = call_sid
+        self._gate_stats = stats or stt_gate_stats
+
+        self._speaking = False
+        self._stopped_at = float("-inf")
+        # Pre-Roll als Bytes in einem Pool-Buffer statt als Frame-Objekte
+        self._preroll: Optional[AudioRing] = None
+        self._last_sent_at = time.monotonic()
+        self._bytes_sent = 0
+        self._bytes_suppressed = 0
+        self._keepalives = 0
+        # Nach stop/cancel: Zähler gemeldet, Pre-Roll freigegeben
+        self._closed = False
+
+    @property
+    def buffered_bytes(self) -> int:
+        """Audio im Vorlauf."""
+        return len(self._preroll) if self._preroll is not None else 0
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        """VAD Frames setzen den Zustand des Gates."""
+        if isinstance(frame, VADUserStartedSpeakingFrame):
+            self._speaking = True
+        elif isinstance(frame, VADUserStoppedSpeakingFrame):
+            self._speaking = False
+            self._stopped_at = time.monotonic()
+        await super().process_frame(frame, direction)
+
+    async def process_audio_frame(self, frame: AudioRawFrame, direction: FrameDirection):
+        """Audio nur während Sprache senden, sonst puffern oder KeepAlive."""
+        # Spätes Audio nach stop/cancel würde einen neuen Pre-Roll anlegen
+        if not isinstance(frame, InputAudioRawFrame) or self._closed:
+            return
+
+        now = time.monotonic()
+        if self._speaking or now - self._stopped_at < self._hangover_secs:
+            # Pre-Roll zuerst (in einem Stück), damit der Wortanfang dabei ist
+            if self._preroll is not None and len(self._preroll):
+                preroll = InputAudioRawFrame(
+                    audio=self._preroll.read(),
+                    sample_rate=frame.sample_rate,
+                    num_channels=frame.num_channels,
+                )
+                await self._send(preroll, direction)
+            await self._send(frame, direction)
+            self._last_sent_at = now
+            return
+
+        if self._preroll is None:
+            frame_bytes = frame.num_channels * 2
+            capacity = int(self._preroll_secs * frame.sample_rate) * frame_bytes
+            self._preroll = AudioRing(buffer_pool, max(capacity, frame_bytes))
+        self._bytes_suppressed += self._preroll.write(frame.audio)
+
+        # Deepgram schließt die Verbindung nach 10s ohne Audio oder KeepAlive
+        if now - self._last_sent_at >= self._keepalive_secs:
+            self._last_sent_at = now
+            await self._keep_alive()
+
+    async def _send(self, frame: InputAudioRawFrame, direction: FrameDirection):
+        self._bytes_sent += len(frame.audio)
+        await super().process_audio_frame(frame, direction)
+
+    async def _keep_alive(self):
+        try:
+            if self._connection and await self._connection.keep_alive():
+                self._keepalives += 1
+        except Exception as e:
+            logger.debug(f"{self}: KeepAlive fehlgeschlagen: {e}")
+
+    def _report(self):
+        if self._closed:
+            return
+        self._closed = True
+        # Was noch im Pre-Roll liegt, wurde nie gesendet
+        if self._preroll is not None:
+            self._bytes_suppressed += len(self._preroll)
+            self._preroll.close()
+            self._preroll = None
+        self._gate_stats.observe_call(self._bytes_sent, self._bytes_suppressed, self._keepalives)
+        total = self._bytes_sent + self._bytes_suppressed
+        if total:
+            logger.info(
+                f"STT Gate {self._call_sid}: {self._bytes_sent} Bytes gesendet, "
+                f"{self._bytes_suppressed} unterdrückt ({self._bytes_suppressed / total:.0%}), "
+                f"{self._keepalives} KeepAlives"
+            )
+
+    async def stop(self, frame: EndFrame):
+        """Zähler melden, dann stoppen."""
+        self._report()
+        await super().stop(frame)
+
+    async def cancel(self, frame: CancelFrame):
+        """Zähler melden, dann abbrechen."""
+        self._report()
+        await super().cancel(frame)
+
+
+# Ein Zähler pro Prozess, wird von allen Anrufen geteilt
+stt_gate_stats = STTGateStats()
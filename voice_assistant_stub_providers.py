@@ -0,0 +1,428 @@
+#
+# Lokale Stand-ins für Deepgram, OpenAI und ElevenLabs
+#
+# Sprechen dieselben Protokolle wie die echten Dienste (Deepgram Live
+# WebSocket und Aura REST, OpenAI Chat Completions Streaming, ElevenLabs
+# multi-stream-input WebSocket und HTTP), antworten aber mit festen Texten und
+# einstellbaren Latenzen. Mit `stall_rate` hängt ein Teil der Erstantworten
+# zusätzlich `stall_ms` lang (für Hedging-Tests). Damit lassen sich Kapazitätstests ohne API Keys und Netzwerk
+# fahren, z.B. in CI.
+#
+# Standalone: python voice_assistant_stub_providers.py --port 9000 --profile typical
+#
+
+"""Lokale Stand-ins für Deepgram, OpenAI und ElevenLabs."""
+
+import argparse
+import asyncio
+import audioop
+import base64
+import itertools
+import json
+import math
+import random
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Dict, List
+from urllib.parse import parse_qs, urlparse
+
+from aiohttp import WSMsgType, web
+from loguru import logger
+from websockets.asyncio.server import ServerConnection, serve
+from websockets.exceptions import ConnectionClosed
+
+# Feste Antworten, reihum verwendet
+STUB_TRANSCRIPTS = [
+    "Wann haben Sie heute geöffnet?",
+    "Kann ich am Samstag einen Termin bekommen?",
+    "Ich hätte gerne einen kostenlosen Kostenvoranschlag.",
+    "Gibt es einen Notdienst am Wochenende?",
+]
+
+STUB_REPLIES = [
+    "Na ja, wir haben Montag bis Freitag von acht bis siebzehn Uhr geöffnet.",
+    "Am Wochenende haben wir leider geschlossen, aber jemand wird Sie zurückrufen.",
+    "Gerne, darf ich Ihren Namen und Ihre Telefonnummer haben?",
+]
+
+# Schwelle für "Sprache" im empfangenen linear16 Audio des Deepgram Stubs
+SPEECH_RMS_THRESHOLD = 500
+
+
+@dataclass
+class LatencyProfile:
+    """Latenzen der Stub-Dienste in Millisekunden."""
+
+    stt_interim_ms: float = 300
+    stt_final_ms: float = 150
+    llm_first_token_ms: float = 400
+    llm_token_ms: float = 25
+    tts_first_byte_ms: float = 250
+    # Wie schnell TTS Audio geliefert wird (2.0 = doppelte Echtzeit)
+    tts_speed: float = 2.0
+    jitter: float = 0.1
+    # Anteil der Erstantworten (erstes Token, erstes Audio), die zusätzlich hängen
+    stall_rate: float = 0.0
+    stall_ms: float = 3000
+
+    def delay(self, ms: float) -> float:
+        """Latenz in Sekunden mit zufälligem Jitter."""
+        return max(0.0, ms * (1 + random.uniform(-self.jitter, self.jitter))) / 1000
+
+    def first_delay(self, ms: float) -> float:
+        """Latenz bis zur Erstantwort, gelegentlich mit Hänger."""
+        stall = self.stall_ms / 1000 if random.random() < self.stall_rate else 0.0
+        return self.delay(ms) + stall
+
+
+LATENCY_PROFILES: Dict[str, LatencyProfile] = {
+    "fast": LatencyProfile(
+        stt_interim_ms=150,
+        stt_final_ms=50,
+        llm_first_token_ms=150,
+        llm_token_ms=10,
+        tts_first_byte_ms=100,
+        tts_speed=4.0,
+    ),
+    "typical": LatencyProfile(),
+    "slow": LatencyProfile(
+        stt_interim_ms=600,
+        stt_final_ms=400,
+        llm_first_token_ms=1200,
+        llm_token_ms=60,
+        tts_first_byte_ms=700,
+        tts_speed=1.2,
+        jitter=0.3,
+    ),
+    # Wie typical, aber jede zehnte Erstantwort hängt 3 Sekunden
+    "flaky": LatencyProfile(stall_rate=0.1, stall_ms=3000),
+}
+
+
+def _synthesize_audio(text: str, output_format: str) -> bytes:
+    """Erzeugt hörbares Platzhalter-Audio (~65ms pro Zeichen) im gewünschten Format."""
+    sample_rate = int(output_format.split("_")[1])
+    num_samples = int(len(text) * 0.065 * sample_rate)
+    pcm = bytearray()
+    for i in range(num_samples):
+        t = i / sample_rate
+        value = 6000 * math.sin(2 * math.pi * 180 * t) * (0.6 + 0.4 * math.sin(2 * math.pi * 4 * t))
+        pcm += int(value).to_bytes(2, "little", signed=True)
+    if output_format.startswith("ulaw"):
+        return audioop.lin2ulaw(bytes(pcm), 2)
+    return bytes(pcm)
+
+
+def _alignment(text: str, duration_ms: float) -> Dict[str, List]:
+    """Zeichen-Alignment wie von ElevenLabs (gleichmäßig verteilt)."""
+    step = duration_ms / max(1, len(text))
+    return {
+        "chars": list(text),
+        "charStartTimesMs": [int(i * step) for i in range(len(text))],
+        "charDurationsMs": [int(step)] * len(text),
+    }
+
+
+def _deepgram_result(transcript: str, *, is_final: bool, start: float, duration: float) -> str:
+    return json.dumps(
+        {
+            "type": "Results",
+            "channel_index": [0, 1],
+            "duration": duration,
+            "start": start,
+            "is_final": is_final,
+            "speech_final": is_final,
+            "channel": {
+                "alternatives": [{"transcript": transcript, "confidence": 0.99, "words": []}]
+            },
+            "metadata": {
+                "request_id": str(uuid.uuid4()),
+                "model_info": {"name": "stub", "version": "0", "arch": "stub"},
+                "model_uuid": "stub",
+            },
+        }
+    )
+
+
+class StubProviders:
+    """Endpunkte der drei Stub-Dienste.
+
+    OpenAI und ElevenLabs laufen als aiohttp App. Deepgram läuft auf einem
+    eigenen `websockets` Server (Port + 1), weil das Deepgram SDK den
+    User-Agent Header doppelt sendet und aiohttp solche Requests ablehnt.
+    """
+
+    def __init__(self, profile: LatencyProfile):
+        """Provider mit den Latenzen aus profile."""
+        self._profile = profile
+        self._transcripts = itertools.cycle(STUB_TRANSCRIPTS)
+        self._replies = itertools.cycle(STUB_REPLIES)
+        self.requests = {
+            "stt_streams": 0,
+            "llm_completions": 0,
+            "tts_streams": 0,
+            "tts_http": 0,
+            "tts_deepgram": 0,
+        }
+
+    def create_app(self) -> web.Application:
+        """Erzeugt die aiohttp Anwendung."""
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self._openai_chat_completions)
+        app.router.add_get(
+            "/v1/text-to-speech/{voice_id}/multi-stream-input", self._elevenlabs_stream
+        )
+        app.router.add_post("/v1/text-to-speech/{voice_id}", self._elevenlabs_http)
+        app.router.add_post("/v1/speak", self._deepgram_speak)
+        return app
+
+    #
+    # Deepgram Live Transcription
+    #
+
+    async def deepgram_listen(self, ws: ServerConnection):
+        """Deepgram Live WebSocket (/v1/listen), läuft auf einem eigenen Port."""
+        self.requests["stt_streams"] += 1
+
+        query = parse_qs(urlparse(ws.request.path).query)
+        sample_rate = int(query.get("sample_rate", ["8000"])[0])
+        bytes_per_sec = sample_rate * 2
+        stream_secs = 0.0
+        speech_secs = 0.0
+        silence_secs = 0.0
+        interim_sent = False
+        transcript = next(self._transcripts)
+
+        async def send_final():
+            nonlocal speech_secs, silence_secs, interim_sent, transcript
+            if speech_secs <= 0:
+                return
+            final = transcript
+            start = stream_secs - speech_secs - silence_secs
+            duration = speech_secs
+            speech_secs = 0.0
+            silence_secs = 0.0
+            interim_sent = False
+            transcript = next(self._transcripts)
+            await asyncio.sleep(self._profile.delay(self._profile.stt_final_ms))
+            await ws.send(_deepgram_result(final, is_final=True, start=start, duration=duration))
+
+        try:
+            async for message in ws:
+                if isinstance(message, bytes):
+                    chunk_secs = len(message) / bytes_per_sec
+                    stream_secs += chunk_secs
+                    if audioop.rms(message, 2) >= SPEECH_RMS_THRESHOLD:
+                        speech_secs += chunk_secs
+                        silence_secs = 0.0
+                    elif speech_secs > 0:
+                        silence_secs += chunk_secs
+                        # Endpointing, falls kein Finalize kommt
+                        if silence_secs >= 1.0:
+                            await send_final()
+                    if speech_secs * 1000 >= self._profile.stt_interim_ms and not interim_sent:
+                        interim_sent = True
+                        words = transcript.split()
+                        partial = " ".join(words[: max(1, len(words) // 2)])
+                        await ws.send(
+                            _deepgram_result(
+                                partial, is_final=False, start=stream_secs, duration=speech_secs
+                            )
+                        )
+                else:
+                    message_type = json.loads(message).get("type")
+                    if message_type == "Finalize":
+                        await send_final()
+                    elif message_type == "CloseStream":
+                        break
+        except ConnectionClosed:
+            pass
+
+    #
+    # OpenAI Chat Completions (Streaming)
+    #
+
+    async def _openai_chat_completions(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests["llm_completions"] += 1
+        reply = next(self._replies)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "stub")
+
+        def chunk(delta: Dict, finish_reason=None) -> bytes:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            return f"data: {json.dumps(data)}\n\n".encode("utf-8")
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        try:
+            await asyncio.sleep(self._profile.first_delay(self._profile.llm_first_token_ms))
+            await response.write(chunk({"role": "assistant", "content": ""}))
+            for i, word in enumerate(reply.split(" ")):
+                if i > 0:
+                    await asyncio.sleep(self._profile.delay(self._profile.llm_token_ms))
+                await response.write(chunk({"content": word if i == 0 else f" {word}"}))
+            await response.write(chunk({}, finish_reason="stop"))
+            await response.write(b"data: [DONE]\n\n")
+            await response.write_eof()
+        except ConnectionResetError:
+            # Abgebrochene Streams (z.B. verworfene Spekulationen)
+            pass
+        return response
+
+    #
+    # ElevenLabs
+    #
+
+    async def _elevenlabs_stream(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self.requests["tts_streams"] += 1
+        output_format = request.query.get("output_format", "pcm_8000")
+        closed_contexts = set()
+
+        async def synthesize(context_id: str, text: str, first: bool):
+            if first:
+                await asyncio.sleep(self._profile.first_delay(self._profile.tts_first_byte_ms))
+            else:
+                await asyncio.sleep(self._profile.delay(self._profile.tts_first_byte_ms))
+            audio = _synthesize_audio(text, output_format)
+            bytes_per_sec = int(output_format.split("_")[1]) * (
+                1 if output_format.startswith("ulaw") else 2
+            )
+            duration_ms = len(audio) / bytes_per_sec * 1000
+            chunk_size = bytes_per_sec // 5  # 200ms Stücke
+            for i in range(0, len(audio), chunk_size):
+                if ws.closed or context_id in closed_contexts:
+                    return
+                message = {
+                    "audio": base64.b64encode(audio[i : i + chunk_size]).decode("utf-8"),
+                    "contextId": context_id,
+                }
+                if i == 0:
+                    message["alignment"] = _alignment(text, duration_ms)
+                await ws.send_str(json.dumps(message))
+                await asyncio.sleep(0.2 / self._profile.tts_speed)
+
+        # Texte eines Kontexts werden nacheinander synthetisiert
+        queues: Dict[str, asyncio.Queue] = {}
+        workers = []
+
+        async def context_worker(context_id: str, queue: asyncio.Queue):
+            first = True
+            while True:
+                text = await queue.get()
+                await synthesize(context_id, text, first)
+                first = False
+
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                break
+            data = json.loads(msg.data)
+            if data.get("close_socket"):
+                break
+            context_id = data.get("context_id")
+            if not context_id:
+                continue
+            if data.get("close_context"):
+                closed_contexts.add(context_id)
+                await ws.send_str(json.dumps({"isFinal": True, "contextId": context_id}))
+                continue
+            text = data.get("text", "")
+            if not text.strip():
+                continue
+            if context_id not in queues:
+                queues[context_id] = asyncio.Queue()
+                workers.append(asyncio.create_task(context_worker(context_id, queues[context_id])))
+            queues[context_id].put_nowait(text)
+
+        for worker in workers:
+            worker.cancel()
+        await ws.close()
+        return ws
+
+    async def _elevenlabs_http(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        self.requests["tts_http"] += 1
+        output_format = request.query.get("output_format", "mp3_44100_128")
+        if output_format.startswith("mp3"):
+            output_format = "pcm_22050"
+        await asyncio.sleep(self._profile.first_delay(self._profile.tts_first_byte_ms))
+        return web.Response(
+            body=_synthesize_audio(body.get("text", ""), output_format),
+            content_type="application/octet-stream",
+        )
+
+    #
+    # Deepgram Aura (REST)
+    #
+
+    async def _deepgram_speak(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        self.requests["tts_deepgram"] += 1
+        sample_rate = int(request.query.get("sample_rate", "24000"))
+        encoding = "ulaw" if request.query.get("encoding") == "mulaw" else "pcm"
+        audio = _synthesize_audio(body.get("text", ""), f"{encoding}_{sample_rate}")
+        bytes_per_sec = sample_rate * (1 if encoding == "ulaw" else 2)
+        chunk_size = bytes_per_sec // 5  # 200ms Stücke
+
+        response = web.StreamResponse(headers={"Content-Type": "application/octet-stream"})
+        await response.prepare(request)
+        try:
+            await asyncio.sleep(self._profile.first_delay(self._profile.tts_first_byte_ms))
+            for i in range(0, len(audio), chunk_size):
+                await response.write(audio[i : i + chunk_size])
+                await asyncio.sleep(0.2 / self._profile.tts_speed)
+            await response.write_eof()
+        except ConnectionResetError:
+            # Verlorene Hedging-Anfragen werden abgebrochen
+            pass
+        return response
+
+
+async def start_stub_providers(host: str, port: int, profile: LatencyProfile):
+    """Startet die Stub-Dienste im laufenden Event Loop (Deepgram auf port + 1)."""
+    stubs = StubProviders(profile)
+    runner = web.AppRunner(stubs.create_app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    deepgram_server = await serve(stubs.deepgram_listen, host, port + 1)
+    logger.info(f"Stub Provider laufen auf http://{host}:{port} (Deepgram: {port + 1})")
+    return runner, deepgram_server
+
+
+def stub_provider_env(host: str, port: int) -> Dict[str, str]:
+    """Umgebungsvariablen, mit denen der Server die Stub-Dienste statt der echten nutzt."""
+    base_url = f"http://{host}:{port}"
+    return {
+        "DEEPGRAM_BASE_URL": f"http://{host}:{port + 1}",
+        "DEEPGRAM_TTS_BASE_URL": base_url,
+        "OPENAI_BASE_URL": f"{base_url}/v1",
+        "ELEVENLABS_API_URL": base_url,
+        "DEEPGRAM_API_KEY": "stub",
+        "OPENAI_API_KEY": "stub",
+        "ELEVENLABS_API_KEY": "stub",
+    }
+
+
+async def _main(host: str, port: int, profile: str):
+    await start_stub_providers(host, port, LATENCY_PROFILES[profile])
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lokale Stub-Dienste für Lasttests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--profile", choices=sorted(LATENCY_PROFILES), default="typical")
+    args = parser.parse_args()
+
+    asyncio.run(_main(args.host, args.port, args.profile))
@@ -0,0 +1,138 @@
+#
+# Telefonie-Fast-Path für 8kHz μ-law
+#
+# Twilio liefert und erwartet 8kHz μ-law, die Pipeline läuft mit 8kHz PCM.
+# Statt bei jedem Frame den (bei gleicher Rate wirkungslosen) Resampler zu
+# durchlaufen, wird hier direkt einmal dekodiert bzw. kodiert. ElevenLabs
+# liefert μ-law statt PCM, das halbiert die Datenmenge pro Anruf.
+#
+# Deepgram bekommt nur das Audio des Anrufers, nicht die über den Pipeline
+# Anfang eingespielte Begrüßung.
+#
+# Beim Barge-in schaltet der Serializer die Audio-Ausgabe sofort stumm, bis die
+# Unterbrechung der Pipeline den Output Transport erreicht hat (oder
+# `BARGE_IN_MUTE_SECS` vergangen sind).
+#
+# media Nachrichten werden mit dem Codec aus voice_assistant_twilio_codec.py
+# gelesen und geschrieben statt über json/base64.
+#
+
+"""Telefonie-Fast-Path für 8kHz μ-law."""
+
+import audioop
+import time
+from typing import Callable, Optional
+
+from pipecat.frames.frames import (
+    AudioRawFrame,
+    Frame,
+    InputAudioRawFrame,
+    InterruptionFrame,
+    TTSAudioRawFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection
+from pipecat.serializers.twilio import TwilioFrameSerializer
+
+from voice_assistant_connections import PooledDeepgramSTTService, PooledElevenLabsTTSService
+from voice_assistant_twilio_codec import MediaEncoder, decode_media
+
+TELEPHONY_SAMPLE_RATE = 8000
+
+# Obergrenze der Stummschaltung, falls die Unterbrechung nie am Output ankommt
+BARGE_IN_MUTE_SECS = 1.0
+
+
+class TelephonyFrameSerializer(TwilioFrameSerializer):
+    """Twilio Serializer ohne Resampler-Umweg, wenn Pipeline und Twilio 8kHz nutzen."""
+
+    def __init__(self, *args, **kwargs):
+        """Wie TwilioFrameSerializer."""
+        super().__init__(*args, **kwargs)
+        self._muted_until = 0.0
+        self._on_interrupted: Optional[Callable[[], None]] = None
+        self._encoder = MediaEncoder(self._stream_sid)
+
+    def _native_rate(self, sample_rate: int) -> bool:
+        return sample_rate == self._twilio_sample_rate == TELEPHONY_SAMPLE_RATE
+
+    def barge_in(self, on_interrupted: Optional[Callable[[], None]] = None) -> dict:
+        """Audio stummschalten bis zur Unterbrechung, liefert die Twilio `clear` Nachricht."""
+        self._muted_until = time.monotonic() + BARGE_IN_MUTE_SECS
+        self._on_interrupted = on_interrupted
+        return {"event": "clear", "streamSid": self._stream_sid}
+
+    async def serialize(self, frame: Frame) -> str | bytes | None:
+        """Frame für Twilio kodieren, μ-law ohne Umweg."""
+        if isinstance(frame, InterruptionFrame):
+            # Warteschlangen im Output sind jetzt geleert
+            self._muted_until = 0.0
+            on_interrupted, self._on_interrupted = self._on_interrupted, None
+            if on_interrupted:
+                on_interrupted()
+            return self._encoder.clear()
+        elif isinstance(frame, AudioRawFrame) and self._muted_until:
+            if time.monotonic() < self._muted_until:
+                return None
+            self._muted_until = 0.0
+        if isinstance(frame, AudioRawFrame) and self._native_rate(frame.sample_rate):
+            return self._serialize_ulaw(audioop.lin2ulaw(frame.audio, 2))
+        return await super().serialize(frame)
+
+    def _serialize_ulaw(self, ulaw: bytes) -> str | None:
+        if not ulaw:
+            return None
+        # Gleiche Nachricht wie TwilioFrameSerializer, nur ohne Resampling
+        return self._encoder.media(ulaw)
+
+    async def deserialize(self, data: str | bytes) -> Frame | None:
+        """Twilio Nachricht dekodieren, μ-law ohne Umweg."""
+        if not self._native_rate(self._sample_rate):
+            return await super().deserialize(data)
+
+        payload = decode_media(data)
+        if payload is None:
+            # Andere Events (dtmf, mark, stop) und unerwartete Formen über JSON
+            return await super().deserialize(data)
+        if not payload:
+            return None
+        return InputAudioRawFrame(
+            audio=audioop.ulaw2lin(payload, 2),
+            num_channels=1,
+            sample_rate=TELEPHONY_SAMPLE_RATE,
+        )
+
+
+class UlawElevenLabsTTSService(PooledElevenLabsTTSService):
+    """ElevenLabs WebSocket TTS, das bei 8kHz ulaw_8000 statt pcm_8000 anfordert.
+
+    Pipecat leitet das Format sonst aus der Sample-Rate ab (pcm_8000). μ-law
+    ist halb so groß und für Twilio ohnehin das Zielformat, dekodiert wird
+    einmalig beim Empfang.
+    """
+
+    async def _connect_websocket(self):
+        if self.sample_rate == TELEPHONY_SAMPLE_RATE:
+            self._output_format = "ulaw_8000"
+        await super()._connect_websocket()
+
+    async def append_to_audio_context(self, context_id: str, frame: TTSAudioRawFrame):
+        """μ-law von ElevenLabs als PCM anhängen."""
+        if self._output_format == "ulaw_8000":
+            frame.audio = audioop.ulaw2lin(frame.audio, 2)
+            frame.num_frames = len(frame.audio) // 2
+        await super().append_to_audio_context(context_id, frame)
+
+
+class CallerDeepgramSTTService(PooledDeepgramSTTService):
+    """Deepgram STT, das nur Anrufer-Audio (InputAudioRawFrame) transkribiert.
+
+    Die vorgerenderte Begrüßung wird am Pipeline Anfang eingespielt und läuft
+    als TTSAudioRawFrame durch den STT Service. Ohne diesen Filter landet sie
+    bei Deepgram und erzeugt Transkripte der eigenen Ansage.
+    """
+
+    async def process_audio_frame(self, frame: AudioRawFrame, direction: FrameDirection):
+        """Nur Input Audio an Deepgram senden."""
+        if not isinstance(frame, InputAudioRawFrame):
+            return
+        await super().process_audio_frame(frame, direction)
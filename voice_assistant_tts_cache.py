@@ -0,0 +1,550 @@
+#
+# Satz-basierter TTS Cache mit LRU im Speicher und memory-mapped Disk-Speicher
+#
+# Ellie wiederholt viele Sätze (Geschäftszeiten, Rückruf, Name und Telefon).
+# Bereits gerenderte Sätze werden als μ-law Audio direkt an transport.output()
+# gestreamt, statt sie bei jedem Anruf erneut über ElevenLabs zu synthetisieren.
+#
+
+"""Satz-basierter TTS Cache mit LRU im Speicher und memory-mapped Disk-Speicher."""
+
+import asyncio
+import audioop
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Set
+
+from loguru import logger
+from pipecat.frames.frames import (
+    Frame,
+    InterruptionFrame,
+    LLMFullResponseEndFrame,
+    LLMFullResponseStartFrame,
+    LLMTextFrame,
+    TTSAudioRawFrame,
+    TTSStartedFrame,
+    TTSStoppedFrame,
+    TTSTextFrame,
+)
+from pipecat.processors.frame_processor import FrameDirection, FrameProcessor
+from pipecat.utils.text.base_text_aggregator import BaseTextAggregator
+from pipecat.utils.text.simple_text_aggregator import SimpleTextAggregator
+
+from voice_assistant_greeting import ULAW_SAMPLE_RATE, render_elevenlabs_audio
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_phrase(text: str) -> str:
+    """Normalisiert einen Satz für den Cache-Schlüssel (Satzzeichen bleiben, sie ändern die Betonung)."""
+    text = unicodedata.normalize("NFC", text)
+    return _WHITESPACE_RE.sub(" ", text).strip().casefold()
+
+
+class LRUAudioCache:
+    """Begrenzter In-Memory LRU Cache für μ-law Audio."""
+
+    def __init__(self, max_bytes: int):
+        """Höchstens max_bytes im Speicher."""
+        self._max_bytes = max_bytes
+        self._entries: "OrderedDict[str, bytes]" = OrderedDict()
+        self._size = 0
+        self.evictions = 0
+
+    @property
+    def size(self) -> int:
+        """Belegte Bytes."""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Liefert das Audio und markiert es als zuletzt benutzt."""
+        audio = self._entries.get(key)
+        if audio is not None:
+            self._entries.move_to_end(key)
+        return audio
+
+    def put(self, key: str, audio: bytes):
+        """Speichert das Audio und verdrängt die ältesten Einträge."""
+        if len(audio) > self._max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = audio
+        self._size += len(audio)
+        while self._size > self._max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+
+
+class MmapAudioStore:
+    """Append-only Datendatei mit JSON Index, gelesen über mmap.
+
+    Überschreitet die Datei `max_bytes`, wird sie kompaktiert: nur die zuletzt
+    benutzten Einträge (bis 75% des Limits) werden in eine neue Datei kopiert.
+
+    Alle Worker-Prozesse teilen sich das Verzeichnis. Anhängen, Kompaktieren
+    und Index schreiben laufen unter einem flock auf `phrases.lock`, davor
+    liest jeder Prozess den Index neu bzw. öffnet die Datendatei neu, falls ein
+    anderer Worker sie kompaktiert hat. Gelesen wird ohne flock: die eigene
+    mmap zeigt immer auf die Datei, zu der der eigene Index gehört.
+    """
+
+    COMPACT_RATIO = 0.75
+
+    def __init__(self, directory: str, max_bytes: int):
+        """Dateien in directory, höchstens max_bytes Audio."""
+        self._data_path = os.path.join(directory, "phrases.bin")
+        self._index_path = os.path.join(directory, "phrases.json")
+        self._lock_path = os.path.join(directory, "phrases.lock")
+        self._directory = directory
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: Dict[str, list] = {}  # key -> [offset, length, last_used]
+        self._index_stamp: Optional[tuple] = None
+        self._fd: Optional[int] = None
+        self._lock_fd: Optional[int] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._size = 0
+        self.evictions = 0
+
+    @property
+    def size(self) -> int:
+        """Größe der Datendatei in Bytes."""
+        return self._size
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Liest das Audio aus der gemappten Datei."""
+        # Läuft im Event Loop: während geschrieben oder kompaktiert wird, gilt
+        # der Zugriff als Fehlversuch statt den Loop zu blockieren
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            if self._fd is None:
+                try:
+                    self._open(blocking=False)
+                except BlockingIOError:
+                    return None
+            entry = self._index.get(key)
+            if not entry:
+                return None
+            offset, length, _ = entry
+            if self._mmap is None or offset + length > len(self._mmap):
+                self._remap()
+            entry[2] = time.time()
+            return self._mmap[offset : offset + length]
+        finally:
+            self._lock.release()
+
+    def put(self, key: str, audio: bytes):
+        """Hängt das Audio an (blockierend, im Executor aufrufen)."""
+        with self._lock:
+            self._open()
+            with self._file_lock():
+                # Ein anderer Worker kann angehängt oder kompaktiert haben
+                self._refresh()
+                if key in self._index:
+                    return
+                offset = self._append(audio)
+                self._size = offset + len(audio)
+                self._index[key] = [offset, len(audio), time.time()]
+                if self._size > self._max_bytes:
+                    self._compact()
+                self._remap()
+                self._save_index()
+
+    @contextmanager
+    def _file_lock(self, *, blocking: bool = True):
+        fcntl.flock(self._lock_fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+
+    def _open(self, *, blocking: bool = True):
+        if self._fd is not None:
+            return
+        os.makedirs(self._directory, exist_ok=True)
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self._lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._file_lock(blocking=blocking):
+            self._reopen()
+
+    def _reopen(self):
+        """Datendatei (neu) öffnen und den zugehörigen Index laden (unter dem flock)."""
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = os.open(self._data_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._size = os.fstat(self._fd).st_size
+        self._index = {}
+        self._load_index()
+        self._remap()
+
+    def _refresh(self):
+        """Stand der anderen Worker übernehmen (unter dem flock)."""
+        try:
+            data_inode = os.stat(self._data_path).st_ino
+        except FileNotFoundError:
+            data_inode = None
+        if data_inode != os.fstat(self._fd).st_ino:
+            self._reopen()
+            return
+        self._size = os.fstat(self._fd).st_size
+        if self._stat_index() != self._index_stamp:
+            self._load_index()
+
+    def _stat_index(self) -> Optional[tuple]:
+        try:
+            st = os.stat(self._index_path)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+    def _load_index(self):
+        self._index_stamp = self._stat_index()
+        if self._index_stamp is None:
+            return
+        try:
+            with open(self._index_path) as f:
+                index = json.load(f)
+        except Exception as e:
+            logger.warning(f"TTS Cache Index unlesbar, starte leer: {e}")
+            index = {}
+        # Einträge, die nicht (mehr) in der Datendatei liegen, verwerfen,
+        # eigene Zugriffszeiten behalten
+        for key, entry in index.items():
+            known = self._index.get(key)
+            if known and known[0] == entry[0] and known[1] == entry[1]:
+                entry[2] = max(entry[2], known[2])
+        self._index = {k: v for k, v in index.items() if v[0] + v[1] <= self._size}
+
+    def _append(self, audio: bytes) -> int:
+        """Schreibt ans Dateiende (O_APPEND) und gibt den Offset des Eintrags zurück."""
+        view = memoryview(audio)
+        written = 0
+        while written < len(view):
+            written += os.write(self._fd, view[written:])
+        return os.lseek(self._fd, 0, os.SEEK_CUR) - len(audio)
+
+    def _remap(self):
+        if self._mmap:
+            self._mmap.close()
+            self._mmap = None
+        if self._size > 0:
+            self._mmap = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+
+    def _compact(self):
+        budget = int(self._max_bytes * self.COMPACT_RATIO)
+        self._remap()
+        keep = sorted(self._index.items(), key=lambda item: item[1][2], reverse=True)
+        tmp_path = self._data_path + ".tmp"
+        index = {}
+        offset = 0
+        with open(tmp_path, "wb") as f:
+            for key, (old_offset, length, last_used) in keep:
+                if offset + length > budget:
+                    self.evictions += 1
+                    continue
+                f.write(self._mmap[old_offset : old_offset + length])
+                index[key] = [offset, length, last_used]
+                offset += length
+        self._mmap.close()
+        self._mmap = None
+        os.close(self._fd)
+        os.replace(tmp_path, self._data_path)
+        self._fd = os.open(self._data_path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self._index = index
+        self._size = offset
+
+    def _save_index(self):
+        tmp_path = self._index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+        self._index_stamp = self._stat_index()
+
+
+class PhraseTTSCache:
+    """Zweistufiger Cache für gerenderte Sätze (Speicher -> Disk).
+
+    Sätze werden erst gerendert, wenn sie `render_after` mal verfehlt wurden,
+    damit einmalige Antworten keine zusätzlichen TTS Kosten verursachen. Das
+    Rendern passiert im Hintergrund, nie im Audio-Pfad eines Anrufs.
+    """
+
+    def __init__(
+        self,
+        *,
+        directory: str,
+        max_memory_bytes: int = 16 * 1024 * 1024,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+        render_after: int = 2,
+        max_tracked_misses: int = 10000,
+    ):
+        """Speicher-Cache vor dem Store auf der Platte."""
+        self._memory = LRUAudioCache(max_memory_bytes)
+        self._disk = MmapAudioStore(directory, max_disk_bytes)
+        self._render_after = render_after
+        self._max_tracked_misses = max_tracked_misses
+        self._miss_counts: Dict[str, int] = {}
+        self._rendering: Set[str] = set()
+        self._render_tasks: Set[asyncio.Task] = set()
+        self._memory_hits = 0
+        self._disk_hits = 0
+        self._misses = 0
+        self._renders = 0
+
+    @staticmethod
+    def key(text: str, *, voice_id: str, model: str, output_format: str) -> str:
+        """Cache-Schlüssel aus normalisiertem Text und Stimmeinstellungen."""
+        raw = "\x00".join((normalize_phrase(text), voice_id, model, output_format))
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[bytes]:
+        """Sucht zuerst im Speicher, dann auf Disk (Treffer werden hochgestuft)."""
+        audio = self._memory.get(key)
+        if audio is not None:
+            self._memory_hits += 1
+            return audio
+        audio = self._disk.get(key)
+        if audio is not None:
+            self._disk_hits += 1
+            self._memory.put(key, audio)
+            return audio
+        self._misses += 1
+        return None
+
+    def record_miss(
+        self, key: str, text: str, *, api_key: str, voice_id: str, model: str, output_format: str
+    ):
+        """Zählt den Fehlversuch und startet bei Bedarf das Rendern im Hintergrund."""
+        if key in self._rendering:
+            return
+        if len(self._miss_counts) >= self._max_tracked_misses:
+            self._miss_counts.clear()
+        count = self._miss_counts.get(key, 0) + 1
+        self._miss_counts[key] = count
+        if count < self._render_after:
+            return
+        self._miss_counts.pop(key, None)
+        self._start_render(
+            key, text, api_key=api_key, voice_id=voice_id, model=model, output_format=output_format
+        )
+
+    async def prerender(
+        self,
+        text: str,
+        *,
+        api_key: str,
+        voice_id: str,
+        model: str,
+        output_format: str,
+        aggregator: Optional[BaseTextAggregator] = None,
+    ):
+        """Rendert die noch fehlenden Sätze eines festen Textes sofort (z.B. FAQ Antworten)."""
+        # Gleiche Aufteilung wie im TTSCacheProcessor, wenn der Text als ein
+        # einziger LLMTextFrame ankommt, sonst passen die Schlüssel nicht
+        aggregator = aggregator or SimpleTextAggregator()
+        sentences = [
+            s for s in [await aggregator.aggregate(text), aggregator.text] if s and s.strip()
+        ]
+        for sentence in sentences:
+            key = self.key(sentence, voice_id=voice_id, model=model, output_format=output_format)
+            if self._memory.get(key) is None and self._disk.get(key) is None:
+                self._start_render(
+                    key,
+                    sentence,
+                    api_key=api_key,
+                    voice_id=voice_id,
+                    model=model,
+                    output_format=output_format,
+                )
+
+    def _start_render(
+        self, key: str, text: str, *, api_key: str, voice_id: str, model: str, output_format: str
+    ):
+        if key in self._rendering:
+            return
+        self._rendering.add(key)
+        task = asyncio.create_task(
+            self._render(
+                key,
+                text.strip(),
+                api_key=api_key,
+                voice_id=voice_id,
+                model=model,
+                output_format=output_format,
+            )
+        )
+        self._render_tasks.add(task)
+        task.add_done_callback(self._render_tasks.discard)
+
+    async def _render(
+        self, key: str, text: str, *, api_key: str, voice_id: str, model: str, output_format: str
+    ):
+        try:
+            audio = await render_elevenlabs_audio(
+                text, api_key=api_key, voice_id=voice_id, model=model, output_format=output_format
+            )
+            self._memory.put(key, audio)
+            await asyncio.get_running_loop().run_in_executor(None, self._disk.put, key, audio)
+            self._renders += 1
+            logger.debug(f"TTS Cache: Satz gerendert ({len(audio)} Bytes): {text}")
+        except Exception as e:
+            logger.warning(f"TTS Cache: Satz konnte nicht gerendert werden: {e}")
+        finally:
+            self._rendering.discard(key)
+
+    def stats(self) -> Dict[str, Any]:
+        """Trefferquoten und Größen der beiden Stufen."""
+        lookups = self._memory_hits + self._disk_hits + self._misses
+        return {
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory.size,
+            "memory_evictions": self._memory.evictions,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self._disk.size,
+            "disk_evictions": self._disk.evictions,
+            "memory_hits": self._memory_hits,
+            "disk_hits": self._disk_hits,
+            "misses": self._misses,
+            "hit_rate": (self._memory_hits + self._disk_hits) / lookups if lookups else 0.0,
+            "renders": self._renders,
+        }
+
+
+class TTSCacheProcessor(FrameProcessor):
+    """Pipeline-Stufe vor dem TTS Service.
+
+    Fasst LLM Tokens zu Sätzen zusammen. Gecachte Sätze werden direkt als Audio
+    weitergereicht (der TTS Service lässt sie durch), alle anderen gehen an den
+    TTS Service. Nach dem ersten Fehlversuch einer Antwort geht der Rest der
+    Antwort an den TTS Service, damit die Reihenfolge des Audios erhalten bleibt.
+    """
+
+    def __init__(
+        self,
+        cache: PhraseTTSCache,
+        *,
+        api_key: str,
+        voice_id: str,
+        model: str,
+        output_format: str,
+        aggregator: Optional[BaseTextAggregator] = None,
+        **kwargs,
+    ):
+        """Prozessor vor dem TTS Service."""
+        super().__init__(**kwargs)
+        self._cache = cache
+        self._api_key = api_key
+        self._voice_id = voice_id
+        self._model = model
+        self._output_format = output_format
+        # Gleiche Aufteilung wie im TTS Service, sonst passen die Schlüssel nicht
+        self._aggregator = aggregator or SimpleTextAggregator()
+        # Solange True, werden Sätze aus dem Cache bedient
+        self._serving = False
+        # Ob in dieser Antwort Sätze aus dem Cache bzw. vom TTS Service kamen
+        self._served_from_cache = False
+        self._sent_to_tts = False
+
+    async def process_frame(self, frame: Frame, direction: FrameDirection):
+        """Bedient Sätze aus dem Cache oder reicht sie an den TTS Service weiter."""
+        await super().process_frame(frame, direction)
+
+        if isinstance(frame, LLMFullResponseStartFrame):
+            await self._aggregator.reset()
+            self._serving = True
+            self._served_from_cache = False
+            self._sent_to_tts = False
+            await self.push_frame(frame, direction)
+        elif isinstance(frame, LLMTextFrame) and not frame.skip_tts:
+            if self._serving:
+                sentence = await self._aggregator.aggregate(frame.text)
+                if sentence:
+                    await self._push_sentence(sentence)
+            else:
+                self._sent_to_tts = True
+                await self.push_frame(frame, direction)
+        elif isinstance(frame, LLMFullResponseEndFrame):
+            remaining = self._aggregator.text
+            await self._aggregator.reset()
+            if self._serving and remaining.strip():
+                await self._push_sentence(remaining)
+            self._serving = False
+            # Ganz aus dem Cache bediente Antworten: der TTS Service würde das
+            # Ende verschlucken, der Assistant Aggregator braucht es aber
+            if self._served_from_cache and not self._sent_to_tts:
+                frame.skip_tts = True
+            await self.push_frame(frame, direction)
+        elif isinstance(frame, InterruptionFrame):
+            await self._aggregator.handle_interruption()
+            self._serving = False
+            await self.push_frame(frame, direction)
+        else:
+            await self.push_frame(frame, direction)
+
+    async def _push_sentence(self, sentence: str):
+        key = self._cache.key(
+            sentence, voice_id=self._voice_id, model=self._model, output_format=self._output_format
+        )
+        audio = self._cache.get(key) if self._serving else None
+        if audio is None:
+            self._serving = False
+            self._sent_to_tts = True
+            self._cache.record_miss(
+                key,
+                sentence,
+                api_key=self._api_key,
+                voice_id=self._voice_id,
+                model=self._model,
+                output_format=self._output_format,
+            )
+            # Der Rest der Antwort geht direkt an den TTS Service, was der
+            # Aggregator noch zurückhält, muss deshalb jetzt mit
+            remaining = self._aggregator.text
+            await self._aggregator.reset()
+            await self.push_frame(LLMTextFrame(sentence + remaining))
+            return
+
+        self._served_from_cache = True
+        await self.push_frame(TTSStartedFrame())
+        # Audio anteilig (nach Zeichen) pro Wort, jedes Wort folgt seinem Audio.
+        # Nach einem Barge-in stehen so nur die gespielten Wörter im Kontext.
+        pcm = audioop.ulaw2lin(audio, 2)
+        words = sentence.split()
+        total_chars = sum(len(word) + 1 for word in words)
+        samples = len(pcm) // 2
+        offset = chars = 0
+        for word in words:
+            chars += len(word) + 1
+            end = samples * chars // total_chars * 2
+            await self.push_frame(
+                TTSAudioRawFrame(
+                    audio=pcm[offset:end], sample_rate=ULAW_SAMPLE_RATE, num_channels=1
+                )
+            )
+            offset = end
+            text_frame = TTSTextFrame(word)
+            text_frame.skip_tts = True
+            await self.push_frame(text_frame)
+        await self.push_frame(TTSStoppedFrame())
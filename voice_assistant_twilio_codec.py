@@ -0,0 +1,82 @@
+#
+# Schneller Codec für Twilio Media Streams Nachrichten
+#
+# Twilio schickt alle 20ms pro Anruf ein media Event als JSON Text mit 160
+# Bytes μ-law als base64, und genauso viele gehen zurück. Der allgemeine Weg
+# (json.loads, base64.b64decode, json.dumps) baut für jede Nachricht zwei
+# verschachtelte dicts mit allen Feldern (sequenceNumber, chunk, timestamp,
+# track), die nie gelesen werden. Bei 100 Anrufen pro Prozess sind das 10.000
+# Nachrichten pro Sekunde auf dem Event Loop.
+#
+# Eingehend: `"event"` und `"payload"` werden direkt im Text gesucht, der
+# base64 Abschnitt geht ohne Zwischenobjekte an binascii. Passt eine Nachricht
+# nicht in diese feste Form (anderes Event, Escapes, unbekannte Formatierung),
+# liefert der Codec None und der Serializer nimmt den JSON Weg.
+#
+# Ausgehend: pro Stream wird einmal eine Vorlage mit der (escapeten) StreamSid
+# gebaut, pro Frame kommt nur noch der base64 Text dazwischen.
+#
+# Vergleich mit dem JSON Weg: voice_assistant_codec_bench.py
+#
+
+"""Schneller Codec für Twilio Media Streams Nachrichten."""
+
+import binascii
+import json
+from typing import Optional, Tuple
+
+EVENT_KEY = '"event"'
+PAYLOAD_KEY = '"payload"'
+
+
+def _string_value(data: str, key: str, start: int = 0) -> Optional[Tuple[int, int]]:
+    """Start und Ende des String-Werts nach `key` ("key": "wert"), None wenn die Form nicht passt."""
+    index = data.find(key, start)
+    if index < 0:
+        return None
+    index += len(key)
+    quote = data.find('"', index)
+    if quote < 0 or data[index:quote].strip() != ":":
+        return None
+    end = data.find('"', quote + 1)
+    if end < 0 or data[end - 1] == "\\":
+        return None
+    return quote + 1, end
+
+
+def decode_media(data: str) -> Optional[bytes]:
+    """μ-law Bytes eines media Events, None für andere Events oder unerwartete Formen."""
+    if not isinstance(data, str):
+        return None
+    event = _string_value(data, EVENT_KEY)
+    if event is None or data[event[0] : event[1]] != "media":
+        return None
+    payload = _string_value(data, PAYLOAD_KEY, event[1])
+    if payload is None:
+        return None
+    try:
+        return binascii.a2b_base64(data[payload[0] : payload[1]])
+    except (binascii.Error, ValueError):
+        return None
+
+
+class MediaEncoder:
+    """Ausgehende Twilio Nachrichten eines Streams aus festen Vorlagen."""
+
+    __slots__ = ("_media_prefix", "_clear")
+
+    def __init__(self, stream_sid: str):
+        """Feste Teile der Nachrichten für stream_sid vorbereiten."""
+        stream_sid_json = json.dumps(stream_sid)
+        self._media_prefix = (
+            '{"event":"media","streamSid":' + stream_sid_json + ',"media":{"payload":"'
+        )
+        self._clear = '{"event":"clear","streamSid":' + stream_sid_json + "}"
+
+    def media(self, ulaw: bytes) -> str:
+        """Media Nachricht mit μ-law Audio."""
+        return self._media_prefix + binascii.b2a_base64(ulaw, newline=False).decode("ascii") + '"}}'
+
+    def clear(self) -> str:
+        """Clear Nachricht."""
+        return self._clear
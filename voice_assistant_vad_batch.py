@@ -0,0 +1,313 @@
+#
+# Gebündelte Silero VAD Inferenz über alle Anrufe eines Prozesses
+#
+# Bei 8 kHz fällt pro Anruf alle 32 ms ein Fenster mit 256 Samples an, jede
+# Silero Inferenz einzeln kostet vor allem Aufruf-Overhead. Die Engine
+# sammelt die Fenster aller Anrufe höchstens `max_wait_secs` lang (oder bis
+# `max_batch` erreicht ist) und rechnet sie in einem ONNX Aufruf. Der
+# rekurrente Zustand (RNN-State und Kontext) bleibt pro Anruf, wird für den
+# Aufruf gestapelt und danach wieder verteilt.
+#
+# Pro Anruf ist höchstens ein Fenster im selben Batch, weil jedes Fenster den
+# Zustand des vorherigen braucht. Die zusätzliche Latenz ist damit durch
+# `max_wait_secs` plus eine Inferenz begrenzt.
+#
+# Der Executor pro Anruf ersetzt den Thread, in dem Pipecat `analyze_audio`
+# aufruft: Die Fenster eines Audio-Frames gehen an die Engine, sobald alle
+# Wahrscheinlichkeiten da sind, läuft `analyze_audio` mit den fertigen Werten.
+# Dafür wartet kein Thread pro Anruf.
+#
+# Nach dem Anruf liegen eventuell noch Fenster in der Engine, die in den
+# Zustand des Analyzers schreiben. `close` verwirft ihre Ergebnisse und
+# meldet erst, wenn keines mehr übrig ist, dass der Analyzer frei ist.
+#
+
+"""Gebündelte Silero VAD Inferenz über alle Anrufe eines Prozesses."""
+
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+# Wie Pipecat: Silero Zustand regelmäßig zurücksetzen, sonst wächst der Speicher
+MODEL_RESET_SECS = 5.0
+
+
+class VADWindow:
+    """Ein Fenster eines Anrufs, das auf den nächsten Batch wartet."""
+
+    __slots__ = ("analyzer", "samples", "queued_at", "on_done")
+
+    def __init__(self, analyzer, samples: np.ndarray, on_done: Callable[[float], None]):
+        """Fenster eines Analyzers, on_done bekommt die Wahrscheinlichkeit."""
+        self.analyzer = analyzer
+        self.samples = samples
+        self.queued_at = time.perf_counter()
+        self.on_done = on_done
+
+
+class VADBatchEngine:
+    """Sammelt VAD Fenster aller Anrufe und rechnet sie gebündelt."""
+
+    def __init__(self, *, max_wait_secs: float = 0.005, max_batch: int = 64):
+        """Batch nach max_wait_secs oder bei max_batch Fenstern auswerten."""
+        self._max_wait_secs = max_wait_secs
+        self._max_batch = max_batch
+        self._cond = threading.Condition()
+        self._pending: List[VADWindow] = []
+        self._thread: Optional[threading.Thread] = None
+
+        self._batches = 0
+        self._windows = 0
+        self._max_batch_seen = 0
+        self._infer_secs = 0.0
+        self._wait_secs = 0.0
+        self._max_wait_seen = 0.0
+        self._failures = 0
+
+    def submit(self, analyzer, window: bytes, on_done: Callable[[float], None]):
+        """Reiht ein Fenster (16-bit PCM) ein, `on_done(confidence)` läuft im Engine-Thread."""
+        samples = np.frombuffer(window, np.int16).astype(np.float32) / 32768.0
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="vad-batch", daemon=True)
+                self._thread.start()
+            self._pending.append(VADWindow(analyzer, samples, on_done))
+            self._cond.notify()
+
+    def confidence(self, analyzer, window: bytes) -> float:
+        """Blockierende Variante für Aufrufer ohne Batch-Executor."""
+        done = threading.Event()
+        result = [0.0]
+
+        def on_done(confidence: float):
+            result[0] = confidence
+            done.set()
+
+        self.submit(analyzer, window, on_done)
+        done.wait()
+        return result[0]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                # Ab dem ältesten Fenster höchstens max_wait_secs sammeln
+                deadline = self._pending[0].queued_at + self._max_wait_secs
+                while len(self._pending) < self._max_batch:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+            self._infer(batch)
+
+    def _take_batch(self) -> List[VADWindow]:
+        """Ältestes Fenster pro Anruf mit gleicher Abtastrate, der Rest wartet."""
+        sample_rate = self._pending[0].analyzer.sample_rate
+        batch: List[VADWindow] = []
+        rest: List[VADWindow] = []
+        seen = set()
+        for window in self._pending:
+            analyzer = window.analyzer
+            if (
+                id(analyzer) in seen
+                or analyzer.sample_rate != sample_rate
+                or len(batch) >= self._max_batch
+            ):
+                rest.append(window)
+            else:
+                seen.add(id(analyzer))
+                batch.append(window)
+        self._pending = rest
+        return batch
+
+    def _infer(self, batch: List[VADWindow]):
+        started = time.perf_counter()
+        sample_rate = batch[0].analyzer.sample_rate
+        context_size = 64 if sample_rate == 16000 else 32
+        models = [w.analyzer.stream_model for w in batch]
+        try:
+            for model in models:
+                if not np.shape(model._context)[1]:
+                    model._context = np.zeros((1, context_size), dtype="float32")
+            x = np.concatenate(
+                [
+                    np.concatenate((m._context, w.samples[None, :]), axis=1)
+                    for m, w in zip(models, batch)
+                ]
+            )
+            state = np.concatenate([m._state for m in models], axis=1)
+            out, state = models[0].session.run(
+                None, {"input": x, "state": state, "sr": np.array(sample_rate, dtype="int64")}
+            )
+            confidences = out[:, 0]
+        except Exception as e:
+            self._failures += 1
+            logger.error(f"Gebündelte VAD Inferenz fehlgeschlagen: {e}")
+            confidences = np.zeros(len(batch), dtype=np.float32)
+            state = None
+
+        now = time.perf_counter()
+        wall = time.time()
+        for i, (model, window) in enumerate(zip(models, batch)):
+            if state is not None:
+                model._state = state[:, i : i + 1]
+                model._context = x[i : i + 1, -context_size:]
+                model._last_sr = sample_rate
+                model._last_batch_size = 1
+            analyzer = window.analyzer
+            if wall - analyzer.last_reset_time >= MODEL_RESET_SECS:
+                model.reset_states()
+                analyzer.last_reset_time = wall
+            self._wait_secs += started - window.queued_at
+            self._max_wait_seen = max(self._max_wait_seen, started - window.queued_at)
+
+        self._batches += 1
+        self._windows += len(batch)
+        self._max_batch_seen = max(self._max_batch_seen, len(batch))
+        self._infer_secs += now - started
+
+        for window, confidence in zip(batch, confidences):
+            try:
+                window.on_done(float(confidence))
+            except Exception as e:
+                logger.error(f"VAD Ergebnis konnte nicht zugestellt werden: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch-Größen und Zeiten für /health."""
+        return {
+            "batches": self._batches,
+            "windows": self._windows,
+            "avg_batch": round(self._windows / self._batches, 2) if self._batches else None,
+            "max_batch": self._max_batch_seen,
+            "pending": len(self._pending),
+            "avg_infer_ms": (
+                round(self._infer_secs / self._batches * 1000, 3) if self._batches else None
+            ),
+            "avg_wait_ms": round(self._wait_secs / self._windows * 1000, 3)
+            if self._windows
+            else None,
+            "max_wait_ms": round(self._max_wait_seen * 1000, 3),
+            "failures": self._failures,
+        }
+
+
+class BatchedVADExecutor(Executor):
+    """Executor eines Anrufs für `analyze_audio` mit gebündelter Inferenz.
+
+    Aufträge laufen in Reihenfolge: Erst wenn alle Fenster eines Audio-Frames
+    ausgewertet sind, läuft `analyze_audio` (Puffer, Lautstärke, Zustand) mit
+    den fertigen Wahrscheinlichkeiten, danach kommt der nächste Frame dran.
+    Nach `close` bleiben Ergebnisse aus der Engine ungenutzt.
+    """
+
+    def __init__(self, analyzer, engine: VADBatchEngine):
+        """Executor für einen Analyzer."""
+        self._analyzer = analyzer
+        self._engine = engine
+        self._lock = threading.Lock()
+        self._jobs: Deque[Tuple[Future, Callable, tuple]] = deque()
+        # Fenster dieses Executors, die noch in der Engine liegen
+        self._in_engine = 0
+        self._closed = False
+        self._on_idle: Optional[Callable[[], None]] = None
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        """Aufruf einreihen, Fenster gehen gebündelt an die Engine."""
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                future.cancel()
+                return future
+            self._jobs.append((future, fn, args))
+            if len(self._jobs) > 1:
+                return future
+        self._start(future, fn, args)
+        return future
+
+    def _start(self, future: Future, fn: Callable, args: tuple):
+        windows = self._analyzer.pending_windows(*args)
+        if not windows:
+            # Nur Puffern, ohne Inferenz
+            self._finish(future, fn, args)
+            return
+
+        with self._lock:
+            if self._closed:
+                return
+            self._in_engine += len(windows)
+        remaining = [len(windows)]
+
+        def on_done(confidence: float):
+            try:
+                if not self._closed:
+                    self._analyzer.add_confidence(confidence)
+                    remaining[0] -= 1
+                    if not remaining[0]:
+                        self._finish(future, fn, args)
+            finally:
+                self._window_done()
+
+        # Die Engine rechnet die Fenster eines Anrufs in Reihenfolge
+        for window in windows:
+            self._engine.submit(self._analyzer, window, on_done)
+
+    def _finish(self, future: Future, fn: Callable, args: tuple):
+        # Auch abgebrochene Aufträge auswerten, sonst passen Puffer und
+        # vorberechnete Wahrscheinlichkeiten nicht mehr zusammen
+        try:
+            result, error = fn(*args), None
+        except BaseException as e:
+            result, error = None, e
+        if future.set_running_or_notify_cancel():
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        with self._lock:
+            if self._closed:
+                return
+            self._jobs.popleft()
+            next_job = self._jobs[0] if self._jobs else None
+        if next_job:
+            self._start(*next_job)
+
+    def _window_done(self):
+        with self._lock:
+            self._in_engine -= 1
+            on_idle = self._on_idle if self._closed and not self._in_engine else None
+            if on_idle:
+                self._on_idle = None
+        if on_idle:
+            on_idle()
+
+    def close(self, on_idle: Callable[[], None]):
+        """Nach dem Anruf: Aufträge abbrechen, `on_idle` läuft ohne Fenster in der Engine."""
+        with self._lock:
+            self._closed = True
+            jobs, self._jobs = list(self._jobs), deque()
+            idle = not self._in_engine
+            if not idle:
+                self._on_idle = on_idle
+        for future, _, _ in jobs:
+            future.cancel()
+        if idle:
+            on_idle()
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False):
+        """Nichts zu tun, die Engine ist geteilt."""
+        pass
+
+
+# Eine Engine pro Prozess, wird von allen Anrufen geteilt
+vad_batch_engine = VADBatchEngine(
+    max_wait_secs=float(os.getenv("VAD_BATCH_WAIT_MS", "5")) / 1000,
+    max_batch=int(os.getenv("VAD_BATCH_MAX", "64")),
+)